@@ -1,11 +1,35 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, has_request_context, send_from_directory, stream_with_context
 from flask_cors import CORS
+import os
+import json
+import threading
 import time
 import logging
 import uuid
 import mysql.connector
 from mysql.connector import Error
 
+import async_server
+from catalog import CatalogSnapshot, Derived
+import change_feed
+import compression
+import db_routing
+from invalidation_bus import InvalidationBus
+import export
+from leaderboard import Leaderboard
+import level_history
+import machines
+from makeable import MakeableCache
+from order_cache import OrderCache, order_shape
+from order_journal import OrderJournal, PERMANENT_ERRORS, RecordNotReady
+from order_watch import OrderWatch
+import profiling
+import query_trace
+from recommendations import SimilarityMatrix
+import reviews_cache
+from search_index import MocktailSearchIndex, SORTS
+from single_flight import StaleWhileRevalidate
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -23,15 +47,236 @@ DB_CONFIG = {
     'database': 'mocktail_machine'
 }
 
-# Функция для получения соединения с базой данных
+# Реплики только для чтения (хосты через запятую, остальные параметры как у DB_CONFIG)
+DB_REPLICA_CONFIGS = [
+    dict(DB_CONFIG, host=host.strip())
+    for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()
+]
+db_router = db_routing.ReplicaRouter(
+    DB_CONFIG,
+    DB_REPLICA_CONFIGS,
+    connect=mysql.connector.connect,
+    max_lag=float(os.environ.get('DB_REPLICA_MAX_LAG', 5))
+)
+
+# Cookie с временем последней записи клиента (read-your-writes между воркерами)
+LAST_WRITE_COOKIE = 'mocktail_last_write'
+
+# Функция для получения соединения с базой данных (primary, для записи)
 def get_db_connection():
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        return connection
+        connection = db_router.primary()
+        return query_trace.wrap(connection)
+    except Error as e:
+        logger.error(f"Ошибка подключения к базе данных: {e}")
+        return None
+
+# Соединение для обработчиков только для чтения (реплика или primary)
+def get_read_connection(key=None):
+    try:
+        return query_trace.wrap(db_router.read(key, force_primary=client_wrote_recently()))
     except Error as e:
         logger.error(f"Ошибка подключения к базе данных: {e}")
         return None
 
+def client_wrote_recently():
+    # Фоновое обновление кэша идёт вне запроса
+    if not has_request_context():
+        return False
+    try:
+        last_write = float(request.cookies.get(LAST_WRITE_COOKIE, 0))
+    except ValueError:
+        return False
+    return time.time() - last_write < db_router.read_your_writes_window
+
+# Отмечаем запись, чтобы следующие чтения этого клиента шли на primary
+def note_write(key=None):
+    db_router.note_write(key)
+    g.db_write = True
+
+@app.after_request
+def remember_client_write(response):
+    if g.get('db_write') and db_router.replica_configs:
+        response.set_cookie(LAST_WRITE_COOKIE, str(time.time()),
+                            max_age=int(db_router.read_your_writes_window), httponly=True)
+    return response
+
+# Параметры сжатия ответов
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_LEVELS = {
+    'gzip': int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6)),
+    'br': int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+}
+compressed_bodies = compression.CompressedBodyCache(
+    max_bytes=int(os.environ.get('COMPRESSION_CACHE_BYTES', 32 * 1024 * 1024))
+)
+# Сжатые тела кэшируются только для ответов из снимков в памяти (каталог, уровни):
+# они повторяются байт в байт, а ответы о заказах и страницы отзывов - нет
+COMPRESSION_CACHED_ENDPOINTS = {'get_mocktails', 'get_ingredient_levels'}
+
+# Сжатие больших JSON-ответов (gzip/brotli по Accept-Encoding)
+@app.after_request
+def compress_json_response(response):
+    return compression.compress_response(
+        response,
+        request.headers.get('Accept-Encoding', ''),
+        compressed_bodies,
+        COMPRESSION_MIN_SIZE,
+        COMPRESSION_LEVELS,
+        cacheable=request.endpoint in COMPRESSION_CACHED_ENDPOINTS
+    )
+
+# Учёт SQL-запросов: бюджеты по эндпоинтам и поиск N+1 (в режиме разработки)
+QUERY_ACCOUNTING_DEV = os.environ.get('QUERY_ACCOUNTING_DEV') == '1'
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT') == '1'
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 3))
+QUERY_BUDGETS = {
+    'get_mocktails': 2,
+    'get_orders': 2,
+    # Второй запрос - только для заказов, созданных до колонки ingredients_json
+    'order_status': 2,
+    'get_ingredient_levels': 2,
+    'check_ingredients': 1,
+    # Два запроса страницы; ещё два - загрузка каталога, если в процессе нет ни одного снимка
+    'get_mocktail_reviews': 4,
+    'get_ingredient_history': 2,
+    'get_changes': 2
+}
+
+@app.before_request
+def start_query_accounting():
+    query_trace.start_collection()
+
+@app.after_request
+def check_query_budget(response):
+    query_log = query_trace.current_log()
+    if query_log is None:
+        return response
+    
+    budget = QUERY_BUDGETS.get(request.endpoint)
+    over_budget = budget is not None and query_log.count > budget
+    if over_budget:
+        logger.warning(f"Превышен бюджет запросов {request.endpoint}: {query_log.count} > {budget}")
+    
+    if QUERY_ACCOUNTING_DEV or QUERY_BUDGET_STRICT:
+        response.headers['X-Query-Count'] = str(query_log.count)
+        repeated = query_log.repeated_shapes(N_PLUS_ONE_THRESHOLD)
+        for shape, count in repeated:
+            logger.warning(f"Возможный N+1 в {request.endpoint}: {count} раз '{shape}'")
+        if repeated:
+            response.headers['X-Query-Repeated'] = str(len(repeated))
+    
+    if over_budget and QUERY_BUDGET_STRICT:
+        # after_request должен вернуть объект ответа, а не кортеж (ответ, код)
+        failed = jsonify({
+            "success": False,
+            "message": f"Превышен бюджет запросов: {query_log.count} > {budget}"
+        })
+        failed.status_code = 500
+        failed.headers['X-Query-Count'] = str(query_log.count)
+        return failed
+    return response
+
+@app.teardown_request
+def stop_query_accounting(exc):
+    query_trace.stop_collection()
+
+# Токен для административных эндпоинтов (если не задан - проверка отключена)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+def is_admin_request():
+    return not ADMIN_TOKEN or request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+# Профилирование запросов: заголовок X-Profile: 1 или выборка доли запросов
+request_profiler = profiling.RequestProfiler(
+    os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')),
+    max_profiles=int(os.environ.get('PROFILE_MAX_FILES', 50)),
+    enabled=os.environ.get('PROFILING_ENABLED') == '1',
+    sample_rate=float(os.environ.get('PROFILING_SAMPLE_RATE', 0.01))
+)
+
+@app.before_request
+def start_request_profile():
+    forced = request.headers.get('X-Profile') == '1' and is_admin_request()
+    if not request_profiler.should_profile(forced):
+        return
+    profile = request_profiler.start()
+    if profile:
+        g.profile = profile
+        g.profile_started = time.time()
+        query_trace.current_log().detailed = True
+
+def finish_request_profile(status_code):
+    profile = g.pop('profile', None)
+    if not profile:
+        return None
+    query_log = query_trace.current_log()
+    queries = query_log.records if query_log else []
+    return request_profiler.finish(profile, queries, {
+        "method": request.method,
+        "path": request.full_path,
+        "endpoint": request.endpoint,
+        "status": status_code,
+        "startedAt": g.profile_started,
+        "wallTimeMs": round((time.time() - g.profile_started) * 1000, 3)
+    })
+
+@app.after_request
+def save_request_profile(response):
+    name = finish_request_profile(response.status_code)
+    if name:
+        response.headers['X-Profile-Name'] = name
+    return response
+
+@app.teardown_request
+def release_request_profile(exc):
+    finish_request_profile(500)
+
+# Управление профилированием (административная функция)
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling_settings():
+    """Включение/выключение выборочного профилирования"""
+    if not is_admin_request():
+        return jsonify({"success": False, "message": "Доступ запрещён"}), 403
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            request_profiler.configure(data.get('enabled'), data.get('sampleRate'))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Неверное значение sampleRate"}), 400
+        logger.info(f"Настройки профилирования: {request_profiler.status()}")
+    return jsonify({"success": True, "profiling": request_profiler.status()})
+
+# Список сохранённых профилей
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Список файлов профилей"""
+    if not is_admin_request():
+        return jsonify({"success": False, "message": "Доступ запрещён"}), 403
+    return jsonify({"success": True, "profiles": request_profiler.list_profiles()})
+
+# Скачивание файла профиля
+@app.route('/admin/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """Скачивание файла профиля (.prof или .json)"""
+    if not is_admin_request():
+        return jsonify({"success": False, "message": "Доступ запрещён"}), 403
+    if not profiling.PROFILE_NAME.match(name):
+        return jsonify({"success": False, "message": "Профиль не найден"}), 404
+    return send_from_directory(request_profiler.directory, name, as_attachment=True)
+
+def journal_order_status(order_id, new_status):
+    """Statut d'une commande pas encore transférée en base: écrit dans le journal de ce processus"""
+    order_journal.append('status', order_id, status=new_status)
+    order_cache.update(order_id, status=new_status)
+    cache_bus.publish(('order', order_id))
+    order_watch.notify(order_id)
+    note_write(order_id)
+    return jsonify({
+        "success": True,
+        "message": f"Statut de la commande mis à jour: {new_status}"
+    })
+
 @app.route('/order_status/update', methods=['POST'])
 def update_order_status():
     """Endpoint pour mettre à jour le statut d'une commande"""
@@ -53,8 +298,15 @@ def update_order_status():
         if new_status not in valid_statuses:
             return jsonify({"success": False, "message": f"Statut invalide. Valeurs autorisées: {', '.join(valid_statuses)}"}), 400
         
+        # Commande pas encore transférée du journal: le statut passe par le journal
+        if order_journal.pending_order(order_id):
+            return journal_order_status(order_id, new_status)
+        
         conn = get_db_connection()
         if not conn:
+            # Base indisponible: la commande peut être encore dans le journal d'un autre processus
+            if order_journal.find_order(order_id):
+                return journal_order_status(order_id, new_status)
             return jsonify({"success": False, "message": "Erreur de connexion à la base de données"}), 500
         
         cursor = conn.cursor()
@@ -69,6 +321,9 @@ def update_order_status():
         if not order:
             cursor.close()
             conn.close()
+            # Commande reçue par un autre processus, encore dans son journal
+            if order_journal.find_order(order_id):
+                return journal_order_status(order_id, new_status)
             return jsonify({"success": False, "message": "Commande introuvable"}), 404
         
         # Mise à jour du statut
@@ -78,8 +333,13 @@ def update_order_status():
         WHERE order_id = %s
         """
         cursor.execute(query, (new_status, order_id))
+        change_feed.record(cursor, 'order', order_id, 'status', {"status": new_status})
         
         conn.commit()
+        order_cache.update(order_id, status=new_status)
+        cache_bus.publish(('order', order_id))
+        order_watch.notify(order_id)
+        note_write(order_id)
         cursor.close()
         conn.close()
         
@@ -92,6 +352,20 @@ def update_order_status():
         logger.error(f"Erreur lors de la mise à jour du statut: {str(e)}")
         return jsonify({"success": False, "message": f"Erreur serveur: {str(e)}"}), 500
 
+# Записи журнала изменений об отзыве и новой средней оценке коктейля
+def review_change_records(op, review_id, mocktail_id, rating_result, rating=None):
+    has_reviews = rating_result and rating_result[0] is not None
+    review_data = {"mocktailId": mocktail_id}
+    if rating is not None:
+        review_data["rating"] = float(rating)
+    return [
+        ('review', review_id, op, review_data),
+        ('mocktail', mocktail_id, 'rating', {
+            "rating": float(rating_result[0]) if has_reviews else 0,
+            "reviewCount": int(rating_result[1]) if has_reviews else 0
+        })
+    ]
+
 @app.route('/reviews/<review_id>', methods=['DELETE'])
 def delete_review(review_id):
     """Supprimer un avis spécifique"""
@@ -112,7 +386,7 @@ def delete_review(review_id):
         
         # Vérifier si l'avis existe
         query = """
-        SELECT * FROM reviews WHERE review_id = %s AND mocktail_id = %s
+        SELECT rating, created_at FROM reviews WHERE review_id = %s AND mocktail_id = %s
         """
         cursor.execute(query, (review_id, mocktail_id))
         review = cursor.fetchone()
@@ -156,7 +430,14 @@ def delete_review(review_id):
             """
             cursor.execute(query, (mocktail_id,))
         
+        change_feed.record_many(cursor, review_change_records('delete', review_id, mocktail_id, result))
         conn.commit()
+        note_write()
+        catalog.invalidate()
+        review_pages.invalidate(mocktail_id)
+        cache_bus.publish(('catalog', None), ('reviews', mocktail_id))
+        if leaderboard.loaded:
+            leaderboard.remove(mocktail_id, review[0], review[1])
         cursor.close()
         conn.close()
         
@@ -202,7 +483,7 @@ def update_review(review_id):
         
         # Vérifier si l'avis existe
         query = """
-        SELECT * FROM reviews WHERE review_id = %s AND mocktail_id = %s
+        SELECT rating, created_at FROM reviews WHERE review_id = %s AND mocktail_id = %s
         """
         cursor.execute(query, (review_id, mocktail_id))
         review = cursor.fetchone()
@@ -240,7 +521,14 @@ def update_review(review_id):
             """
             cursor.execute(query, (avg_rating, review_count, mocktail_id))
         
+        change_feed.record_many(cursor, review_change_records('update', review_id, mocktail_id, result, rating))
         conn.commit()
+        note_write()
+        catalog.invalidate()
+        review_pages.invalidate(mocktail_id)
+        cache_bus.publish(('catalog', None), ('reviews', mocktail_id))
+        if leaderboard.loaded:
+            leaderboard.update(mocktail_id, review[0], rating, review[1])
         cursor.close()
         conn.close()
         
@@ -264,67 +552,560 @@ def health_check():
         return jsonify({"status": "online", "database": "connected", "timestamp": time.time()})
     return jsonify({"status": "online", "database": "disconnected", "timestamp": time.time()})
 
+# Загрузка каталога коктейлей с ингредиентами и тегами (два запроса независимо от размера)
+def fetch_catalog(cursor):
+    # Получаем все коктейли с рейтингами
+    query = """
+    SELECT m.mocktail_id, m.name, m.description, m.image_url, 
+           COALESCE(m.rating, 0) as rating, COALESCE(m.review_count, 0) as review_count
+    FROM mocktails m
+    """
+    cursor.execute(query)
+    mocktails = cursor.fetchall()
+    
+    by_id = {}
+    for mocktail in mocktails:
+        mocktail['ingredients'] = {}
+        mocktail['tags'] = []
+        by_id[mocktail['mocktail_id']] = mocktail
+    
+    # Ингредиенты и теги всех коктейлей одним запросом
+    query = """
+    SELECT mi.mocktail_id, 'ingredient' as kind, i.name, mi.amount
+    FROM mocktail_ingredients mi
+    JOIN ingredients i ON mi.ingredient_id = i.ingredient_id
+    UNION ALL
+    SELECT mt.mocktail_id, 'tag' as kind, t.name, NULL as amount
+    FROM mocktail_tags mt
+    JOIN tags t ON mt.tag_id = t.tag_id
+    """
+    cursor.execute(query)
+    for item in cursor.fetchall():
+        mocktail = by_id.get(item['mocktail_id'])
+        if not mocktail:
+            continue
+        if item['kind'] == 'ingredient':
+            mocktail['ingredients'][item['name']] = item['amount']
+        else:
+            mocktail['tags'].append(item['name'])
+    
+    return mocktails
+
 # Эндпоинт для получения всех коктейлей с их рейтингами
 @app.route('/mocktails', methods=['GET'])
 def get_mocktails():
     """Эндпоинт для получения всех коктейлей с их рейтингами"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
+        # Снимок каталога: холодный кэш загружается одним запросом на процесс
+        _, mocktails = catalog.get()
         
-        cursor = conn.cursor(dictionary=True)
+        return jsonify({
+            "success": True,
+            "mocktails": mocktails
+        })
         
-        # Получаем все коктейли с рейтингами
-        query = """
-        SELECT m.mocktail_id, m.name, m.description, m.image_url, 
-               COALESCE(m.rating, 0) as rating, COALESCE(m.review_count, 0) as review_count
-        FROM mocktails m
-        """
-        cursor.execute(query)
-        mocktails = cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка получения коктейлей: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+# Каталог в памяти процесса и построенные по нему индексы
+CATALOG_TTL = float(os.environ.get('CATALOG_TTL', 60))
+
+def load_catalog():
+    conn = get_read_connection()
+    if not conn:
+        raise ConnectionError("Не удалось подключиться к базе данных")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        return fetch_catalog(cursor)
+    finally:
+        cursor.close()
+        conn.close()
+
+catalog = CatalogSnapshot(load_catalog, ttl=CATALOG_TTL)
+mocktail_search_index = Derived(catalog, MocktailSearchIndex)
+
+def split_param(name):
+    values = []
+    for value in request.args.getlist(name):
+        values.extend(item.strip() for item in value.split(',') if item.strip())
+    return values
+
+# Поиск коктейлей с фильтрами (теги, ингредиенты, рейтинг, текст)
+@app.route('/mocktails/search', methods=['GET'])
+def search_mocktails():
+    """Фасетный поиск по каталогу из инвертированных индексов в памяти"""
+    try:
+        sort = request.args.get('sort', 'rating')
+        if sort not in SORTS:
+            return jsonify({"success": False, "message": f"Неверная сортировка. Допустимые значения: {', '.join(SORTS)}"}), 400
+        order = request.args.get('order')
+        if order not in (None, 'asc', 'desc'):
+            return jsonify({"success": False, "message": "Параметр order: asc или desc"}), 400
         
-        # Для каждого коктейля получаем ингредиенты и теги
-        for mocktail in mocktails:
-            # Получаем ингредиенты
-            query = """
-            SELECT i.name, mi.amount
-            FROM mocktail_ingredients mi
-            JOIN ingredients i ON mi.ingredient_id = i.ingredient_id
-            WHERE mi.mocktail_id = %s
-            """
-            cursor.execute(query, (mocktail['mocktail_id'],))
-            ingredients_data = cursor.fetchall()
-            mocktail['ingredients'] = {item['name']: item['amount'] for item in ingredients_data}
-            
-            # Получаем теги
-            query = """
-            SELECT t.name
-            FROM mocktail_tags mt
-            JOIN tags t ON mt.tag_id = t.tag_id
-            WHERE mt.mocktail_id = %s
-            """
-            cursor.execute(query, (mocktail['mocktail_id'],))
-            tags_data = cursor.fetchall()
-            mocktail['tags'] = [item['name'] for item in tags_data]
+        try:
+            min_rating = request.args.get('minRating', type=float)
+            page = max(int(request.args.get('page', 1)), 1)
+            page_size = min(max(int(request.args.get('pageSize', 20)), 1), 100)
+        except ValueError:
+            return jsonify({"success": False, "message": "Неверные параметры страницы"}), 400
+        
+        total, mocktails, facets = mocktail_search_index.get().search(
+            tags=split_param('tags'),
+            include=split_param('include'),
+            exclude=split_param('exclude'),
+            min_rating=min_rating,
+            text=request.args.get('q'),
+            sort=sort,
+            descending=None if order is None else order == 'desc',
+            page=page,
+            page_size=page_size
+        )
         
+        return jsonify({
+            "success": True,
+            "total": total,
+            "page": page,
+            "pageSize": page_size,
+            "mocktails": mocktails,
+            "facets": facets
+        })
+    except Exception as e:
+        logger.error(f"Ошибка поиска коктейлей: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
+# Текущие уровни ингредиентов всех машин по имени (с primary: читаются сразу после записи)
+def load_ingredient_levels():
+    conn = get_db_connection()
+    if not conn:
+        raise ConnectionError("Не удалось подключиться к базе данных")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        return {
+            machine_id: {level['name']: level['currentLevel'] for level in levels}
+            for machine_id, levels in machines.fetch_all_levels(cursor).items()
+        }
+    finally:
         cursor.close()
         conn.close()
+
+makeable_cache = MakeableCache(catalog, load_ingredient_levels)
+MAKEABLE_DEFAULT_VOLUMES = [150, 250, 350]
+
+# Машина для доступности коктейлей: по умолчанию все, как при выборе машины для заказа
+def makeable_machine():
+    return request.args.get('machineId', machines.ALL_MACHINES)
+
+# Какие коктейли можно приготовить прямо сейчас и сколько порций осталось
+@app.route('/mocktails/makeable', methods=['GET'])
+def get_makeable_mocktails():
+    """Доступность коктейлей для каждого объёма по текущим уровням ингредиентов"""
+    try:
+        try:
+            volumes = [float(volume) for volume in split_param('totalVolume')] or MAKEABLE_DEFAULT_VOLUMES
+        except ValueError:
+            return jsonify({"success": False, "message": "Неверное значение totalVolume"}), 400
+        if any(volume <= 0 for volume in volumes):
+            return jsonify({"success": False, "message": "totalVolume должен быть больше 0"}), 400
+        volumes = [int(volume) if volume == int(volume) else volume for volume in volumes]
+        
+        machine_id = makeable_machine()
+        try:
+            servings = makeable_cache.get(volumes, machine_id)
+        except machines.UnknownMachineError:
+            return jsonify({"success": False, "message": "Неверное значение machineId"}), 400
+        _, mocktails = catalog.get()
+        result = []
+        for mocktail in mocktails:
+            by_volume = servings.get(mocktail['mocktail_id'], {})
+            result.append({
+                "mocktailId": mocktail['mocktail_id'],
+                "name": mocktail['name'],
+                "volumes": {
+                    str(volume): {"makeable": count > 0, "servings": count}
+                    for volume, count in by_volume.items()
+                }
+            })
         
         return jsonify({
             "success": True,
-            "mocktails": mocktails
+            "machineId": machine_id,
+            "volumes": volumes,
+            "mocktails": result
+        })
+    except Exception as e:
+        logger.error(f"Ошибка расчёта доступности коктейлей: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
+# Матрица сходства коктейлей (перестраивается только при смене каталога)
+mocktail_similarity = Derived(catalog, SimilarityMatrix)
+
+def resolve_mocktail_id(mocktails, value):
+    """mocktail_id по id, названию или названию в формате id"""
+    formatted_id = value.lower().replace(' ', '_')
+    for mocktail in mocktails:
+        if value in (mocktail['mocktail_id'], mocktail['name']) or mocktail['mocktail_id'] == formatted_id:
+            return mocktail['mocktail_id']
+    return None
+
+# Похожие коктейли (по составу и тегам), при необходимости - только доступные сейчас
+@app.route('/mocktails/<mocktail_id>/similar', methods=['GET'])
+def get_similar_mocktails(mocktail_id):
+    """Рекомендации коктейлей, похожих на указанный"""
+    try:
+        try:
+            limit = min(max(int(request.args.get('limit', 5)), 1), 50)
+            volume = float(request.args.get('totalVolume', MAKEABLE_DEFAULT_VOLUMES[0]))
+        except ValueError:
+            return jsonify({"success": False, "message": "Неверные параметры limit/totalVolume"}), 400
+        makeable_only = request.args.get('makeable') in ('1', 'true')
+        
+        _, mocktails = catalog.get()
+        resolved_id = resolve_mocktail_id(mocktails, mocktail_id)
+        if not resolved_id:
+            return jsonify({"success": False, "message": "Коктейль не найден"}), 404
+        
+        allowed = None
+        if makeable_only:
+            try:
+                servings = makeable_cache.get([volume], makeable_machine())
+            except machines.UnknownMachineError:
+                return jsonify({"success": False, "message": "Неверное значение machineId"}), 400
+            allowed = {item_id for item_id, by_volume in servings.items() if by_volume[volume] > 0}
+        
+        names = {mocktail['mocktail_id']: mocktail['name'] for mocktail in mocktails}
+        similar = mocktail_similarity.get().similar(resolved_id, limit, allowed)
+        
+        return jsonify({
+            "success": True,
+            "mocktailId": resolved_id,
+            "similar": [{
+                "mocktailId": item_id,
+                "name": names.get(item_id, item_id),
+                "similarity": round(score, 4)
+            } for item_id, score in similar]
         })
+    except Exception as e:
+        logger.error(f"Ошибка получения рекомендаций: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
+# Рейтинг лучших коктейлей (байесовское среднее, обновляется при записи отзывов)
+leaderboard = Leaderboard(
+    prior_weight=float(os.environ.get('LEADERBOARD_PRIOR_WEIGHT', 5)),
+    prior_mean=float(os.environ['LEADERBOARD_PRIOR_MEAN']) if 'LEADERBOARD_PRIOR_MEAN' in os.environ else None,
+    decay_half_lives={'trending': 30, 'hot': 7}
+)
+leaderboard_load_lock = threading.Lock()
+
+def ensure_leaderboard_loaded():
+    if leaderboard.loaded:
+        return
+    with leaderboard_load_lock:
+        if leaderboard.loaded:
+            return
+        # С primary: рейтинг хранится без срока годности, а перезагрузка после
+        # изменения отзывов с отстающей реплики потеряла бы это изменение
+        generation = leaderboard.generation
+        conn = get_db_connection()
+        if not conn:
+            raise ConnectionError("Не удалось подключиться к базе данных")
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT mocktail_id, rating, created_at FROM reviews")
+            leaderboard.load(cursor.fetchall(), generation)
+        finally:
+            cursor.close()
+            conn.close()
+
+@app.route('/mocktails/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """Лучшие коктейли по байесовскому (или затухающему) рейтингу"""
+    try:
+        variant = request.args.get('variant', 'bayesian')
+        if variant not in leaderboard.half_lives:
+            return jsonify({"success": False, "message": f"Неверный вариант. Допустимые значения: {', '.join(leaderboard.half_lives)}"}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+        except ValueError:
+            return jsonify({"success": False, "message": "Неверное значение limit"}), 400
+        
+        ensure_leaderboard_loaded()
+        _, mocktails = catalog.get()
+        names = {mocktail['mocktail_id']: mocktail['name'] for mocktail in mocktails}
         
+        return jsonify({
+            "success": True,
+            "variant": variant,
+            "leaderboard": [{
+                "rank": rank,
+                "mocktailId": mocktail_id,
+                "name": names.get(mocktail_id, mocktail_id),
+                "score": round(score, 4),
+                "rating": round(mean, 4),
+                "reviewCount": count
+            } for rank, (mocktail_id, score, count, mean) in enumerate(leaderboard.top(limit, variant), 1)]
+        })
     except Exception as e:
-        logger.error(f"Ошибка получения коктейлей: {str(e)}")
+        logger.error(f"Ошибка получения рейтинга коктейлей: {str(e)}")
         return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
+# Ингредиенты заказа хранятся и в самой строке orders (ingredients_json),
+# чтобы заказ читался одним запросом; order_ingredients остаётся для аналитики
+def encode_order_ingredients(ingredients):
+    return json.dumps(ingredients, ensure_ascii=False, separators=(',', ':'))
+
+def attach_order_ingredients(cursor, orders):
+    """Заполняет order['ingredients']; order_ingredients читается только для заказов без ingredients_json"""
+    missing = {}
+    for order in orders:
+        packed = order.pop('ingredients_json', None)
+        if packed is None:
+            order['ingredients'] = {}
+            missing[order['order_id']] = order
+        else:
+            order['ingredients'] = json.loads(packed)
+    if missing:
+        placeholders = ', '.join(['%s'] * len(missing))
+        cursor.execute(
+            f"SELECT order_id, ingredient_name, amount FROM order_ingredients WHERE order_id IN ({placeholders})",
+            tuple(missing)
+        )
+        for item in cursor.fetchall():
+            missing[item['order_id']]['ingredients'][item['ingredient_name']] = item['amount']
+    return orders
+
+# Записи журнала изменений о новых уровнях ингредиентов машины ({ingredient_id: уровень})
+def level_change_records(machine_id, levels):
+    return [
+        ('ingredient', machines.history_key(machine_id, ingredient_id), 'level', {
+            "machineId": machine_id,
+            "ingredientId": ingredient_id,
+            "currentLevel": level
+        })
+        for ingredient_id, level in levels.items()
+    ]
+
+# Сколько статус может ждать заказ, которого нет ни в базе, ни в журналах (секунды)
+ORDER_STATUS_GRACE = float(os.environ.get('ORDER_STATUS_GRACE', 10))
+
+def order_exists(cursor, order_id):
+    cursor.execute("SELECT 1 FROM orders WHERE order_id = %s", (order_id,))
+    return cursor.fetchone() is not None
+
+# Перенос записей журнала заказов в базу данных (идемпотентно, по порядку)
+def apply_journal_batch(records):
+    conn = get_db_connection()
+    if not conn:
+        raise ConnectionError("Не удалось подключиться к базе данных")
+    
+    cursor = conn.cursor()
+    levels_changed = False
+    try:
+        for record in records:
+            if record['type'] == 'status':
+                query = """
+                UPDATE orders
+                SET status = %s
+                WHERE order_id = %s
+                """
+                cursor.execute(query, (record['status'], record['order_id']))
+                if cursor.rowcount == 0 and not order_exists(cursor, record['order_id']):
+                    # Заказ принят другим процессом и ещё не перенесён из его журнала
+                    if (order_journal.find_order(record['order_id'])
+                            or time.time() - record['journaled_at'] < ORDER_STATUS_GRACE):
+                        raise RecordNotReady(f"Заказ {record['order_id']} ещё не перенесён в базу данных")
+                    raise LookupError(f"Заказ {record['order_id']} не найден")
+                change_feed.record(cursor, 'order', record['order_id'], 'status', {"status": record['status']})
+                continue
+            
+            order = record['order']
+            machine_id = order.get('machine_id', machines.DEFAULT_MACHINE_ID)
+            # INSERT IGNORE: заказ, уже перенесённый до сбоя, пропускается целиком
+            query = """
+            INSERT IGNORE INTO orders (order_id, mocktail_name, timestamp, status, total_volume, machine_id, ingredients_json)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """
+            values = (
+                order['order_id'],
+                order['mocktail_name'],
+                order['timestamp'],
+                order['status'],
+                order['total_volume'],
+                machine_id,
+                encode_order_ingredients(order['ingredients'])
+            )
+            cursor.execute(query, values)
+            if cursor.rowcount == 0:
+                continue
+            levels_changed = True
+            
+            # Нормализованная копия ингредиентов - для аналитики
+            query = """
+            INSERT INTO order_ingredients (order_id, ingredient_name, amount)
+            VALUES (%s, %s, %s)
+            """
+            cursor.executemany(query, [
+                (order['order_id'], ingredient_name, amount)
+                for ingredient_name, amount in order['ingredients'].items()
+            ])
+            
+            # Текущие уровни машины (с блокировкой) - для истории изменений
+            before = machines.lock_levels(cursor, machine_id, list(order['ingredients'].keys()))
+            
+            # Обновляем уровни ингредиентов машины
+            machines.decrement_levels(cursor, machine_id, before, order['ingredients'])
+            
+            level_history.record_changes(cursor, [
+                (machines.history_key(machine_id, before[name][0]), before[name][1], max(0, before[name][1] - amount))
+                for name, amount in order['ingredients'].items() if name in before
+            ], 'order', order['order_id'], ts=order['timestamp'])
+            
+            change_feed.record_many(cursor, [('order', order['order_id'], 'create', {
+                "status": order['status'],
+                "mocktailName": order['mocktail_name'],
+                "machineId": machine_id,
+                "timestamp": order['timestamp']
+            })] + level_change_records(machine_id, {
+                before[name][0]: max(0, before[name][1] - amount)
+                for name, amount in order['ingredients'].items() if name in before
+            }))
+        
+        conn.commit()
+        if levels_changed:
+            makeable_cache.invalidate_levels()
+            ingredient_levels.invalidate(keep_stale=True)
+        cache_bus.publish(*[
+            ('order', record['order_id']) for record in records if record['type'] == 'status'
+        ] + ([('levels', None)] if levels_changed else []))
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+# Журнал заказов: заказ сначала пишется локально, в MySQL - фоновым потоком
+ORDER_JOURNAL_PATH = os.environ.get(
+    'ORDER_JOURNAL_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'orders_journal.log')
+)
+order_journal = OrderJournal(
+    ORDER_JOURNAL_PATH,
+    apply_journal_batch,
+    batch_size=int(os.environ.get('ORDER_JOURNAL_BATCH_SIZE', 50)),
+    # Данные записи, которые MySQL не примет ни при каком повторе
+    permanent_errors=PERMANENT_ERRORS + (
+        mysql.connector.errors.DataError,
+        mysql.connector.errors.IntegrityError
+    )
+)
+
+# Фоновая очистка истории уровней ингредиентов и журнала изменений
+history_pruner = level_history.HistoryPruner(get_db_connection)
+change_log_pruner = change_feed.ChangeLogPruner(get_db_connection)
+
+# Сброс кэшей этого процесса по сообщениям других процессов сервера и import_data.py
+def apply_remote_invalidation(topic, key):
+    if topic in ('catalog', 'all'):
+        catalog.invalidate(keep_stale=True)
+    if topic in ('reviews', 'all'):
+        leaderboard.invalidate()
+        review_pages.invalidate(key if topic == 'reviews' else None)
+    if topic in ('levels', 'all'):
+        makeable_cache.invalidate_levels()
+        order_router.invalidate()
+        ingredient_levels.invalidate(keep_stale=True)
+    if topic == 'order':
+        order_cache.discard(key)
+        order_watch.notify(key)
+    elif topic == 'all':
+        order_cache.clear()
+        order_watch.notify_all()
+
+cache_bus = InvalidationBus(apply_remote_invalidation)
+
+@app.before_request
+def start_background_tasks():
+    order_journal.start()
+    history_pruner.start()
+    change_log_pruner.start()
+    cache_bus.start()
+
+# Состояние для маршрутизации заказов: уровни и длины очередей всех машин
+def load_machine_state():
+    conn = get_read_connection()
+    if not conn:
+        raise ConnectionError("Не удалось подключиться к базе данных")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        levels_by_machine = machines.fetch_all_levels(cursor)
+        placeholders = ', '.join(['%s'] * len(machines.QUEUED_STATUSES))
+        cursor.execute(f"""
+        SELECT machine_id, COUNT(*) as queued FROM orders
+        WHERE status IN ({placeholders})
+        GROUP BY machine_id
+        """, machines.QUEUED_STATUSES)
+        queues = {row['machine_id']: row['queued'] for row in cursor.fetchall()}
+        return levels_by_machine, queues
+    finally:
+        cursor.close()
+        conn.close()
+
+order_router = machines.OrderRouter(load_machine_state)
+
+# Кэш недавних и активных заказов для /order_status (заполняется при записи)
+order_cache = OrderCache(
+    max_entries=int(os.environ.get('ORDER_CACHE_SIZE', 10000)),
+    active_ttl=float(os.environ.get('ORDER_CACHE_ACTIVE_TTL', 2)),
+    terminal_ttl=float(os.environ.get('ORDER_CACHE_TERMINAL_TTL', 60))
+)
+
+# Ожидающие смены статуса заказа (long poll) просыпаются по уведомлению
+order_watch = OrderWatch()
+
+# Режим раздачи заказов диспенсерам: заказ ждёт в статусе 'received',
+# пока контроллер не заберёт его через /dispensers/claim
+DISPENSER_CLAIM_MODE = os.environ.get('DISPENSER_CLAIM_MODE') == '1'
+
+def is_positive_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 < value < float('inf')
+
+def is_order_id(value):
+    return isinstance(value, (str, int)) and not isinstance(value, bool) and value != ''
+
+def validate_order(data):
+    """Сообщение об ошибке в данных заказа или None"""
+    if not isinstance(data['mocktailName'], str) or not data['mocktailName'].strip():
+        return "Поле mocktailName должно быть непустой строкой"
+    ingredients = data['ingredients']
+    if not isinstance(ingredients, dict) or not ingredients or not all(
+        isinstance(name, str) and name and is_positive_number(amount) for name, amount in ingredients.items()
+    ):
+        return "Поле ingredients должно быть объектом {ингредиент: положительное количество}"
+    if not is_positive_number(data['totalVolume']):
+        return "Поле totalVolume должно быть положительным числом"
+    machine_id = data.get('machineId')
+    if machine_id and (not isinstance(machine_id, str) or machine_id == machines.ALL_MACHINES):
+        return "Неверное значение machineId"
+    return None
+
+def check_machine(machine_id):
+    """Есть ли активная машина machine_id (по базе); None - база недоступна"""
+    conn = get_read_connection()
+    if not conn:
+        return None
+    cursor = conn.cursor()
+    try:
+        return machines.machine_is_active(cursor, machine_id)
+    finally:
+        cursor.close()
+        conn.close()
+
 # Эндпоинт для приготовления коктейля
 @app.route('/prepare_mocktail', methods=['POST'])
 def prepare_mocktail():
     """Эндпоинт для приема запросов на приготовление коктейля"""
     try:
-        data = request.json
+        data = request.json or {}
         logger.info(f"Получен заказ: {data}")
         
         # Проверяем наличие обязательных полей
@@ -333,71 +1114,286 @@ def prepare_mocktail():
             if field not in data:
                 return jsonify({"success": False, "message": f"Отсутствует обязательное поле: {field}"}), 400
         
+        # Заказ принимается в журнал без БД, поэтому данные проверяются здесь:
+        # запись, которую MySQL не примет, иначе обнаружилась бы только при переносе
+        error = validate_order(data)
+        if error:
+            return jsonify({"success": False, "message": error}), 400
+        
+        # Создаем ID заказа
+        order_id = str(uuid.uuid4())
+        
+        # Машина: указанная клиентом или выбранная по запасам и длине очереди
+        # (маршрутизатор не обращается к базе в запросе: машина из последнего известного
+        # состояния принимается сразу, остальные - новые, без запасов или неверные - по базе)
+        machine_id = data.get('machineId')
+        if machine_id:
+            known = order_router.machine_exists(machine_id) or check_machine(machine_id)
+            if known is None:
+                return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
+            if not known:
+                return jsonify({"success": False, "message": "Неверное значение machineId"}), 400
+        machine_id = machine_id or order_router.route(data['ingredients'])
+        
+        # Записываем заказ в журнал (fsync); в базу его перенесёт фоновый поток
+        order = {
+            'order_id': order_id,
+            'mocktail_name': data['mocktailName'],
+            'timestamp': time.time(),
+            'status': 'received' if DISPENSER_CLAIM_MODE else 'processing',
+            'total_volume': data['totalVolume'],
+            'ingredients': data['ingredients'],
+            'machine_id': machine_id
+        }
+        order_journal.append('order', order_id, order=order)
+        order_cache.put(order)
+        note_write(order_id)
+        
+        return jsonify({
+            "success": True,
+            "message": "Заказ коктейля принят и обрабатывается",
+            "orderId": order_id,
+            "machineId": machine_id
+        })
+        
+    except Exception as e:
+        logger.error(f"Ошибка обработки запроса: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
+# Счётчики кэша заказов
+@app.route('/orders/cache', methods=['GET'])
+def order_cache_status():
+    """Состояние кэша заказов (попадания, промахи, размер)"""
+    return jsonify({"success": True, "cache": order_cache.status(), "bus": cache_bus.status()})
+
+# Состояние журнала заказов (отставание переноса в БД)
+@app.route('/journal/status', methods=['GET'])
+def journal_status():
+    """Состояние журнала заказов"""
+    return jsonify({"success": True, "journal": order_journal.status()})
+
+# ЭНДПОИНТЫ ДЛЯ КОНТРОЛЛЕРОВ ДИСПЕНСЕРОВ
+
+DEFAULT_LEASE_SECONDS = 30
+MAX_LEASE_SECONDS = 600
+MAX_CLAIM_BATCH = 20
+
+def parse_lease_request(data):
+    """controllerId и длительность аренды из тела запроса (или сообщение об ошибке)"""
+    controller_id = data.get('controllerId')
+    if not controller_id:
+        return None, None, "Отсутствует обязательное поле: controllerId"
+    try:
+        lease_seconds = float(data.get('leaseSeconds', DEFAULT_LEASE_SECONDS))
+    except (TypeError, ValueError):
+        return None, None, "Неверное значение leaseSeconds"
+    if not 0 < lease_seconds <= MAX_LEASE_SECONDS:
+        return None, None, f"leaseSeconds должно быть от 0 до {MAX_LEASE_SECONDS}"
+    return str(controller_id), lease_seconds, None
+
+def fetch_orders_with_ingredients(cursor, order_ids):
+    placeholders = ', '.join(['%s'] * len(order_ids))
+    cursor.execute(f"SELECT * FROM orders WHERE order_id IN ({placeholders}) ORDER BY timestamp", tuple(order_ids))
+    return attach_order_ingredients(cursor, cursor.fetchall())
+
+# Аренда следующих заказов контроллером
+@app.route('/dispensers/claim', methods=['POST'])
+def claim_orders():
+    """Атомарная аренда до limit заказов машины в статусе 'received' (или с истёкшей арендой)"""
+    try:
+        data = request.json or {}
+        controller_id, lease_seconds, error = parse_lease_request(data)
+        if error:
+            return jsonify({"success": False, "message": error}), 400
+        try:
+            limit = min(max(int(data.get('limit', 1)), 1), MAX_CLAIM_BATCH)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Неверное значение limit"}), 400
+        
         conn = get_db_connection()
         if not conn:
             return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
         
         cursor = conn.cursor(dictionary=True)
+        now = time.time()
         
-        # Создаем ID заказа
-        order_id = str(uuid.uuid4())
-        
-        # Добавляем заказ в базу данных
+        # SKIP LOCKED: заказы, уже блокированные другим контроллером, пропускаются
+        machine_id = data.get('machineId', machines.DEFAULT_MACHINE_ID)
         query = """
-        INSERT INTO orders (order_id, mocktail_name, timestamp, status, total_volume)
-        VALUES (%s, %s, %s, %s, %s)
+        SELECT order_id FROM orders
+        WHERE machine_id = %s
+          AND (status = 'received'
+               OR (status = 'processing' AND claimed_by IS NOT NULL AND lease_expires_at < %s))
+        ORDER BY timestamp
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
         """
-        values = (
-            order_id,
-            data['mocktailName'],
-            time.time(),
-            'received',
-            data['totalVolume']
-        )
-        cursor.execute(query, values)
-        
-        # Добавляем ингредиенты заказа
-        for ingredient_name, amount in data['ingredients'].items():
-            query = """
-            INSERT INTO order_ingredients (order_id, ingredient_name, amount)
-            VALUES (%s, %s, %s)
+        cursor.execute(query, (machine_id, now, limit))
+        order_ids = [row['order_id'] for row in cursor.fetchall()]
+        
+        orders = []
+        if order_ids:
+            placeholders = ', '.join(['%s'] * len(order_ids))
+            query = f"""
+            UPDATE orders
+            SET status = 'processing', claimed_by = %s, lease_expires_at = %s, attempts = attempts + 1
+            WHERE order_id IN ({placeholders})
             """
-            values = (order_id, ingredient_name, amount)
-            cursor.execute(query, values)
+            cursor.execute(query, (controller_id, now + lease_seconds) + tuple(order_ids))
+            change_feed.record_many(cursor, [
+                ('order', order_id, 'status', {"status": 'processing'}) for order_id in order_ids
+            ])
+            conn.commit()
+            orders = fetch_orders_with_ingredients(cursor, order_ids)
+            for order in orders:
+                order_cache.put(order)
+            cache_bus.publish(*[('order', order_id) for order_id in order_ids])
+            order_watch.notify(*order_ids)
+        else:
+            conn.commit()
         
-        # Обновляем уровни ингредиентов
-        for ingredient_name, amount in data['ingredients'].items():
-            query = """
-            UPDATE ingredients
-            SET current_level = GREATEST(0, current_level - %s)
-            WHERE name = %s
-            """
-            values = (amount, ingredient_name)
-            cursor.execute(query, values)
+        cursor.close()
+        conn.close()
+        for order_id in order_ids:
+            note_write(order_id)
+        
+        if orders:
+            logger.info(f"Контроллер {controller_id} арендовал заказы: {order_ids}")
+        return jsonify({
+            "success": True,
+            "leaseExpiresAt": now + lease_seconds,
+            "orders": orders
+        })
+    except Exception as e:
+        logger.error(f"Ошибка аренды заказов: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
+# Продление аренды заказов пачкой
+@app.route('/dispensers/heartbeat', methods=['POST'])
+def heartbeat_orders():
+    """Продление аренды заказов, которые контроллер ещё готовит"""
+    try:
+        data = request.json or {}
+        controller_id, lease_seconds, error = parse_lease_request(data)
+        if error:
+            return jsonify({"success": False, "message": error}), 400
+        order_ids = data.get('orderIds')
+        if not order_ids:
+            return jsonify({"success": False, "message": "Отсутствует обязательное поле: orderIds"}), 400
+        if not isinstance(order_ids, list) or not all(is_order_id(order_id) for order_id in order_ids):
+            return jsonify({"success": False, "message": "Поле orderIds должно быть списком идентификаторов заказов"}), 400
+        order_ids = [str(order_id) for order_id in order_ids]
         
-        # Имитируем время обработки
-        time.sleep(1)
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
         
-        # Обновляем статус заказа
-        query = """
+        cursor = conn.cursor(dictionary=True)
+        lease_expires_at = time.time() + lease_seconds
+        placeholders = ', '.join(['%s'] * len(order_ids))
+        
+        query = f"""
         UPDATE orders
-        SET status = 'processing'
-        WHERE order_id = %s
+        SET lease_expires_at = %s
+        WHERE order_id IN ({placeholders}) AND claimed_by = %s AND status = 'processing'
         """
-        cursor.execute(query, (order_id,))
+        cursor.execute(query, (lease_expires_at,) + tuple(order_ids) + (controller_id,))
+        query = f"""
+        SELECT order_id FROM orders
+        WHERE order_id IN ({placeholders}) AND claimed_by = %s AND status = 'processing'
+        """
+        cursor.execute(query, tuple(order_ids) + (controller_id,))
+        extended = {row['order_id'] for row in cursor.fetchall()}
         
         conn.commit()
         cursor.close()
         conn.close()
+        for order_id in extended:
+            order_cache.update(order_id, lease_expires_at=lease_expires_at)
+        cache_bus.publish(*[('order', order_id) for order_id in extended])
         
         return jsonify({
             "success": True,
-            "message": "Заказ коктейля принят и обрабатывается",
-            "orderId": order_id
+            "leaseExpiresAt": lease_expires_at,
+            "extended": [order_id for order_id in order_ids if order_id in extended],
+            "lost": [order_id for order_id in order_ids if order_id not in extended]
         })
+    except Exception as e:
+        logger.error(f"Ошибка продления аренды: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
+# Завершение заказов пачкой
+@app.route('/dispensers/complete', methods=['POST'])
+def complete_orders():
+    """Отметка арендованных заказов как выполненных или отменённых"""
+    try:
+        data = request.json or {}
+        controller_id = data.get('controllerId')
+        results = data.get('results')
+        if not controller_id or not results:
+            return jsonify({"success": False, "message": "Обязательные поля: controllerId, results"}), 400
+        
+        if not isinstance(results, list):
+            return jsonify({"success": False, "message": "Поле results должно быть списком"}), 400
+        
+        by_status = {}
+        for result in results:
+            if (not isinstance(result, dict) or result.get('status') not in ('completed', 'cancelled')
+                    or not is_order_id(result.get('orderId'))):
+                return jsonify({"success": False, "message": "Каждый результат: orderId и status (completed или cancelled)"}), 400
+            by_status.setdefault(result['status'], []).append(str(result['orderId']))
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
+        
+        cursor = conn.cursor(dictionary=True)
+        
+        # Принимаются только заказы, аренда которых принадлежит этому контроллеру
+        all_ids = [order_id for order_ids in by_status.values() for order_id in order_ids]
+        placeholders = ', '.join(['%s'] * len(all_ids))
+        query = f"""
+        SELECT order_id FROM orders
+        WHERE order_id IN ({placeholders}) AND claimed_by = %s AND status = 'processing'
+        FOR UPDATE
+        """
+        cursor.execute(query, tuple(all_ids) + (str(controller_id),))
+        owned = {row['order_id'] for row in cursor.fetchall()}
+        
+        for status, order_ids in by_status.items():
+            accepted_ids = [order_id for order_id in order_ids if order_id in owned]
+            if not accepted_ids:
+                continue
+            placeholders = ', '.join(['%s'] * len(accepted_ids))
+            query = f"""
+            UPDATE orders
+            SET status = %s, lease_expires_at = NULL
+            WHERE order_id IN ({placeholders})
+            """
+            cursor.execute(query, (status,) + tuple(accepted_ids))
+            change_feed.record_many(cursor, [
+                ('order', order_id, 'status', {"status": status}) for order_id in accepted_ids
+            ])
+        
+        conn.commit()
+        cursor.close()
+        conn.close()
+        for status, order_ids in by_status.items():
+            for order_id in order_ids:
+                if order_id in owned:
+                    order_cache.update(order_id, status=status, lease_expires_at=None)
+        cache_bus.publish(*[('order', order_id) for order_id in owned])
+        order_watch.notify(*owned)
+        for order_id in owned:
+            note_write(order_id)
         
+        return jsonify({
+            "success": True,
+            "accepted": [order_id for order_id in all_ids if order_id in owned],
+            "rejected": [order_id for order_id in all_ids if order_id not in owned]
+        })
     except Exception as e:
-        logger.error(f"Ошибка обработки запроса: {str(e)}")
+        logger.error(f"Ошибка завершения заказов: {str(e)}")
         return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
 
 # Эндпоинт для проверки статуса заказа
@@ -405,8 +1401,33 @@ def prepare_mocktail():
 def order_status(order_id):
     """Эндпоинт для проверки статуса заказа"""
     try:
-        conn = get_db_connection()
+        # Недавний заказ - из кэша, без обращения к базе
+        cached = order_cache.get(order_id)
+        if cached:
+            return jsonify({
+                "success": True,
+                "order": cached
+            })
+        
+        # Заказ, ещё не перенесённый из журнала в базу; его статус мог записать
+        # в свой журнал другой процесс, поэтому статусы сводятся по всем журналам
+        if order_journal.pending_order(order_id):
+            pending = order_journal.find_order(order_id)
+            if pending:
+                return jsonify({
+                    "success": True,
+                    "order": order_shape(pending)
+                })
+        
+        conn = get_read_connection(order_id)
         if not conn:
+            # База недоступна: заказ мог принять другой процесс
+            pending = order_journal.find_order(order_id)
+            if pending:
+                return jsonify({
+                    "success": True,
+                    "order": order_shape(pending)
+                })
             return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
         
         cursor = conn.cursor(dictionary=True)
@@ -421,20 +1442,18 @@ def order_status(order_id):
         if not order:
             cursor.close()
             conn.close()
+            # Заказ принят другим процессом сервера и ещё в его журнале
+            pending = order_journal.find_order(order_id)
+            if pending:
+                return jsonify({
+                    "success": True,
+                    "order": order_shape(pending)
+                })
             return jsonify({"success": False, "message": "Заказ не найден"}), 404
         
-        # Получаем ингредиенты заказа
-        query = """
-        SELECT ingredient_name, amount FROM order_ingredients WHERE order_id = %s
-        """
-        cursor.execute(query, (order_id,))
-        ingredients = cursor.fetchall()
-        
-        # Формируем словарь ингредиентов
-        ingredients_dict = {item['ingredient_name']: item['amount'] for item in ingredients}
-        
-        # Добавляем ингредиенты к информации о заказе
-        order['ingredients'] = ingredients_dict
+        # Ингредиенты - из самой строки заказа (запасной запрос только для старых заказов)
+        attach_order_ingredients(cursor, [order])
+        order_cache.put(order)
         
         cursor.close()
         conn.close()
@@ -448,32 +1467,67 @@ def order_status(order_id):
         logger.error(f"Ошибка проверки статуса заказа: {str(e)}")
         return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
 
+# Параметры ожидания смены статуса заказа (long poll); без уведомления
+# (изменение вне сервера, шина недоступна) статус перечитывается раз в RECHECK
+ORDER_WAIT_RECHECK_INTERVAL = float(os.environ.get('ORDER_WAIT_RECHECK_INTERVAL', 5))
+ORDER_WAIT_MAX_TIMEOUT = float(os.environ.get('ORDER_WAIT_MAX_TIMEOUT', 60))
+
+# Эндпоинт ожидания смены статуса заказа
+@app.route('/order_status/<order_id>/wait', methods=['GET'])
+def wait_order_status(order_id):
+    """Ожидание изменения статуса заказа (known - статус, известный клиенту)
+
+    В асинхронном режиме этот маршрут обслуживается корутиной в async_server.py,
+    здесь - та же логика для режима WSGI.
+    """
+    known = request.args.get('known')
+    try:
+        timeout = min(float(request.args.get('timeout', 30)), ORDER_WAIT_MAX_TIMEOUT)
+    except ValueError:
+        timeout = ORDER_WAIT_MAX_TIMEOUT
+
+    deadline = time.monotonic() + timeout
+    changed = threading.Event()
+    wake = changed.set
+    order_watch.subscribe(order_id, wake)
+    try:
+        while True:
+            changed.clear()
+            result = order_status(order_id)
+            response, status_code = result if isinstance(result, tuple) else (result, result.status_code)
+            remaining = deadline - time.monotonic()
+            if status_code != 200 or known is None or remaining <= 0:
+                return result
+            if response.get_json()['order']['status'] != known:
+                return result
+            changed.wait(min(ORDER_WAIT_RECHECK_INTERVAL, remaining))
+    finally:
+        order_watch.unsubscribe(order_id, wake)
+
 # Эндпоинт для получения всех заказов
 @app.route('/orders', methods=['GET'])
 def get_orders():
     """Эндпоинт для получения всех заказов"""
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         if not conn:
             return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
         
         cursor = conn.cursor(dictionary=True)
         
-        # Получаем все заказы
-        query = """
-        SELECT * FROM orders ORDER BY timestamp DESC
-        """
-        cursor.execute(query)
-        orders = cursor.fetchall()
-        
-        # Для каждого заказа получаем ингредиенты
-        for order in orders:
+        # Получаем все заказы (или заказы одной машины)
+        machine_id = request.args.get('machineId')
+        if machine_id:
+            query = """
+            SELECT * FROM orders WHERE machine_id = %s ORDER BY timestamp DESC
+            """
+            cursor.execute(query, (machine_id,))
+        else:
             query = """
-            SELECT ingredient_name, amount FROM order_ingredients WHERE order_id = %s
+            SELECT * FROM orders ORDER BY timestamp DESC
             """
-            cursor.execute(query, (order['order_id'],))
-            ingredients = cursor.fetchall()
-            order['ingredients'] = {item['ingredient_name']: item['amount'] for item in ingredients}
+            cursor.execute(query)
+        orders = attach_order_ingredients(cursor, cursor.fetchall())
         
         cursor.close()
         conn.close()
@@ -487,73 +1541,159 @@ def get_orders():
         logger.error(f"Ошибка получения заказов: {str(e)}")
         return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
 
-# ЭНДПОИНТЫ ДЛЯ ОТЗЫВОВ
+# ЖУРНАЛ ИЗМЕНЕНИЙ ДЛЯ ДЕЛЬТА-СИНХРОНИЗАЦИИ
 
-# Получение всех отзывов для коктейля
+MAX_CHANGES_PER_REQUEST = 1000
 
-@app.route('/reviews/<mocktail_id>', methods=['GET'])
-def get_mocktail_reviews(mocktail_id):
-    """Get reviews for a specific mocktail"""
+# Изменения после версии since
+@app.route('/changes', methods=['GET'])
+def get_changes():
+    """Изменения после версии since; resyncRequired - клиенту нужна полная загрузка.
+
+    Без since возвращается только текущая версия: клиент запоминает её,
+    загружает данные полностью и дальше запрашивает /changes?since=<версия>.
+    """
     try:
-        print(f"===== PYTHON BACKEND DEBUG =====")
-        print(f"Received request for reviews with mocktail_id: {mocktail_id}")
-        
-        conn = get_db_connection()
+        since = int(request.args['since']) if 'since' in request.args else None
+        limit = min(max(int(request.args.get('limit', MAX_CHANGES_PER_REQUEST)), 1), MAX_CHANGES_PER_REQUEST)
+    except ValueError:
+        return jsonify({"success": False, "message": "Неверное значение since/limit"}), 400
+    
+    try:
+        conn = get_read_connection()
         if not conn:
-            print("Database connection failed")
-            return jsonify({"success": False, "message": "Failed to connect to database"}), 500
+            return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
         
         cursor = conn.cursor(dictionary=True)
-        
-        # First try by exact mocktail_id
-        query = """
-        SELECT * FROM reviews WHERE mocktail_id = %s ORDER BY created_at DESC
-        """
-        cursor.execute(query, (mocktail_id,))
-        reviews = cursor.fetchall()
-        print(f"Query by mocktail_id={mocktail_id} returned {len(reviews)} reviews")
-        
-        # If no results, try by name
-        if not reviews:
-            print(f"Trying to find by name match")
-            query = """
-            SELECT r.* FROM reviews r
-            JOIN mocktails m ON r.mocktail_id = m.mocktail_id
-            WHERE m.name = %s
-            ORDER BY r.created_at DESC
-            """
-            cursor.execute(query, (mocktail_id,))
-            reviews = cursor.fetchall()
-            print(f"Query by name={mocktail_id} returned {len(reviews)} reviews")
-        
-        # If still no results, try by formatted name
-        if not reviews:
-            formatted_id = mocktail_id.lower().replace(' ', '_')
-            print(f"Trying with formatted ID: {formatted_id}")
-            query = """
-            SELECT r.* FROM reviews r
-            JOIN mocktails m ON r.mocktail_id = m.mocktail_id
-            WHERE m.mocktail_id = %s
-            ORDER BY r.created_at DESC
-            """
-            cursor.execute(query, (formatted_id,))
-            reviews = cursor.fetchall()
-            print(f"Query by formatted_id={formatted_id} returned {len(reviews)} reviews")
-        
-        # Print each review for debugging
-        for review in reviews:
-            print(f"Review found: {review}")
-        
+        changes, version, resync_required, has_more = change_feed.read_changes(cursor, since, limit)
         cursor.close()
         conn.close()
         
         return jsonify({
             "success": True,
-            "reviews": reviews
+            "version": version,
+            "resyncRequired": resync_required,
+            "hasMore": has_more,
+            "changes": changes
+        })
+    except Exception as e:
+        logger.error(f"Ошибка получения журнала изменений: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
+# ВЫГРУЗКА ЗАКАЗОВ И ОТЗЫВОВ
+
+def parse_export_request():
+    """Формат и временной интервал выгрузки (или сообщение об ошибке)"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in export.FORMATS:
+        return None, None, None, f"format должен быть одним из: {', '.join(export.FORMATS)}"
+    try:
+        since = float(request.args['since']) if 'since' in request.args else None
+        until = float(request.args['until']) if 'until' in request.args else None
+    except ValueError:
+        return None, None, None, "Неверное значение since/until"
+    return export_format, since, until, None
+
+def export_response(conn, cursor, records, export_format, columns, name):
+    response = Response(
+        stream_with_context(export.stream(conn, cursor, records, export_format, columns)),
+        mimetype=export.FORMATS[export_format]
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}.{export_format}"'
+    return response
+
+# Потоковая выгрузка заказов (NDJSON или CSV)
+@app.route('/export/orders', methods=['GET'])
+def export_orders():
+    """Выгрузка заказов с ингредиентами; since/until - интервал времени, status - фильтр"""
+    export_format, since, until, error = parse_export_request()
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    
+    conn = get_read_connection()
+    if not conn:
+        return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
+    
+    try:
+        cursor = export.open_cursor(conn)
+        records = export.iter_orders(cursor, since, until, split_param('status'), request.args.get('machineId'))
+    except Exception as e:
+        conn.close()
+        logger.error(f"Ошибка выгрузки заказов: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+    
+    return export_response(conn, cursor, records, export_format, export.ORDER_COLUMNS, 'orders')
+
+# Потоковая выгрузка отзывов (NDJSON или CSV)
+@app.route('/export/reviews', methods=['GET'])
+def export_reviews():
+    """Выгрузка отзывов; since/until - интервал времени, mocktailId - фильтр"""
+    export_format, since, until, error = parse_export_request()
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    
+    conn = get_read_connection()
+    if not conn:
+        return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
+    
+    try:
+        cursor = export.open_cursor(conn)
+        records = export.iter_reviews(cursor, since, until, request.args.get('mocktailId'))
+    except Exception as e:
+        conn.close()
+        logger.error(f"Ошибка выгрузки отзывов: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+    
+    return export_response(conn, cursor, records, export_format, export.REVIEW_COLUMNS, 'reviews')
+
+# ЭНДПОИНТЫ ДЛЯ ОТЗЫВОВ
+
+# Получение всех отзывов для коктейля
+
+# Страницы отзывов по каноническому mocktail_id; сбрасываются при записи отзыва
+review_pages = reviews_cache.ReviewsCache(ttl=float(os.environ.get('REVIEWS_CACHE_TTL', 60)))
+MAX_REVIEWS_PAGE = 100
+
+@app.route('/reviews/<mocktail_id>', methods=['GET'])
+def get_mocktail_reviews(mocktail_id):
+    """Get reviews for a specific mocktail (newest first, optionally paginated)"""
+    try:
+        # Pagination: ?limit=N&cursor=<nextCursor of the previous page>; no limit - all reviews
+        try:
+            limit = min(max(int(request.args['limit']), 1), MAX_REVIEWS_PAGE) if 'limit' in request.args else None
+            page_cursor = request.args.get('cursor')
+            after = reviews_cache.decode_cursor(page_cursor) if page_cursor else None
+        except ValueError:
+            return jsonify({"success": False, "message": "Invalid limit or cursor"}), 400
+        
+        # Resolve id, name or formatted name against the last catalog snapshot: a review
+        # write invalidates the catalog, but ids and names stay the same, so the reload
+        # runs in the background; only a process without any snapshot loads it here
+        _, mocktails = catalog.latest()
+        canonical_id = resolve_mocktail_id(mocktails, mocktail_id) or mocktail_id
+        
+        def load():
+            conn = get_read_connection()
+            if not conn:
+                raise ConnectionError("Failed to connect to database")
+            cursor = conn.cursor(dictionary=True)
+            try:
+                return reviews_cache.fetch_page(cursor, canonical_id, after, limit)
+            finally:
+                cursor.close()
+                conn.close()
+        
+        page = review_pages.get(canonical_id, (page_cursor, limit), load)
+        
+        return jsonify({
+            "success": True,
+            "mocktailId": canonical_id,
+            "reviews": page['reviews'],
+            "total": page['total'],
+            "nextCursor": page['nextCursor']
         })
     except Exception as e:
         logger.error(f"Error getting reviews: {str(e)}")
-        print(f"Exception occurred: {str(e)}")
         return jsonify({"success": False, "message": f"Server error: {str(e)}"}), 500
 
 # Добавление нового отзыва
@@ -573,6 +1713,14 @@ def add_review():
                 print(f"Missing required field: {field}")
                 return jsonify({"success": False, "message": f"Missing required field: {field}"}), 400
         
+        # Validate rating before it reaches the database and the leaderboard
+        try:
+            rating = float(data['rating'])
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Invalid rating format"}), 400
+        if not (1.0 <= rating <= 5.0):
+            return jsonify({"success": False, "message": "Rating must be between 1.0 and 5.0"}), 400
+        
         conn = get_db_connection()
         if not conn:
             print("Database connection failed")
@@ -632,7 +1780,7 @@ def add_review():
             review_id,
             mocktail_id,
             data['userName'],
-            data['rating'],
+            rating,
             data['comment'],
             created_at
         )
@@ -661,7 +1809,14 @@ def add_review():
             """
             cursor.execute(query, (avg_rating, review_count, mocktail_id))
         
+        change_feed.record_many(cursor, review_change_records('create', review_id, mocktail_id, result, rating))
         conn.commit()
+        note_write()
+        catalog.invalidate()
+        review_pages.invalidate(mocktail_id)
+        cache_bus.publish(('catalog', None), ('reviews', mocktail_id))
+        if leaderboard.loaded:
+            leaderboard.add(mocktail_id, rating, created_at)
         cursor.close()
         conn.close()
         
@@ -675,6 +1830,59 @@ def add_review():
         print(f"Exception occurred: {str(e)}")
         return jsonify({"success": False, "message": f"Server error: {str(e)}"}), 500
 
+# ЭНДПОИНТЫ ДЛЯ МАШИН
+
+# Список машин и регистрация новой машины
+@app.route('/machines', methods=['GET', 'POST'])
+def machines_list():
+    """Машины с длиной очереди; POST - регистрация машины (административная функция)"""
+    try:
+        if request.method == 'POST':
+            if not is_admin_request():
+                return jsonify({"success": False, "message": "Доступ запрещён"}), 403
+            data = request.json or {}
+            machine_id = data.get('machineId')
+            if not machine_id or machine_id in (machines.DEFAULT_MACHINE_ID, machines.ALL_MACHINES):
+                return jsonify({"success": False, "message": "Неверное значение machineId"}), 400
+            
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
+            cursor = conn.cursor()
+            cursor.execute("""
+            INSERT INTO machines (machine_id, name, active, created_at)
+            VALUES (%s, %s, 1, %s)
+            ON DUPLICATE KEY UPDATE name = VALUES(name), active = 1
+            """, (machine_id, data.get('name', machine_id), time.time()))
+            # Запасы новой машины - по списку ингредиентов, пустые до пополнения
+            cursor.execute("""
+            INSERT IGNORE INTO machine_inventory (machine_id, ingredient_id, current_level, max_level)
+            SELECT %s, ingredient_id, 0, max_level FROM ingredients
+            """, (machine_id,))
+            change_feed.record(cursor, 'machine', machine_id, 'create', {"name": data.get('name', machine_id)})
+            conn.commit()
+            note_write()
+            order_router.invalidate()
+            ingredient_levels.invalidate()
+            cache_bus.publish(('levels', None))
+            cursor.close()
+            conn.close()
+            logger.info(f"Зарегистрирована машина: {machine_id}")
+            return jsonify({"success": True, "machineId": machine_id}), 201
+        
+        levels_by_machine, queues = load_machine_state()
+        return jsonify({
+            "success": True,
+            "machines": [{
+                "machineId": machine_id,
+                "queued": queues.get(machine_id, 0),
+                "ingredients": levels
+            } for machine_id, levels in sorted(levels_by_machine.items())]
+        })
+    except Exception as e:
+        logger.error(f"Ошибка работы со списком машин: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
 # ЭНДПОИНТЫ ДЛЯ ИНГРЕДИЕНТОВ
 
 # Получение уровней ингредиентов
@@ -682,29 +1890,73 @@ def add_review():
 def get_ingredient_levels():
     """Получение текущих уровней всех ингредиентов"""
     try:
-        conn = get_db_connection()
+        machine_id = request.args.get('machineId', machines.DEFAULT_MACHINE_ID)
+        levels = ingredient_levels.get(machine_id)
+        return jsonify(dict(levels, success=True))
+    except Exception as e:
+        logger.error(f"Ошибка получения уровней ингредиентов: {str(e)}")
+        return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
+
+# Уровни для /ingredients/levels: одно чтение на машину, сколько бы запросов его ни ждали.
+# Уровни меняет каждый заказ, поэтому после заказа и по истечении ttl читатели получают
+# прежние уровни (не старше LEVELS_MAX_STALE), пока новые читаются в фоне
+LEVELS_CACHE_TTL = float(os.environ.get('LEVELS_CACHE_TTL', 1))
+LEVELS_MAX_STALE = float(os.environ.get('LEVELS_MAX_STALE', 30))
+
+def build_ingredient_levels(machine_id):
+    conn = get_read_connection()
+    if not conn:
+        raise ConnectionError("Не удалось подключиться к базе данных")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # machineId=all - сумма по всем машинам и разбивка по машинам
+        if machine_id == machines.ALL_MACHINES:
+            levels_by_machine = machines.fetch_all_levels(cursor)
+            return {
+                "ingredients": machines.aggregate_levels(levels_by_machine),
+                "machines": levels_by_machine
+            }
+        return {"ingredients": machines.fetch_levels(cursor, machine_id)}
+    finally:
+        cursor.close()
+        conn.close()
+
+ingredient_levels = StaleWhileRevalidate(build_ingredient_levels, LEVELS_CACHE_TTL, max_stale=LEVELS_MAX_STALE)
+
+# История уровня ингредиента
+@app.route('/ingredients/<ingredient_id>/history', methods=['GET'])
+def get_ingredient_history(ingredient_id):
+    """История уровня ингредиента: не больше points точек за любой интервал"""
+    try:
+        try:
+            end = float(request.args.get('to', time.time()))
+            start = float(request.args.get('from', end - 86400))
+            max_points = min(max(int(request.args.get('points', 200)), 1), 2000)
+        except ValueError:
+            return jsonify({"success": False, "message": "Неверные параметры from/to/points"}), 400
+        if start > end:
+            return jsonify({"success": False, "message": "from должен быть меньше to"}), 400
+        
+        conn = get_read_connection()
         if not conn:
             return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
         
         cursor = conn.cursor(dictionary=True)
-        
-        # Получаем ингредиенты
-        query = """
-        SELECT ingredient_id as ingredientId, name, current_level as currentLevel, max_level as maxLevel 
-        FROM ingredients
-        """
-        cursor.execute(query)
-        ingredients = cursor.fetchall()
-        
+        history_key = machines.history_key(request.args.get('machineId', machines.DEFAULT_MACHINE_ID), ingredient_id)
+        resolution, points = level_history.query_history(cursor, history_key, start, end, max_points)
         cursor.close()
         conn.close()
         
         return jsonify({
             "success": True,
-            "ingredients": ingredients
+            "ingredientId": ingredient_id,
+            "from": start,
+            "to": end,
+            "resolution": resolution,
+            "points": points
         })
     except Exception as e:
-        logger.error(f"Ошибка получения уровней ингредиентов: {str(e)}")
+        logger.error(f"Ошибка получения истории уровня: {str(e)}")
         return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
 
 # Проверка наличия ингредиентов
@@ -718,7 +1970,7 @@ def check_ingredients():
         if 'ingredients' not in data:
             return jsonify({"success": False, "message": "Отсутствует обязательное поле: ingredients"}), 400
         
-        conn = get_db_connection()
+        conn = get_read_connection()
         if not conn:
             return jsonify({"success": False, "message": "Не удалось подключиться к базе данных"}), 500
         
@@ -728,18 +1980,15 @@ def check_ingredients():
         requested_ingredients = data['ingredients']
         missing_ingredients = []
         
+        # Уровни всех запрошенных ингредиентов машины одним запросом
+        machine_id = data.get('machineId', machines.DEFAULT_MACHINE_ID)
+        levels = machines.levels_by_name(cursor, machine_id, list(requested_ingredients.keys()))
+        
         for name, amount in requested_ingredients.items():
-            # Ищем ингредиент по имени
-            query = """
-            SELECT current_level FROM ingredients WHERE name = %s
-            """
-            cursor.execute(query, (name,))
-            result = cursor.fetchone()
-            
-            if not result:
+            if name not in levels:
                 missing_ingredients.append(f"{name} (не доступен)")
-            elif result['current_level'] < amount:
-                missing_ingredients.append(f"{name} (требуется {amount} мл, доступно {result['current_level']} мл)")
+            elif levels[name] < amount:
+                missing_ingredients.append(f"{name} (требуется {amount} мл, доступно {levels[name]} мл)")
         
         cursor.close()
         conn.close()
@@ -778,15 +2027,30 @@ def update_ingredient_levels_admin():
         
         # Обновляем уровни
         updated_levels = data['updatedLevels']
-        for ingredient_id, level in updated_levels.items():
-            query = """
-            UPDATE ingredients
-            SET current_level = %s
-            WHERE ingredient_id = %s
-            """
-            cursor.execute(query, (level, ingredient_id))
+        
+        machine_id = data.get('machineId', machines.DEFAULT_MACHINE_ID)
+        if not isinstance(machine_id, str) or not machines.machine_is_active(cursor, machine_id):
+            cursor.close()
+            conn.close()
+            return jsonify({"success": False, "message": "Неверное значение machineId"}), 400
+        
+        # Прежние уровни (с блокировкой) - для истории изменений
+        before = machines.lock_levels_by_id(cursor, machine_id, list(updated_levels.keys()))
+        machines.set_levels(cursor, machine_id, updated_levels)
+        
+        level_history.record_changes(cursor, [
+            (machines.history_key(machine_id, ingredient_id), before.get(ingredient_id, 0), level)
+            for ingredient_id, level in updated_levels.items()
+            if ingredient_id in before or machine_id != machines.DEFAULT_MACHINE_ID
+        ], 'admin')
+        change_feed.record_many(cursor, level_change_records(machine_id, updated_levels))
         
         conn.commit()
+        note_write()
+        makeable_cache.invalidate_levels()
+        order_router.invalidate()
+        ingredient_levels.invalidate()
+        cache_bus.publish(('levels', None))
         cursor.close()
         conn.close()
         
@@ -798,6 +2062,20 @@ def update_ingredient_levels_admin():
         logger.error(f"Ошибка обновления уровней ингредиентов: {str(e)}")
         return jsonify({"success": False, "message": f"Ошибка сервера: {str(e)}"}), 500
 
+# Режим обслуживания: 'wsgi' (по умолчанию) или 'async'
+SERVING_MODE = os.environ.get('SERVING_MODE', 'wsgi')
+ASYNC_DB_WORKERS = int(os.environ.get('ASYNC_DB_WORKERS', 8))
+
 if __name__ == '__main__':
-    logger.info("Запуск сервера Mocktail Machine с MySQL...")
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    if SERVING_MODE == 'async':
+        logger.info("Запуск сервера Mocktail Machine с MySQL (asyncio)...")
+        start_background_tasks()
+        async_server.run(app, host='0.0.0.0', port=5001, max_workers=ASYNC_DB_WORKERS, watch=order_watch,
+                         recheck_interval=ORDER_WAIT_RECHECK_INTERVAL, max_wait=ORDER_WAIT_MAX_TIMEOUT)
+    else:
+        logger.info("Запуск сервера Mocktail Machine с MySQL...")
+        # Журнал, восстановленный при запуске, переносится сразу, а не с первым запросом;
+        # процесс-наблюдатель перезагрузчика (debug) запросы не обслуживает
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_tasks()
+        app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,221 @@
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import mysql.connector
+
+import change_feed
+from import_data import DATA_DIR, cache_bus, db_config
+
+# Политика хранения: завершённые и отменённые заказы старше ORDER_RETENTION_DAYS
+# переносятся в архивные таблицы (ARCHIVE_MODE=table) или в сжатый файл (ARCHIVE_MODE=file)
+RETENTION_DAYS = float(os.environ.get('ORDER_RETENTION_DAYS', 90))
+ARCHIVE_MODE = os.environ.get('ARCHIVE_MODE', 'table')
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(DATA_DIR, 'archive'))
+ARCHIVED_STATUSES = ('completed', 'cancelled')
+
+# Небольшие порции и пауза между ними: блокировки держатся миллисекунды,
+# а нагрузка на primary и репликацию ограничена
+CHUNK_SIZE = int(os.environ.get('ARCHIVE_CHUNK_SIZE', 500))
+PAUSE_SECONDS = float(os.environ.get('ARCHIVE_PAUSE_SECONDS', 0.5))
+
+# Заказов в одном сообщении шины инвалидаций: больше не уместится в датаграмму,
+# и получатели вместо отдельных заказов сбросили бы все кэши
+PUBLISH_BATCH = 200
+
+CREATE_TABLES = [
+    "CREATE TABLE IF NOT EXISTS orders_archive LIKE orders",
+    "CREATE TABLE IF NOT EXISTS order_ingredients_archive LIKE order_ingredients"
+]
+
+
+def table_columns(cursor, table):
+    cursor.execute("""
+        SELECT COLUMN_NAME
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_NAME = %s
+        AND TABLE_SCHEMA = %s
+        ORDER BY ORDINAL_POSITION
+    """, (table, db_config['database']))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def shared_columns(cursor, table, archive_table):
+    """Колонки, которые есть и в рабочей, и в архивной таблице"""
+    archive = set(table_columns(cursor, archive_table))
+    columns = table_columns(cursor, table)
+    missing = [column for column in columns if column not in archive]
+    if missing:
+        print(f"Внимание: колонок {missing} нет в {archive_table}, они не будут сохранены")
+    return [column for column in columns if column in archive]
+
+
+def count_eligible(cursor, cutoff):
+    placeholders = ', '.join(['%s'] * len(ARCHIVED_STATUSES))
+    cursor.execute(f"""
+    SELECT COUNT(*) FROM orders
+    WHERE status IN ({placeholders}) AND timestamp < %s
+    """, ARCHIVED_STATUSES + (cutoff,))
+    return cursor.fetchone()[0]
+
+
+def lock_chunk(cursor, cutoff, chunk_size):
+    """Самые старые подходящие заказы, заблокированные до конца транзакции.
+
+    Удалённые заказы больше не выбираются, поэтому прерванный запуск
+    просто продолжается следующим - отдельная контрольная точка не нужна.
+    """
+    placeholders = ', '.join(['%s'] * len(ARCHIVED_STATUSES))
+    cursor.execute(f"""
+    SELECT order_id FROM orders
+    WHERE status IN ({placeholders}) AND timestamp < %s
+    ORDER BY timestamp
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+    """, ARCHIVED_STATUSES + (cutoff, chunk_size))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def delete_chunk(cursor, order_ids):
+    placeholders = ', '.join(['%s'] * len(order_ids))
+    cursor.execute(f"DELETE FROM order_ingredients WHERE order_id IN ({placeholders})", tuple(order_ids))
+    cursor.execute(f"DELETE FROM orders WHERE order_id IN ({placeholders})", tuple(order_ids))
+    # Клиенты журнала изменений удаляют заказы у себя, а не ждут полной синхронизации
+    change_feed.record_many(cursor, [('order', order_id, 'delete', {"archived": True}) for order_id in order_ids])
+
+
+def publish_chunk(order_ids):
+    """Сброс перенесённых заказов в кэшах процессов сервера (после commit)"""
+    for start in range(0, len(order_ids), PUBLISH_BATCH):
+        cache_bus.publish(*[('order', order_id) for order_id in order_ids[start:start + PUBLISH_BATCH]])
+
+
+class TableArchive:
+    """Перенос в orders_archive / order_ingredients_archive в той же транзакции, что и удаление"""
+
+    def __init__(self, cursor):
+        for query in CREATE_TABLES:
+            cursor.execute(query)
+        self.order_columns = shared_columns(cursor, 'orders', 'orders_archive')
+        self.ingredient_columns = shared_columns(cursor, 'order_ingredients', 'order_ingredients_archive')
+
+    def write(self, cursor, order_ids):
+        placeholders = ', '.join(['%s'] * len(order_ids))
+        for table, columns in (('orders', self.order_columns), ('order_ingredients', self.ingredient_columns)):
+            column_list = ', '.join(columns)
+            # INSERT IGNORE: порция, уже перенесённая до сбоя, не дублируется
+            cursor.execute(f"""
+            INSERT IGNORE INTO {table}_archive ({column_list})
+            SELECT {column_list} FROM {table} WHERE order_id IN ({placeholders})
+            """, tuple(order_ids))
+
+    def close(self):
+        pass
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class FileArchive:
+    """Заказы с ингредиентами построчно (NDJSON) в gzip-файл; запись сбрасывается на диск до удаления"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"orders_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson.gz")
+        self._raw = open(self.path, 'ab')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='ab')
+        self.written = 0
+
+    def write(self, cursor, order_ids):
+        placeholders = ', '.join(['%s'] * len(order_ids))
+        cursor.execute(f"SELECT * FROM orders WHERE order_id IN ({placeholders})", tuple(order_ids))
+        columns = [column[0] for column in cursor.description]
+        orders = {row[columns.index('order_id')]: dict(zip(columns, map(_plain, row))) for row in cursor.fetchall()}
+        for order in orders.values():
+            order['ingredients'] = {}
+        cursor.execute(
+            f"SELECT order_id, ingredient_name, amount FROM order_ingredients WHERE order_id IN ({placeholders})",
+            tuple(order_ids)
+        )
+        for order_id, ingredient_name, amount in cursor.fetchall():
+            orders[order_id]['ingredients'][ingredient_name] = _plain(amount)
+
+        for order in orders.values():
+            order.pop('ingredients_json', None)
+            self._file.write((json.dumps(order, ensure_ascii=False) + "\n").encode('utf-8'))
+        # Файл на диске до удаления из БД: при сбое заказ может попасть в архив
+        # дважды (различается по order_id), но не потеряется
+        self._file.flush()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self.written += len(orders)
+
+    def close(self):
+        self._file.close()
+        self._raw.close()
+        if not self.written:
+            os.remove(self.path)
+
+
+def archive_orders(retention_days=RETENTION_DAYS, mode=ARCHIVE_MODE, chunk_size=CHUNK_SIZE, pause=PAUSE_SECONDS):
+    if mode not in ('table', 'file'):
+        raise ValueError(f"ARCHIVE_MODE должен быть table или file, получено: {mode}")
+    cutoff = time.time() - retention_days * 86400
+    print(f"Архивация заказов старше {retention_days:g} дн. (режим: {mode})...")
+
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    archive = None
+    archived = 0
+
+    try:
+        archive = TableArchive(cursor) if mode == 'table' else FileArchive(ARCHIVE_DIR)
+        conn.commit()
+        total = count_eligible(cursor, cutoff)
+        print(f"Заказов к архивации: {total}")
+        started = time.monotonic()
+
+        while True:
+            order_ids = lock_chunk(cursor, cutoff, chunk_size)
+            if not order_ids:
+                conn.commit()
+                break
+            # Архив и удаление - одна транзакция: заказ и его ингредиенты
+            # всегда находятся целиком либо в рабочих таблицах, либо в архиве
+            archive.write(cursor, order_ids)
+            delete_chunk(cursor, order_ids)
+            conn.commit()
+            publish_chunk(order_ids)
+
+            archived += len(order_ids)
+            elapsed = time.monotonic() - started
+            rate = archived / elapsed if elapsed > 0 else 0
+            print(f"Перенесено {archived}/{total} ({rate:.0f} заказов/с)")
+            time.sleep(pause)
+
+        print(f"Архивация завершена: {archived} заказов"
+              + (f", файл {archive.path}" if mode == 'file' else ""))
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при архивации заказов (перенесено {archived}, повторный запуск продолжит): {e}")
+
+    finally:
+        if archive is not None:
+            archive.close()
+        cursor.close()
+        conn.close()
+
+    return archived
+
+
+if __name__ == "__main__":
+    archive_orders()
@@ -0,0 +1,300 @@
+import asyncio
+import functools
+import io
+import json
+import logging
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import parse_qs, unquote_to_bytes
+
+logger = logging.getLogger('mocktail_server.async')
+
+# Ограничения на входящие запросы
+MAX_REQUEST_LINE = 8192
+MAX_HEADERS = 100
+MAX_BODY_SIZE = 1024 * 1024
+KEEPALIVE_TIMEOUT = 15
+
+# Маршрут ожидания смены статуса заказа (long poll)
+ORDER_WAIT_ROUTE = re.compile(r'^/order_status/([^/]+)/wait$')
+
+
+class RequestError(ValueError):
+    """Запрос, на который сервер отвечает status, не вызывая приложение"""
+
+    def __init__(self, message, status='400 Bad Request'):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncWSGIServer:
+    """HTTP-сервер на asyncio поверх того же Flask-приложения.
+
+    Соединения, чтение/запись на медленных клиентах и ожидание статуса
+    заказа - это корутины. Поток из ограниченного пула занимается только
+    на время выполнения самого обработчика (и его запросов к БД).
+    Ожидающих статуса будит watch (OrderWatch) при смене статуса; без
+    уведомления статус перечитывается раз в recheck_interval секунд.
+    """
+
+    def __init__(self, app, host='0.0.0.0', port=5001, max_workers=8,
+                 watch=None, recheck_interval=5, max_wait=60):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.watch = watch
+        self.recheck_interval = recheck_interval
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mocktail-db')
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                            limit=MAX_REQUEST_LINE)
+        logger.info(f"Асинхронный сервер запущен на {self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+
+                method, target, version, headers, body = request
+                keep_alive = self.wants_keep_alive(version, headers)
+                environ = self.build_environ(method, target, version, headers, body, peer)
+
+                match = ORDER_WAIT_ROUTE.match(environ['PATH_INFO']) if method == 'GET' else None
+                if match:
+                    status, response_headers, chunks = await self.wait_order_status(environ, match.group(1))
+                else:
+                    status, response_headers, chunks = await self.call_app(environ)
+
+                await self.write_response(writer, method, version, status, response_headers, chunks, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            await self.write_simple(writer, getattr(e, 'status', '400 Bad Request'), str(e))
+        except Exception as e:
+            logger.error(f"Ошибка обработки соединения: {str(e)}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').strip().split(' ', 2)
+        except ValueError:
+            raise ValueError('Malformed request line')
+
+        headers = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise ValueError('Too many headers')
+            name, _, value = line.decode('latin-1').partition(':')
+            headers.append((name.strip(), value.strip()))
+
+        lengths = set()
+        for name, value in headers:
+            name = name.lower()
+            if name == 'content-length':
+                lengths.add(value)
+            elif name == 'transfer-encoding' and value.lower() != 'identity':
+                # Тело по кускам не читается: клиент должен прислать Content-Length
+                raise RequestError('Transfer-Encoding is not supported', '501 Not Implemented')
+        if len(lengths) > 1:
+            raise RequestError('Conflicting Content-Length headers')
+        length = lengths.pop() if lengths else '0'
+        if not length.isdecimal():
+            raise RequestError('Invalid Content-Length')
+        length = int(length)
+        if length > MAX_BODY_SIZE:
+            raise RequestError('Request body too large', '413 Payload Too Large')
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, version, headers, body
+
+    @staticmethod
+    def wants_keep_alive(version, headers):
+        connection = ''
+        for name, value in headers:
+            if name.lower() == 'connection':
+                connection = value.lower()
+        if version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def build_environ(self, method, target, version, headers, body, peer):
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers:
+            key = name.upper().replace('-', '_')
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+                continue
+            key = 'HTTP_' + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def call_app(self, environ):
+        """Выполнение Flask-приложения в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        status, headers, result = await loop.run_in_executor(self.executor, self.run_app, environ)
+        return status, headers, self.iter_body(loop, result)
+
+    def run_app(self, environ):
+        captured = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            return written.append
+
+        result = self.app(environ, start_response)
+        if written:
+            result = written + list(result)
+        return captured['status'], captured['headers'], result
+
+    async def iter_body(self, loop, result):
+        # Тело читается по кускам в пуле: генераторы (стриминг) могут ходить в БД
+        iterator = iter(result)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    yield chunk
+        finally:
+            close = getattr(result, 'close', None)
+            if close:
+                await loop.run_in_executor(self.executor, close)
+
+    async def wait_order_status(self, environ, order_id):
+        """Long poll статуса заказа: ожидание - корутина, а не поток.
+
+        Обработчик (поток пула) выполняется при входе, при уведомлении о смене
+        статуса и раз в recheck_interval, а не на каждом шаге опроса.
+        """
+        params = parse_qs(environ['QUERY_STRING'])
+        known = params.get('known', [None])[0]
+        try:
+            timeout = min(float(params.get('timeout', [30])[0]), self.max_wait)
+        except ValueError:
+            timeout = self.max_wait
+
+        status_environ = dict(environ)
+        status_environ['PATH_INFO'] = f"/order_status/{order_id}"
+        status_environ['QUERY_STRING'] = ''
+        status_environ.pop('HTTP_ACCEPT_ENCODING', None)
+        deadline = time.monotonic() + timeout
+        changed = asyncio.Event()
+        wake = functools.partial(asyncio.get_running_loop().call_soon_threadsafe, changed.set)
+        if self.watch is not None:
+            # Подписка до чтения статуса: смена между чтением и ожиданием не теряется
+            self.watch.subscribe(order_id, wake)
+        try:
+            while True:
+                changed.clear()
+                status_environ['wsgi.input'] = io.BytesIO(b'')
+                status, headers, chunks = await self.call_app(status_environ)
+                body = b''.join([chunk async for chunk in chunks])
+                remaining = deadline - time.monotonic()
+                if not status.startswith('200') or remaining <= 0:
+                    break
+                try:
+                    current = json.loads(body)['order']['status']
+                except (ValueError, KeyError, TypeError):
+                    break
+                if known is None or current != known:
+                    break
+                try:
+                    await asyncio.wait_for(changed.wait(), min(self.recheck_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self.watch is not None:
+                self.watch.unsubscribe(order_id, wake)
+
+        async def single():
+            yield body
+        return status, headers, single()
+
+    async def write_response(self, writer, method, version, status, headers, chunks, keep_alive):
+        header_names = {name.lower() for name, _ in headers}
+        chunked = 'content-length' not in header_names and version == 'HTTP/1.1'
+        if 'content-length' not in header_names and not chunked:
+            keep_alive = False
+
+        lines = [f"{version} {status}"]
+        lines.extend(f"{name}: {value}" for name, value in headers)
+        if 'date' not in header_names:
+            lines.append(f"Date: {formatdate(usegmt=True)}")
+        if chunked:
+            lines.append('Transfer-Encoding: chunked')
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        async for chunk in chunks:
+            if method == 'HEAD':
+                continue
+            if chunked:
+                writer.write(f"{len(chunk):X}\r\n".encode('latin-1') + chunk + b'\r\n')
+            else:
+                writer.write(chunk)
+            await writer.drain()
+        if chunked and method != 'HEAD':
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    @staticmethod
+    async def write_simple(writer, status, message):
+        body = message.encode('utf-8')
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+def run(app, host='0.0.0.0', port=5001, max_workers=8, watch=None, recheck_interval=5, max_wait=60):
+    """Запуск асинхронного режима обслуживания"""
+    server = AsyncWSGIServer(app, host, port, max_workers, watch, recheck_interval, max_wait)
+    asyncio.run(server.serve_forever())
@@ -0,0 +1,70 @@
+import threading
+
+from single_flight import StaleWhileRevalidate
+
+
+class CatalogSnapshot:
+    """Каталог коктейлей в памяти процесса.
+
+    loader() возвращает список коктейлей (как fetch_catalog). Снимок
+    перезагружается после invalidate() или по истечении ttl секунд;
+    version растёт при каждой перезагрузке, и производные структуры
+    (индексы, матрицы) перестраиваются, только когда она изменилась.
+    Перезагрузка одна на процесс, сколько бы запросов её ни ждали;
+    после invalidate(keep_stale=True) запросы получают прежний снимок,
+    пока новый загружается в фоне. latest() отдаёт последний загруженный
+    снимок даже после invalidate() - для поиска коктейля по id или
+    названию, которые от записи отзывов не меняются.
+    """
+
+    def __init__(self, loader, ttl=60):
+        self.loader = loader
+        self.version = 0
+        self._snapshots = StaleWhileRevalidate(self._load, ttl)
+        self._latest = None
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        mocktails = self.loader()
+        with self._lock:
+            self.version += 1
+            self._latest = self.version, mocktails
+            return self._latest
+
+    def get(self):
+        """(version, mocktails) - актуальный снимок каталога"""
+        return self._snapshots.get()
+
+    def latest(self):
+        """(version, mocktails) - последний загруженный снимок; устаревший обновляется в фоне"""
+        with self._lock:
+            latest = self._latest
+        if latest is None:
+            return self.get()
+        self._snapshots.refresh()
+        return latest
+
+    def invalidate(self, keep_stale=False):
+        self._snapshots.invalidate(keep_stale=keep_stale)
+
+    def status(self):
+        return dict(self._snapshots.status(), version=self.version)
+
+
+class Derived:
+    """Структура, построенная по снимку каталога и перестраиваемая при смене версии"""
+
+    def __init__(self, catalog, build):
+        self.catalog = catalog
+        self.build = build
+        self._version = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        version, mocktails = self.catalog.get()
+        with self._lock:
+            if self._version != version:
+                self._value = self.build(mocktails)
+                self._version = version
+            return self._value
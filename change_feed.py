@@ -0,0 +1,142 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger('mocktail_server.changes')
+
+# Сколько хранить записи журнала изменений (клиент, отставший сильнее, делает полную синхронизацию)
+RETENTION = 7 * 86400
+
+# Пропуск в версиях моложе этого считается незавершённой транзакцией:
+# AUTO_INCREMENT выдаётся при вставке, а видна запись только после commit
+GAP_GRACE = 5.0
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS change_log (
+        version BIGINT AUTO_INCREMENT PRIMARY KEY,
+        entity VARCHAR(16) NOT NULL,
+        entity_id VARCHAR(128) NOT NULL,
+        op VARCHAR(8) NOT NULL,
+        data TEXT NULL,
+        created_at DOUBLE NOT NULL,
+        INDEX idx_change_log_created_at (created_at)
+    )
+    """
+]
+
+
+def record(cursor, entity, entity_id, op, data=None, ts=None):
+    """Запись изменения в той же транзакции, что и само изменение"""
+    record_many(cursor, [(entity, entity_id, op, data)], ts)
+
+
+def record_many(cursor, changes, ts=None):
+    """changes - список (entity, entity_id, op, data)"""
+    if not changes:
+        return
+    ts = time.time() if ts is None else ts
+    cursor.executemany("""
+    INSERT INTO change_log (entity, entity_id, op, data, created_at)
+    VALUES (%s, %s, %s, %s, %s)
+    """, [
+        (entity, str(entity_id), op,
+         json.dumps(data, ensure_ascii=False, separators=(',', ':')) if data is not None else None, ts)
+        for entity, entity_id, op, data in changes
+    ])
+
+
+def read_changes(cursor, since, limit, now=None):
+    """Изменения после версии since (dictionary-курсор, два запроса).
+
+    Возвращает (changes, version, resync_required, has_more); version - до какой
+    версии клиент получил всё. Пропуск в версиях моложе GAP_GRACE останавливает
+    выдачу: следующий запрос вернёт запись, когда её транзакция завершится.
+    """
+    now = time.time() if now is None else now
+    cursor.execute("SELECT MIN(version) as oldest, MAX(version) as latest FROM change_log")
+    bounds = cursor.fetchone()
+    oldest, latest = bounds['oldest'], bounds['latest']
+
+    if since is None or (latest is not None and since > latest) or (oldest is not None and since < oldest - 1):
+        return [], latest or 0, True, False
+    if latest is None or since == latest:
+        return [], since, False, False
+
+    cursor.execute("""
+    SELECT version, entity, entity_id, op, data, created_at FROM change_log
+    WHERE version > %s
+    ORDER BY version
+    LIMIT %s
+    """, (since, limit + 1))
+    rows = cursor.fetchall()
+
+    changes = []
+    version = since
+    for row in rows[:limit]:
+        if row['version'] != version + 1 and now - row['created_at'] < GAP_GRACE:
+            return changes, version, False, True
+        changes.append({
+            "version": row['version'],
+            "entity": row['entity'],
+            "id": row['entity_id'],
+            "op": row['op'],
+            "data": json.loads(row['data']) if row['data'] is not None else None,
+            "ts": row['created_at']
+        })
+        version = row['version']
+    return changes, version, False, len(rows) > limit
+
+
+def prune(cursor, commit, now=None, chunk_size=1000):
+    """Удаление записей старше RETENTION порциями; последняя запись остаётся всегда"""
+    now = time.time() if now is None else now
+    cursor.execute("SELECT MAX(version) FROM change_log")
+    latest = cursor.fetchone()[0]
+    if latest is None:
+        return 0
+    deleted = 0
+    while True:
+        cursor.execute(f"""
+        DELETE FROM change_log
+        WHERE created_at < %s AND version < %s
+        LIMIT {int(chunk_size)}
+        """, (now - RETENTION, latest))
+        commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < chunk_size:
+            return deleted
+
+
+class ChangeLogPruner:
+    """Фоновая очистка журнала изменений раз в interval секунд"""
+
+    def __init__(self, get_connection, interval=3600):
+        self.get_connection = get_connection
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='change-log-pruner', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            conn = self.get_connection()
+            if not conn:
+                continue
+            cursor = conn.cursor()
+            try:
+                deleted = prune(cursor, conn.commit)
+                if deleted:
+                    logger.info(f"Журнал изменений: удалено {deleted} устаревших записей")
+            except Exception as e:
+                logger.error(f"Ошибка очистки журнала изменений: {e}")
+            finally:
+                cursor.close()
+                conn.close()
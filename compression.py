@@ -0,0 +1,133 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+# brotli - необязательная зависимость, без неё отдаём только gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Кодировки в порядке предпочтения сервера
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+def choose_encoding(accept_encoding):
+    """Выбор кодировки по заголовку Accept-Encoding (с учётом q-значений)"""
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for part in accept_encoding.split(','):
+        item = part.strip()
+        if not item:
+            continue
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best = None
+    best_q = 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding, level):
+    """Сжатие тела ответа выбранной кодировкой"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class CompressedBodyCache:
+    """LRU-кэш сжатых тел, ключ - хэш исходных байт, кодировка и уровень.
+
+    Одинаковые (закэшированные) ответы сжимаются один раз, дальше
+    сжатая версия хранится рядом с исходной и отдаётся без затрат CPU.
+    Размер ограничен и числом записей, и суммой сжатых байт (max_bytes).
+    """
+
+    def __init__(self, max_entries=256, max_body_size=4 * 1024 * 1024, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_body_size = max_body_size
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compress(self, body, encoding, level):
+        if len(body) > self.max_body_size:
+            return compress(body, encoding, level)
+
+        key = (hashlib.sha1(body).digest(), encoding, level)
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compressed
+
+        compressed = compress(body, encoding, level)
+        with self._lock:
+            self.misses += 1
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = compressed
+            self._bytes += len(compressed)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return compressed
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+def compress_response(response, accept_encoding, cache, min_size, levels, cacheable=True):
+    """Сжимает JSON-ответ Flask, если клиент это поддерживает и тело достаточно большое.
+
+    cacheable=False - тело уникально для запроса (заказ, страница отзывов),
+    его сжатая версия в кэш не кладётся.
+    """
+    if response.mimetype != 'application/json':
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if (response.status_code < 200 or response.status_code >= 300
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    encoding = choose_encoding(accept_encoding)
+    if not encoding:
+        return response
+
+    if cacheable:
+        compressed = cache.get_or_compress(body, encoding, levels[encoding])
+    else:
+        compressed = compress(body, encoding, levels[encoding])
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = str(len(compressed))
+    return response
@@ -0,0 +1,117 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('mocktail_server.db')
+
+
+def mysql_replica_lag(connection):
+    """Отставание реплики MySQL в секундах (0 - если сервер не реплика)"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except Exception:
+            cursor.execute("SHOW SLAVE STATUS")
+        status = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if not status:
+        return 0
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    # NULL означает, что репликация остановлена
+    return float('inf') if lag is None else float(lag)
+
+
+class ReplicaRouter:
+    """Маршрутизация соединений: запись - на primary, чтение - на реплики.
+
+    Реплика пропускается, если она недоступна (на retry_after секунд) или
+    отстаёт больше чем на max_lag секунд; тогда чтение идёт на primary.
+    Заказы, записанные недавно (окно read_your_writes_window), читаются с
+    primary, чтобы клиент видел свой только что созданный заказ.
+
+    connect и lag_probe подменяются в тестах (например, двумя SQLite-базами).
+    """
+
+    def __init__(self, primary_config, replica_configs, connect, lag_probe=mysql_replica_lag,
+                 max_lag=5, lag_check_interval=2, retry_after=10,
+                 read_your_writes_window=15, max_tracked_writes=10000):
+        self.primary_config = primary_config
+        self.replica_configs = list(replica_configs)
+        self.connect = connect
+        self.lag_probe = lag_probe
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.retry_after = retry_after
+        self.read_your_writes_window = max(read_your_writes_window, max_lag)
+        self.max_tracked_writes = max_tracked_writes
+
+        self._lock = threading.Lock()
+        self._next_replica = itertools.cycle(range(len(self.replica_configs)))
+        self._down_until = {}
+        self._lag_checked_at = {}
+        self._recent_writes = OrderedDict()
+
+    def primary(self):
+        return self.connect(**self.primary_config)
+
+    def note_write(self, key):
+        """Запоминаем ключ (например, order_id), записанный на primary"""
+        if key is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._recent_writes[key] = now
+            self._recent_writes.move_to_end(key)
+            while len(self._recent_writes) > self.max_tracked_writes:
+                self._recent_writes.popitem(last=False)
+
+    def written_recently(self, key):
+        if key is None:
+            return False
+        with self._lock:
+            written_at = self._recent_writes.get(key)
+        return written_at is not None and time.monotonic() - written_at < self.read_your_writes_window
+
+    def read(self, key=None, force_primary=False):
+        """Соединение для чтения: реплика, если можно, иначе primary"""
+        if force_primary or not self.replica_configs or self.written_recently(key):
+            return self.primary()
+
+        for _ in range(len(self.replica_configs)):
+            with self._lock:
+                index = next(self._next_replica)
+            connection = self._connect_replica(index)
+            if connection is not None:
+                return connection
+        return self.primary()
+
+    def _connect_replica(self, index):
+        now = time.monotonic()
+        if self._down_until.get(index, 0) > now:
+            return None
+
+        try:
+            connection = self.connect(**self.replica_configs[index])
+        except Exception as e:
+            logger.warning(f"Реплика {index} недоступна: {e}")
+            self._down_until[index] = now + self.retry_after
+            return None
+
+        if now - self._lag_checked_at.get(index, float('-inf')) >= self.lag_check_interval:
+            try:
+                lag = self.lag_probe(connection)
+            except Exception as e:
+                logger.warning(f"Не удалось проверить отставание реплики {index}: {e}")
+                lag = float('inf')
+            if lag > self.max_lag:
+                logger.warning(f"Реплика {index} отстаёт на {lag} с, чтение с primary")
+                connection.close()
+                self._down_until[index] = now + self.lag_check_interval
+                return None
+            self._lag_checked_at[index] = now
+        return connection
@@ -0,0 +1,172 @@
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+from decimal import Decimal
+
+logger = logging.getLogger('mocktail_server.export')
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# Сколько строк забирать с сервера за раз (память ответа не зависит от объёма выгрузки)
+FETCH_SIZE = 500
+
+# Строки отправляются кусками примерно такого размера, а не по одной
+CHUNK_SIZE = 16 * 1024
+
+ORDER_COLUMNS = ['order_id', 'mocktail_name', 'timestamp', 'status', 'total_volume', 'machine_id', 'ingredients']
+REVIEW_COLUMNS = ['review_id', 'mocktail_id', 'user_name', 'rating', 'comment', 'created_at']
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _rows(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def order_filters(since=None, until=None, statuses=None, machine_id=None):
+    """Условие WHERE и параметры для выгрузки заказов"""
+    conditions, params = [], []
+    if since is not None:
+        conditions.append("o.timestamp >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("o.timestamp < %s")
+        params.append(until)
+    if statuses:
+        conditions.append(f"o.status IN ({', '.join(['%s'] * len(statuses))})")
+        params.extend(statuses)
+    if machine_id:
+        conditions.append("o.machine_id = %s")
+        params.append(machine_id)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def iter_orders(cursor, since=None, until=None, statuses=None, machine_id=None):
+    """Заказы с ингредиентами в порядке времени.
+
+    Один запрос с LEFT JOIN, отсортированный по (timestamp, order_id):
+    строки одного заказа идут подряд и собираются без накопления.
+    Запрос выполняется сразу, чтобы ошибка БД вернулась до начала ответа.
+    """
+    where, params = order_filters(since, until, statuses, machine_id)
+    cursor.execute(f"""
+    SELECT o.order_id, o.mocktail_name, o.timestamp, o.status, o.total_volume, o.machine_id,
+           oi.ingredient_name, oi.amount
+    FROM orders o
+    LEFT JOIN order_ingredients oi ON oi.order_id = o.order_id
+    {where}
+    ORDER BY o.timestamp, o.order_id
+    """, tuple(params))
+    return _group_orders(cursor)
+
+
+def _group_orders(cursor):
+    order = None
+    for row in _rows(cursor):
+        if order is None or order['order_id'] != row['order_id']:
+            if order is not None:
+                yield order
+            order = {column: _plain(row[column]) for column in ORDER_COLUMNS[:-1]}
+            order['ingredients'] = {}
+        if row['ingredient_name'] is not None:
+            order['ingredients'][row['ingredient_name']] = _plain(row['amount'])
+    if order is not None:
+        yield order
+
+
+def iter_reviews(cursor, since=None, until=None, mocktail_id=None):
+    """Отзывы в порядке создания"""
+    conditions, params = [], []
+    if since is not None:
+        conditions.append("created_at >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("created_at < %s")
+        params.append(until)
+    if mocktail_id:
+        conditions.append("mocktail_id = %s")
+        params.append(mocktail_id)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    cursor.execute(f"""
+    SELECT {', '.join(REVIEW_COLUMNS)} FROM reviews
+    {where}
+    ORDER BY created_at, review_id
+    """, tuple(params))
+    return ({column: _plain(row[column]) for column in REVIEW_COLUMNS} for row in _rows(cursor))
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def csv_lines(records, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for record in records:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([
+            json.dumps(record[column], ensure_ascii=False) if isinstance(record[column], dict) else record[column]
+            for column in columns
+        ])
+        yield buffer.getvalue()
+
+
+def encode(records, export_format, columns):
+    if export_format == 'csv':
+        return _chunks(csv_lines(records, columns))
+    return _chunks(ndjson_lines(records))
+
+
+def _chunks(lines):
+    parts, size = [], 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(parts)
+            parts, size = [], 0
+    if parts:
+        yield "".join(parts)
+
+
+def open_cursor(conn):
+    """Небуферизованный курсор: строки читаются с сервера по мере отправки"""
+    return conn.cursor(dictionary=True, buffered=False)
+
+
+def stream(conn, cursor, records, export_format, columns):
+    """Генератор тела ответа; соединение закрывается и при обрыве клиента"""
+    try:
+        yield from encode(records, export_format, columns)
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки: {e}")
+        raise
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            # Выгрузка прервана - непрочитанные строки остаются на соединении
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -2,6 +2,11 @@ import mysql.connector
 import json
 import os
 
+import change_feed
+from invalidation_bus import InvalidationBus
+import level_history
+import machines
+
 # Параметры подключения к базе данных
 db_config = {
     'host': '172.20.10.4',
@@ -10,6 +15,9 @@ db_config = {
     'database': 'mocktail_machine'
 }
 
+# Уведомление запущенных процессов сервера об изменённых данных
+cache_bus = InvalidationBus()
+
 # Путь к данным
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 if not os.path.exists(DATA_DIR):
@@ -109,6 +117,235 @@ def update_table_structure():
         cursor.close()
         conn.close()
 
+# Проверка наличия колонки в таблице
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) 
+        FROM INFORMATION_SCHEMA.COLUMNS 
+        WHERE TABLE_NAME = %s 
+        AND COLUMN_NAME = %s
+        AND TABLE_SCHEMA = %s
+    """, (table, column, db_config['database']))
+    return cursor.fetchone()[0] > 0
+
+# Проверка наличия индекса в таблице
+def index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) 
+        FROM INFORMATION_SCHEMA.STATISTICS 
+        WHERE TABLE_NAME = %s 
+        AND INDEX_NAME = %s
+        AND TABLE_SCHEMA = %s
+    """, (table, index, db_config['database']))
+    return cursor.fetchone()[0] > 0
+
+# Колонки аренды заказов контроллерами диспенсеров
+def update_order_claim_structure():
+    print("Обновление структуры таблицы orders для аренды заказов...")
+    
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    
+    try:
+        columns = [
+            ('claimed_by', "VARCHAR(64) NULL"),
+            ('lease_expires_at', "DOUBLE NULL"),
+            ('attempts', "INT NOT NULL DEFAULT 0")
+        ]
+        for column, definition in columns:
+            if not column_exists(cursor, 'orders', column):
+                print(f"Добавление колонки {column} в таблицу orders")
+                cursor.execute(f"ALTER TABLE orders ADD COLUMN {column} {definition}")
+        
+        if not index_exists(cursor, 'orders', 'idx_orders_status_timestamp'):
+            print("Добавление индекса idx_orders_status_timestamp")
+            cursor.execute("CREATE INDEX idx_orders_status_timestamp ON orders (status, timestamp)")
+        
+        conn.commit()
+        print("Структура таблицы orders обновлена")
+    
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при обновлении таблицы orders: {e}")
+    
+    finally:
+        cursor.close()
+        conn.close()
+
+# Индексы для потоковой выгрузки по времени (/export/orders, /export/reviews)
+def create_export_indexes():
+    print("Создание индексов для выгрузки...")
+    
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    
+    try:
+        indexes = [
+            ('orders', 'idx_orders_timestamp', "timestamp"),
+            ('reviews', 'idx_reviews_created_at', "created_at")
+        ]
+        for table, index, columns in indexes:
+            if not index_exists(cursor, table, index):
+                print(f"Добавление индекса {index}")
+                cursor.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+        conn.commit()
+        print("Индексы для выгрузки готовы")
+    
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при создании индексов для выгрузки: {e}")
+    
+    finally:
+        cursor.close()
+        conn.close()
+
+# Индекс для страниц отзывов коктейля (/reviews/<mocktail_id>)
+def create_review_page_index():
+    print("Создание индекса страниц отзывов...")
+    
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    
+    try:
+        if not index_exists(cursor, 'reviews', 'idx_reviews_mocktail_created'):
+            print("Добавление индекса idx_reviews_mocktail_created")
+            cursor.execute("CREATE INDEX idx_reviews_mocktail_created ON reviews (mocktail_id, created_at)")
+        conn.commit()
+        print("Индекс страниц отзывов готов")
+    
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при создании индекса страниц отзывов: {e}")
+    
+    finally:
+        cursor.close()
+        conn.close()
+
+# Создание таблицы журнала изменений (дельта-синхронизация клиентов, /changes)
+def create_change_log_table():
+    print("Создание таблицы журнала изменений...")
+    
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    
+    try:
+        for query in change_feed.CREATE_TABLES:
+            cursor.execute(query)
+        conn.commit()
+        print("Таблица журнала изменений готова")
+    
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при создании таблицы журнала изменений: {e}")
+    
+    finally:
+        cursor.close()
+        conn.close()
+
+# Создание таблиц истории уровней ингредиентов
+def create_level_history_tables():
+    print("Создание таблиц истории уровней ингредиентов...")
+    
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    
+    try:
+        for query in level_history.CREATE_TABLES:
+            cursor.execute(query)
+        conn.commit()
+        print("Таблицы истории уровней готовы")
+    
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при создании таблиц истории уровней: {e}")
+    
+    finally:
+        cursor.close()
+        conn.close()
+
+# Таблицы машин и колонка машины в заказах
+def create_machine_tables():
+    print("Создание таблиц машин...")
+    
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    
+    try:
+        for query in machines.CREATE_TABLES:
+            cursor.execute(query)
+        
+        if not column_exists(cursor, 'orders', 'machine_id'):
+            print("Добавление колонки machine_id в таблицу orders")
+            cursor.execute(
+                f"ALTER TABLE orders ADD COLUMN machine_id VARCHAR(64) NOT NULL DEFAULT '{machines.DEFAULT_MACHINE_ID}'"
+            )
+        
+        if not index_exists(cursor, 'orders', 'idx_orders_machine_status'):
+            print("Добавление индекса idx_orders_machine_status")
+            cursor.execute("CREATE INDEX idx_orders_machine_status ON orders (machine_id, status, timestamp)")
+        
+        conn.commit()
+        print("Таблицы машин готовы")
+    
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при создании таблиц машин: {e}")
+    
+    finally:
+        cursor.close()
+        conn.close()
+
+# Ингредиенты заказа в самой строке orders (ingredients_json) и перенос для старых заказов
+def backfill_order_ingredients(batch_size=1000):
+    print("Заполнение orders.ingredients_json...")
+    
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    
+    try:
+        if not column_exists(cursor, 'orders', 'ingredients_json'):
+            print("Добавление колонки ingredients_json в таблицу orders")
+            cursor.execute("ALTER TABLE orders ADD COLUMN ingredients_json TEXT NULL")
+            conn.commit()
+        
+        total = 0
+        while True:
+            cursor.execute(
+                "SELECT order_id FROM orders WHERE ingredients_json IS NULL LIMIT %s", (batch_size,)
+            )
+            order_ids = [row[0] for row in cursor.fetchall()]
+            if not order_ids:
+                break
+            
+            placeholders = ', '.join(['%s'] * len(order_ids))
+            cursor.execute(f"""
+            SELECT order_id, ingredient_name, amount FROM order_ingredients
+            WHERE order_id IN ({placeholders})
+            """, tuple(order_ids))
+            ingredients = {order_id: {} for order_id in order_ids}
+            for order_id, ingredient_name, amount in cursor.fetchall():
+                ingredients[order_id][ingredient_name] = amount
+            
+            cursor.executemany("""
+            UPDATE orders SET ingredients_json = %s WHERE order_id = %s
+            """, [
+                (json.dumps(items, ensure_ascii=False, separators=(',', ':')), order_id)
+                for order_id, items in ingredients.items()
+            ])
+            conn.commit()
+            total += len(order_ids)
+            print(f"Обработано заказов: {total}")
+        
+        print("Колонка ingredients_json заполнена")
+    
+    except Exception as e:
+        conn.rollback()
+        print(f"Ошибка при заполнении ingredients_json: {e}")
+    
+    finally:
+        cursor.close()
+        conn.close()
+
 # Обновление ингредиентов (вместо удаления и повторной вставки)
 def update_ingredients():
     # Проверяем наличие файла ингредиентов
@@ -126,10 +363,11 @@ def update_ingredients():
         for ingredient in ingredients:
             # Проверяем, существует ли ингредиент
             cursor.execute(
-                "SELECT COUNT(*) FROM ingredients WHERE ingredient_id = %s", 
+                "SELECT current_level FROM ingredients WHERE ingredient_id = %s", 
                 (ingredient['ingredientId'],)
             )
-            if cursor.fetchone()[0] > 0:
+            existing = cursor.fetchone()
+            if existing:
                 # Обновляем существующий ингредиент
                 query = """
                 UPDATE ingredients
@@ -143,6 +381,11 @@ def update_ingredients():
                     ingredient['ingredientId']
                 )
                 cursor.execute(query, values)
+                level_history.record_changes(
+                    cursor,
+                    [(ingredient['ingredientId'], existing[0], ingredient['currentLevel'])],
+                    'import'
+                )
                 print(f"Обновлен ингредиент: {ingredient['name']}")
             else:
                 # Вставляем новый ингредиент
@@ -159,8 +402,21 @@ def update_ingredients():
                 cursor.execute(query, values)
                 print(f"Добавлен новый ингредиент: {ingredient['name']}")
         
+        # Журнал изменений: клиенты получат новые уровни через /changes
+        change_feed.record_many(cursor, [
+            ('ingredient', ingredient['ingredientId'], 'update', {
+                "machineId": machines.DEFAULT_MACHINE_ID,
+                "ingredientId": ingredient['ingredientId'],
+                "name": ingredient['name'],
+                "currentLevel": ingredient['currentLevel'],
+                "maxLevel": ingredient['maxLevel']
+            })
+            for ingredient in ingredients
+        ])
+        
         # Сохранение изменений
         conn.commit()
+        cache_bus.publish(('levels', None))
         print(f"Обновление ингредиентов завершено")
     
     except Exception as e:
@@ -351,7 +607,14 @@ def update_mocktails():
                 else:
                     print(f"Внимание: Ингредиент '{ingredient_name}' не найден в базе данных")
         
+        # Журнал изменений: клиенты перезагрузят изменённые коктейли
+        change_feed.record_many(cursor, [
+            ('mocktail', mocktail['mocktail_id'], 'update', {"name": mocktail['name']})
+            for mocktail in mocktails
+        ])
+        
         conn.commit()
+        cache_bus.publish(('catalog', None))
         print(f"Обновление коктейлей завершено")
     
     except Exception as e:
@@ -366,6 +629,13 @@ if __name__ == "__main__":
     print("Начинаем обновление данных в базе данных mocktail_machine...")
     # Обновляем структуру таблиц для поддержки рейтингов
     update_table_structure()
+    create_change_log_table()
+    create_level_history_tables()
+    update_order_claim_structure()
+    create_export_indexes()
+    create_review_page_index()
+    create_machine_tables()
+    backfill_order_ingredients()
     update_ingredients()
     update_mocktails()
     print("Обновление данных завершено!")
@@ -0,0 +1,154 @@
+import atexit
+import errno
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import uuid
+
+logger = logging.getLogger('mocktail_server.bus')
+
+# Каталог сокетов: каждый процесс сервера слушает свой datagram-сокет,
+# публикация - рассылка сообщения во все сокеты каталога
+DEFAULT_DIRECTORY = os.environ.get('CACHE_BUS_DIR', os.path.join(tempfile.gettempdir(), 'mocktail-cache-bus'))
+
+# Сообщение больше этого заменяется сбросом всех кэшей
+MAX_MESSAGE_SIZE = 16 * 1024
+
+
+class InvalidationBus:
+    """Рассылка инвалидаций кэшей между процессами одной машины.
+
+    Сообщение - список ключей (тема, ключ), например ('order', order_id) или
+    ('catalog', None). Unix datagram-сокеты не требуют внешних сервисов и
+    доставляют сообщение за доли миллисекунды. Если сообщение потеряно
+    (переполнен буфер получателя), получатель видит пропуск в номерах
+    сообщений отправителя и сбрасывает все кэши: устаревание ограничено
+    следующим сообщением этого отправителя и TTL самих кэшей.
+    """
+
+    def __init__(self, handler=None, directory=DEFAULT_DIRECTORY):
+        self.handler = handler
+        self.directory = directory
+        self.origin = None
+        self.path = None
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.error = None
+        self._seq = 0
+        self._last_seen = {}
+        self._sender = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_process(self):
+        # После fork (воркеры с предзагрузкой приложения) у процесса своё имя и нумерация
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.origin = f"{self._pid}-{uuid.uuid4().hex[:8]}"
+            self._seq = 0
+            self._sender = None
+            self._thread = None
+            self.path = None
+
+    def start(self):
+        """Начать приём сообщений других процессов (нужен handler)"""
+        with self._lock:
+            self._ensure_process()
+            if self._thread is not None or self.error:
+                return
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"{self.origin}.sock")
+                receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                receiver.bind(path)
+            except OSError as e:
+                # Без шины кэши процесса устаревают не дольше своего TTL
+                self.error = str(e)
+                logger.error(f"Шина инвалидации недоступна: {e}")
+                return
+            self.path = path
+            atexit.register(self.close)
+            self._thread = threading.Thread(target=self._run, args=(receiver,), name='cache-bus', daemon=True)
+            self._thread.start()
+
+    def publish(self, *keys):
+        """Разослать ключи всем остальным процессам; ошибки доставки не прерывают запись"""
+        if not keys:
+            return
+        with self._lock:
+            self._ensure_process()
+            self._seq += 1
+            message = {"origin": self.origin, "seq": self._seq, "keys": [list(key) for key in keys]}
+            data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+            if len(data) > MAX_MESSAGE_SIZE:
+                message['keys'] = [['all', None]]
+                data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+            if self._sender is None:
+                self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self._sender.setblocking(False)
+            self.published += 1
+
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.sock') or path == self.path:
+                continue
+            try:
+                self._sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Процесс завершился, не удалив сокет
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.ENOBUFS):
+                    logger.error(f"Ошибка отправки инвалидации в {name}: {e}")
+                self.dropped += 1
+
+    def _run(self, receiver):
+        while True:
+            try:
+                data = receiver.recv(MAX_MESSAGE_SIZE + 1024)
+                message = json.loads(data)
+            except Exception as e:
+                logger.error(f"Ошибка приёма инвалидации: {e}")
+                continue
+            self.received += 1
+
+            keys = message['keys']
+            last = self._last_seen.get(message['origin'])
+            if last is not None and message['seq'] != last + 1:
+                keys = [['all', None]]
+            self._last_seen[message['origin']] = message['seq']
+
+            for topic, key in keys:
+                try:
+                    self.handler(topic, key)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки инвалидации {topic}/{key}: {e}")
+
+    def close(self):
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def status(self):
+        return {
+            "origin": self.origin,
+            "listening": self._thread is not None,
+            "error": self.error,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped
+        }
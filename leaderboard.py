@@ -0,0 +1,142 @@
+import bisect
+import threading
+import time
+from datetime import datetime
+
+DAY = 86400
+
+
+def as_timestamp(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value) if value is not None else time.time()
+
+
+class Leaderboard:
+    """Рейтинг коктейлей по байесовскому среднему, обновляемый инкрементально.
+
+    score = (C * m + сумма оценок) / (C + число оценок), где m - априорное
+    среднее, C - вес априорного значения. Варианты с затуханием считают
+    то же самое с весом отзыва 2 ** (возраст / период полураспада).
+    Для каждого варианта хранится отсортированный список, поэтому top(k)
+    стоит O(k), а изменение одного отзыва - один bisect.
+    """
+
+    def __init__(self, prior_weight=5.0, prior_mean=None, decay_half_lives=None, rebase_interval=3600):
+        self.prior_weight = prior_weight
+        self.fixed_prior_mean = prior_mean
+        self.prior_mean = prior_mean if prior_mean is not None else 3.0
+        self.half_lives = {'bayesian': None}
+        self.half_lives.update({name: days * DAY for name, days in (decay_half_lives or {}).items()})
+        self.rebase_interval = rebase_interval
+        self.loaded = False
+        self.generation = 0
+
+        self._lock = threading.RLock()
+        self._epoch = time.time()
+        self._rebased_at = self._epoch
+        self._stats = {}
+        self._scores = {}
+        self._ranked = {variant: [] for variant in self.half_lives}
+
+    def load(self, reviews, generation=None):
+        """Полное построение по списку (mocktail_id, rating, created_at).
+
+        generation - значение self.generation до чтения отзывов: если за время
+        чтения был invalidate(), рейтинг строится, но остаётся незагруженным.
+        """
+        with self._lock:
+            self._epoch = time.time()
+            self._rebased_at = self._epoch
+            self._stats = {}
+            total, count = 0.0, 0
+            for mocktail_id, rating, created_at in reviews:
+                self._accumulate(mocktail_id, float(rating), as_timestamp(created_at), 1)
+                total += float(rating)
+                count += 1
+            if self.fixed_prior_mean is None and count:
+                self.prior_mean = total / count
+            self._rescore_all()
+            self.loaded = generation is None or generation == self.generation
+
+    def invalidate(self):
+        """Отзывы изменены другим процессом - полная перезагрузка при следующем запросе"""
+        with self._lock:
+            self.loaded = False
+            self.generation += 1
+
+    def _weight(self, half_life, created_at):
+        return 2 ** ((created_at - self._epoch) / half_life)
+
+    def _accumulate(self, mocktail_id, rating, created_at, sign):
+        stats = self._stats.setdefault(mocktail_id, {
+            variant: [0.0, 0.0] for variant in self.half_lives
+        })
+        for variant, half_life in self.half_lives.items():
+            weight = 1.0 if half_life is None else self._weight(half_life, created_at)
+            stats[variant][0] += sign * weight * rating
+            stats[variant][1] += sign * weight
+        if stats['bayesian'][1] <= 0.5:
+            del self._stats[mocktail_id]
+
+    def _score(self, variant, mocktail_id):
+        stats = self._stats.get(mocktail_id)
+        if not stats:
+            return None
+        weighted_sum, weight = stats[variant]
+        half_life = self.half_lives[variant]
+        prior = self.prior_weight if half_life is None else \
+            self.prior_weight * self._weight(half_life, self._rebased_at)
+        return (prior * self.prior_mean + weighted_sum) / (prior + weight)
+
+    def _rescore_all(self):
+        self._scores = {}
+        for variant in self.half_lives:
+            entries = []
+            for mocktail_id in self._stats:
+                score = self._score(variant, mocktail_id)
+                self._scores[(variant, mocktail_id)] = score
+                entries.append((-score, mocktail_id))
+            entries.sort()
+            self._ranked[variant] = entries
+
+    def _rescore(self, mocktail_id):
+        for variant, ranked in self._ranked.items():
+            old = self._scores.pop((variant, mocktail_id), None)
+            if old is not None:
+                index = bisect.bisect_left(ranked, (-old, mocktail_id))
+                if index < len(ranked) and ranked[index] == (-old, mocktail_id):
+                    ranked.pop(index)
+            score = self._score(variant, mocktail_id)
+            if score is not None:
+                self._scores[(variant, mocktail_id)] = score
+                bisect.insort(ranked, (-score, mocktail_id))
+
+    def add(self, mocktail_id, rating, created_at):
+        with self._lock:
+            self._accumulate(mocktail_id, float(rating), as_timestamp(created_at), 1)
+            self._rescore(mocktail_id)
+
+    def remove(self, mocktail_id, rating, created_at):
+        with self._lock:
+            if mocktail_id in self._stats:
+                self._accumulate(mocktail_id, float(rating), as_timestamp(created_at), -1)
+            self._rescore(mocktail_id)
+
+    def update(self, mocktail_id, old_rating, new_rating, created_at):
+        with self._lock:
+            self.remove(mocktail_id, old_rating, created_at)
+            self.add(mocktail_id, new_rating, created_at)
+
+    def top(self, limit, variant='bayesian'):
+        """Первые limit коктейлей: (mocktail_id, score, число отзывов, среднее)"""
+        with self._lock:
+            if variant != 'bayesian' and time.time() - self._rebased_at > self.rebase_interval:
+                # Затухающие оценки зависят от текущего времени - пересчёт из агрегатов
+                self._rebased_at = time.time()
+                self._rescore_all()
+            result = []
+            for negative_score, mocktail_id in self._ranked[variant][:limit]:
+                weighted_sum, count = self._stats[mocktail_id]['bayesian']
+                result.append((mocktail_id, -negative_score, int(round(count)), weighted_sum / count))
+            return result
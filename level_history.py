@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('mocktail_server.history')
+
+# Разрешения агрегатов (секунды в корзине)
+RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Сколько хранить данные каждого разрешения (None - бессрочно)
+RETENTION = {
+    'raw': 2 * 86400,
+    'minute': 14 * 86400,
+    'hour': 400 * 86400,
+    'day': None
+}
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS ingredient_level_samples (
+        sample_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        ingredient_id VARCHAR(50) NOT NULL,
+        ts DOUBLE NOT NULL,
+        level FLOAT NOT NULL,
+        delta FLOAT NOT NULL,
+        source_type VARCHAR(16) NOT NULL,
+        source_id VARCHAR(64) NULL,
+        INDEX idx_level_samples_ingredient_ts (ingredient_id, ts),
+        INDEX idx_level_samples_ts (ts)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ingredient_level_rollups (
+        ingredient_id VARCHAR(50) NOT NULL,
+        resolution VARCHAR(8) NOT NULL,
+        bucket_start DOUBLE NOT NULL,
+        min_level FLOAT NOT NULL,
+        max_level FLOAT NOT NULL,
+        last_level FLOAT NOT NULL,
+        consumed FLOAT NOT NULL DEFAULT 0,
+        refilled FLOAT NOT NULL DEFAULT 0,
+        samples INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (ingredient_id, resolution, bucket_start),
+        INDEX idx_level_rollups_resolution (resolution, bucket_start)
+    )
+    """
+]
+
+
+def record_changes(cursor, changes, source_type, source_id=None, ts=None):
+    """Запись изменений уровней: changes - список (ingredient_id, старый, новый уровень).
+
+    Выполняется в транзакции изменения уровня; агрегаты minute/hour/day
+    обновляются сразу, поэтому запросы истории не зависят от фоновых задач.
+    """
+    ts = time.time() if ts is None else ts
+    changes = [(ingredient_id, float(old), float(new)) for ingredient_id, old, new in changes if old != new]
+    if not changes:
+        return
+
+    cursor.executemany("""
+    INSERT INTO ingredient_level_samples (ingredient_id, ts, level, delta, source_type, source_id)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    """, [(ingredient_id, ts, new, new - old, source_type, source_id) for ingredient_id, old, new in changes])
+
+    rows = []
+    for ingredient_id, old, new in changes:
+        consumed = max(old - new, 0)
+        refilled = max(new - old, 0)
+        for resolution, seconds in RESOLUTIONS.items():
+            bucket_start = ts - ts % seconds
+            rows.append((ingredient_id, resolution, bucket_start, new, new, new, consumed, refilled))
+    cursor.executemany("""
+    INSERT INTO ingredient_level_rollups
+        (ingredient_id, resolution, bucket_start, min_level, max_level, last_level, consumed, refilled, samples)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1)
+    ON DUPLICATE KEY UPDATE
+        min_level = LEAST(min_level, VALUES(min_level)),
+        max_level = GREATEST(max_level, VALUES(max_level)),
+        last_level = VALUES(last_level),
+        consumed = consumed + VALUES(consumed),
+        refilled = refilled + VALUES(refilled),
+        samples = samples + 1
+    """, rows)
+
+
+def choose_resolution(start, end, max_points, now=None):
+    """Самое подробное разрешение, дающее не больше max_points точек и ещё хранящееся"""
+    now = time.time() if now is None else now
+    for resolution in ('minute', 'hour', 'day'):
+        retention = RETENTION[resolution]
+        if retention is not None and start < now - retention:
+            continue
+        if (end - start) / RESOLUTIONS[resolution] <= max_points:
+            return resolution
+    return 'day'
+
+
+def query_history(cursor, ingredient_id, start, end, max_points):
+    """Не более max_points точек истории уровня за [start, end]"""
+    points = None
+    resolution = 'raw'
+    if start >= time.time() - RETENTION['raw']:
+        cursor.execute("""
+        SELECT ts, level, delta FROM ingredient_level_samples
+        WHERE ingredient_id = %s AND ts >= %s AND ts <= %s
+        ORDER BY ts
+        LIMIT %s
+        """, (ingredient_id, start, end, max_points + 1))
+        rows = cursor.fetchall()
+        if len(rows) <= max_points:
+            points = [{
+                "t": row['ts'],
+                "level": row['level'],
+                "min": row['level'],
+                "max": row['level'],
+                "consumed": max(-row['delta'], 0),
+                "refilled": max(row['delta'], 0)
+            } for row in rows]
+
+    if points is None:
+        resolution = choose_resolution(start, end, max_points)
+        seconds = RESOLUTIONS[resolution]
+        cursor.execute("""
+        SELECT bucket_start, min_level, max_level, last_level, consumed, refilled
+        FROM ingredient_level_rollups
+        WHERE ingredient_id = %s AND resolution = %s AND bucket_start >= %s AND bucket_start <= %s
+        ORDER BY bucket_start
+        """, (ingredient_id, resolution, start - start % seconds, end))
+        points = [{
+            "t": row['bucket_start'],
+            "level": row['last_level'],
+            "min": row['min_level'],
+            "max": row['max_level'],
+            "consumed": row['consumed'],
+            "refilled": row['refilled']
+        } for row in cursor.fetchall()]
+        points = downsample(points, max_points)
+
+    return resolution, points
+
+
+def downsample(points, max_points):
+    """Слияние соседних точек, пока их не станет не больше max_points"""
+    if len(points) <= max_points:
+        return points
+    size = -(-len(points) // max_points)
+    merged = []
+    for i in range(0, len(points), size):
+        group = points[i:i + size]
+        merged.append({
+            "t": group[0]['t'],
+            "level": group[-1]['level'],
+            "min": min(point['min'] for point in group),
+            "max": max(point['max'] for point in group),
+            "consumed": sum(point['consumed'] for point in group),
+            "refilled": sum(point['refilled'] for point in group)
+        })
+    return merged
+
+
+def prune(cursor, commit, now=None, chunk_size=1000):
+    """Удаление данных старше срока хранения небольшими порциями"""
+    now = time.time() if now is None else now
+    deleted = 0
+    targets = [("ingredient_level_samples", "ts", None, RETENTION['raw'])]
+    targets += [("ingredient_level_rollups", "bucket_start", resolution, RETENTION[resolution])
+                for resolution in RESOLUTIONS if RETENTION[resolution] is not None]
+    for table, column, resolution, retention in targets:
+        condition = f"{column} < %s" + (" AND resolution = %s" if resolution else "")
+        params = (now - retention,) + ((resolution,) if resolution else ())
+        while True:
+            cursor.execute(f"DELETE FROM {table} WHERE {condition} LIMIT {int(chunk_size)}", params)
+            commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < chunk_size:
+                break
+    return deleted
+
+
+class HistoryPruner:
+    """Фоновая очистка истории уровней раз в interval секунд"""
+
+    def __init__(self, get_connection, interval=3600):
+        self.get_connection = get_connection
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='level-history-pruner', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            conn = self.get_connection()
+            if not conn:
+                continue
+            cursor = conn.cursor()
+            try:
+                deleted = prune(cursor, conn.commit)
+                if deleted:
+                    logger.info(f"История уровней: удалено {deleted} устаревших записей")
+            except Exception as e:
+                logger.error(f"Ошибка очистки истории уровней: {e}")
+            finally:
+                cursor.close()
+                conn.close()
@@ -0,0 +1,296 @@
+import threading
+import time
+
+# Машина по умолчанию: её запасы - это ingredients.current_level,
+# поэтому прежний API для одной машины работает без изменений
+DEFAULT_MACHINE_ID = 'default'
+
+# machineId=all в запросах на чтение: все активные машины вместе
+ALL_MACHINES = 'all'
+
+# Статусы заказов, которые занимают очередь машины
+QUEUED_STATUSES = ('received', 'processing')
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS machines (
+        machine_id VARCHAR(64) PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        active TINYINT(1) NOT NULL DEFAULT 1,
+        created_at DOUBLE NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS machine_inventory (
+        machine_id VARCHAR(64) NOT NULL,
+        ingredient_id VARCHAR(50) NOT NULL,
+        current_level FLOAT NOT NULL DEFAULT 0,
+        max_level FLOAT NOT NULL DEFAULT 1000,
+        PRIMARY KEY (machine_id, ingredient_id)
+    )
+    """
+]
+
+
+class UnknownMachineError(LookupError):
+    """machineId, которого нет среди активных машин"""
+
+
+def machine_is_active(cursor, machine_id):
+    """Есть ли машина среди активных (машина по умолчанию - всегда)"""
+    if machine_id == DEFAULT_MACHINE_ID:
+        return True
+    cursor.execute("SELECT machine_id FROM machines WHERE machine_id = %s AND active = 1", (machine_id,))
+    return cursor.fetchone() is not None
+
+
+def history_key(machine_id, ingredient_id):
+    """Ключ ингредиента в истории уровней (для машины по умолчанию - просто id)"""
+    if machine_id == DEFAULT_MACHINE_ID:
+        return ingredient_id
+    return f"{machine_id}/{ingredient_id}"
+
+
+def fetch_levels(cursor, machine_id):
+    """Уровни ингредиентов машины (dictionary-курсор), в формате /ingredients/levels"""
+    if machine_id == DEFAULT_MACHINE_ID:
+        cursor.execute("""
+        SELECT ingredient_id as ingredientId, name, current_level as currentLevel, max_level as maxLevel
+        FROM ingredients
+        """)
+    else:
+        cursor.execute("""
+        SELECT i.ingredient_id as ingredientId, i.name, mi.current_level as currentLevel, mi.max_level as maxLevel
+        FROM machine_inventory mi
+        JOIN ingredients i ON mi.ingredient_id = i.ingredient_id
+        WHERE mi.machine_id = %s
+        """, (machine_id,))
+    return cursor.fetchall()
+
+
+def fetch_all_levels(cursor):
+    """Уровни всех машин: {machine_id: [уровни]} (dictionary-курсор, два запроса)"""
+    levels = {DEFAULT_MACHINE_ID: fetch_levels(cursor, DEFAULT_MACHINE_ID)}
+    cursor.execute("""
+    SELECT mi.machine_id, i.ingredient_id as ingredientId, i.name,
+           mi.current_level as currentLevel, mi.max_level as maxLevel
+    FROM machine_inventory mi
+    JOIN ingredients i ON mi.ingredient_id = i.ingredient_id
+    JOIN machines m ON mi.machine_id = m.machine_id
+    WHERE m.active = 1
+    """)
+    for row in cursor.fetchall():
+        machine_id = row.pop('machine_id')
+        if machine_id != DEFAULT_MACHINE_ID:
+            levels.setdefault(machine_id, []).append(row)
+    return levels
+
+
+def aggregate_levels(levels_by_machine):
+    """Сумма уровней по всем машинам для каждого ингредиента"""
+    totals = {}
+    for levels in levels_by_machine.values():
+        for level in levels:
+            total = totals.setdefault(level['ingredientId'], {
+                "ingredientId": level['ingredientId'],
+                "name": level['name'],
+                "currentLevel": 0,
+                "maxLevel": 0
+            })
+            total['currentLevel'] += level['currentLevel']
+            total['maxLevel'] += level['maxLevel']
+    return list(totals.values())
+
+
+def lock_levels(cursor, machine_id, names):
+    """Уровни ингредиентов по имени с блокировкой строк: {name: (ingredient_id, level)}"""
+    if not names:
+        return {}
+    placeholders = ', '.join(['%s'] * len(names))
+    if machine_id == DEFAULT_MACHINE_ID:
+        cursor.execute(f"""
+        SELECT ingredient_id, name, current_level FROM ingredients
+        WHERE name IN ({placeholders}) FOR UPDATE
+        """, tuple(names))
+    else:
+        cursor.execute(f"""
+        SELECT i.ingredient_id, i.name, mi.current_level
+        FROM machine_inventory mi
+        JOIN ingredients i ON mi.ingredient_id = i.ingredient_id
+        WHERE mi.machine_id = %s AND i.name IN ({placeholders})
+        FOR UPDATE
+        """, (machine_id,) + tuple(names))
+    return {name: (ingredient_id, level) for ingredient_id, name, level in cursor.fetchall()}
+
+
+def levels_by_name(cursor, machine_id, names):
+    """Текущие уровни по имени ингредиента (dictionary-курсор), один запрос"""
+    if not names:
+        return {}
+    placeholders = ', '.join(['%s'] * len(names))
+    if machine_id == DEFAULT_MACHINE_ID:
+        cursor.execute(f"""
+        SELECT name, current_level FROM ingredients WHERE name IN ({placeholders})
+        """, tuple(names))
+    else:
+        cursor.execute(f"""
+        SELECT i.name, mi.current_level
+        FROM machine_inventory mi
+        JOIN ingredients i ON mi.ingredient_id = i.ingredient_id
+        WHERE mi.machine_id = %s AND i.name IN ({placeholders})
+        """, (machine_id,) + tuple(names))
+    return {item['name']: item['current_level'] for item in cursor.fetchall()}
+
+
+def lock_levels_by_id(cursor, machine_id, ingredient_ids):
+    """Уровни по ingredient_id с блокировкой строк: {ingredient_id: level}"""
+    if not ingredient_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(ingredient_ids))
+    if machine_id == DEFAULT_MACHINE_ID:
+        cursor.execute(f"""
+        SELECT ingredient_id, current_level FROM ingredients
+        WHERE ingredient_id IN ({placeholders}) FOR UPDATE
+        """, tuple(ingredient_ids))
+    else:
+        cursor.execute(f"""
+        SELECT ingredient_id, current_level FROM machine_inventory
+        WHERE machine_id = %s AND ingredient_id IN ({placeholders}) FOR UPDATE
+        """, (machine_id,) + tuple(ingredient_ids))
+    return dict(cursor.fetchall())
+
+
+def set_levels(cursor, machine_id, levels):
+    """Установка уровней {ingredient_id: level} (пополнение машины)"""
+    if machine_id == DEFAULT_MACHINE_ID:
+        cursor.executemany("""
+        UPDATE ingredients
+        SET current_level = %s
+        WHERE ingredient_id = %s
+        """, [(level, ingredient_id) for ingredient_id, level in levels.items()])
+    else:
+        cursor.executemany("""
+        INSERT INTO machine_inventory (machine_id, ingredient_id, current_level)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE current_level = VALUES(current_level)
+        """, [(machine_id, ingredient_id, level) for ingredient_id, level in levels.items()])
+
+
+def decrement_levels(cursor, machine_id, locked, amounts):
+    """Списание ингредиентов заказа; locked - результат lock_levels"""
+    if machine_id == DEFAULT_MACHINE_ID:
+        cursor.executemany("""
+        UPDATE ingredients
+        SET current_level = GREATEST(0, current_level - %s)
+        WHERE name = %s
+        """, [(amount, name) for name, amount in amounts.items()])
+    else:
+        cursor.executemany("""
+        UPDATE machine_inventory
+        SET current_level = GREATEST(0, current_level - %s)
+        WHERE machine_id = %s AND ingredient_id = %s
+        """, [(amount, machine_id, locked[name][0]) for name, amount in amounts.items() if name in locked])
+
+
+class OrderRouter:
+    """Выбор машины для заказа: хватает запасов и самая короткая очередь.
+
+    Состояние (уровни и длины очередей) кэшируется на ttl секунд, чтобы
+    маршрутизация не добавляла запросов к БД на каждый заказ; каждое
+    решение сразу учитывается в кэше, чтобы пачка заказов распределялась.
+    Заказ никогда не ждёт БД: состояние перечитывается в фоновом потоке,
+    а до его загрузки используется последнее известное (или машина по
+    умолчанию). После ошибки загрузки следующая попытка - не раньше чем
+    через retry_after секунд, с удвоением до max_backoff.
+    """
+
+    def __init__(self, load_state, ttl=2, retry_after=1, max_backoff=30):
+        self.load_state = load_state
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.max_backoff = max_backoff
+        self._state = None
+        self._loaded_at = 0
+        self._version = 0
+        self._loaded_version = None
+        self._loading = False
+        self._backoff = retry_after
+        self._retry_at = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        # Последнее известное состояние остаётся для маршрутизации до загрузки нового;
+        # загрузка начнётся со следующим заказом
+        with self._lock:
+            self._version += 1
+
+    def _fresh(self):
+        return (self._state is not None and self._loaded_version == self._version
+                and time.monotonic() - self._loaded_at <= self.ttl)
+
+    def _refresh_if_needed(self):
+        # Вызывается под self._lock
+        if self._loading or self._fresh() or time.monotonic() < self._retry_at:
+            return
+        self._loading = True
+        threading.Thread(target=self._refresh, args=(self._version,),
+                         name='order-router-refresh', daemon=True).start()
+
+    def _refresh(self, version):
+        try:
+            levels_by_machine, queues = self.load_state()
+        except Exception:
+            with self._lock:
+                self._loading = False
+                self._retry_at = time.monotonic() + self._backoff
+                self._backoff = min(self._backoff * 2, self.max_backoff)
+            return
+        state = {
+            machine_id: {
+                "levels": {level['name']: level['currentLevel'] for level in levels},
+                "queue": queues.get(machine_id, 0)
+            }
+            for machine_id, levels in levels_by_machine.items()
+        }
+        with self._lock:
+            self._state = state
+            self._loaded_at = time.monotonic()
+            self._loaded_version = version
+            self._loading = False
+            self._backoff = self.retry_after
+            self._retry_at = 0
+
+    def machine_exists(self, machine_id):
+        """True/False по последнему известному состоянию; None - состояние ещё не загружено"""
+        if machine_id == DEFAULT_MACHINE_ID:
+            return True
+        with self._lock:
+            self._refresh_if_needed()
+            if self._state is None:
+                return None
+            if machine_id in self._state:
+                return True
+            # Машина могла появиться после загрузки: отказ - только по актуальному состоянию
+            return False if self._loaded_version == self._version else None
+
+    def route(self, ingredients):
+        with self._lock:
+            self._refresh_if_needed()
+            state = self._state
+            if state is None:
+                return DEFAULT_MACHINE_ID
+
+            candidates = [
+                machine_id for machine_id, machine in state.items()
+                if all(machine['levels'].get(name, 0) >= amount for name, amount in ingredients.items())
+            ]
+            if not candidates:
+                return DEFAULT_MACHINE_ID
+
+            chosen = min(candidates, key=lambda machine_id: (
+                state[machine_id]['queue'], machine_id != DEFAULT_MACHINE_ID, machine_id
+            ))
+            state[chosen]['queue'] += 1
+            for name, amount in ingredients.items():
+                state[chosen]['levels'][name] -= amount
+            return chosen
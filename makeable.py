@@ -0,0 +1,118 @@
+import threading
+
+import numpy as np
+
+from catalog import Derived
+from machines import ALL_MACHINES, DEFAULT_MACHINE_ID, UnknownMachineError
+
+# Допуск на округление при сравнении объёмов с уровнями
+EPSILON = 1e-9
+
+
+class RecipeMatrix:
+    """Матрица рецептов: строка - коктейль, столбец - ингредиент, значение - доля в объёме"""
+
+    def __init__(self, mocktails):
+        self.mocktail_ids = [m['mocktail_id'] for m in mocktails]
+        self.names = {m['mocktail_id']: m['name'] for m in mocktails}
+        self.row = {mocktail_id: i for i, mocktail_id in enumerate(self.mocktail_ids)}
+        self.ingredients = sorted({name for m in mocktails for name in m['ingredients']})
+        self.column = {name: j for j, name in enumerate(self.ingredients)}
+
+        amounts = np.zeros((len(self.mocktail_ids), len(self.ingredients)))
+        for i, mocktail in enumerate(mocktails):
+            for name, amount in mocktail['ingredients'].items():
+                amounts[i, self.column[name]] = float(amount)
+        totals = amounts.sum(axis=1, keepdims=True)
+        self.proportions = np.divide(amounts, totals, out=np.zeros_like(amounts), where=totals > 0)
+
+    def servings(self, levels, volumes):
+        """Число порций (коктейль × объём) при заданных уровнях ингредиентов, за один проход"""
+        level_vector = np.array([float(levels.get(name, 0)) for name in self.ingredients])
+        required = self.proportions[:, None, :] * np.asarray(volumes, dtype=float)[None, :, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(required > 0, level_vector[None, None, :] / required, np.inf)
+        limit = ratio.min(axis=2) if self.ingredients else np.full(required.shape[:2], np.inf)
+        # Коктейль без ингредиентов приготовить нельзя
+        limit[np.isinf(limit)] = 0
+        return np.floor(limit + EPSILON).astype(int)
+
+
+class MakeableCache:
+    """Кэш "можно приготовить сейчас" для машин и наборов объёмов.
+
+    load_levels возвращает уровни всех машин: {machine_id: {name: level}}.
+    Пересчитывается при смене версии каталога или после invalidate_levels(),
+    который вызывается при каждом изменении уровней ингредиентов.
+    """
+
+    def __init__(self, catalog, load_levels, max_entries=32):
+        self.catalog = catalog
+        self.recipes = Derived(catalog, RecipeMatrix)
+        self.load_levels = load_levels
+        self.max_entries = max_entries
+        self.levels_version = 0
+        self._levels = None
+        self._results = {}
+        self._tag = None
+        self._lock = threading.Lock()
+
+    def invalidate_levels(self):
+        with self._lock:
+            self._levels = None
+            self.levels_version += 1
+            self._results.clear()
+
+    def levels(self):
+        return self._levels_snapshot()[1]
+
+    def _levels_snapshot(self):
+        """(версия, уровни): версия берётся до загрузки, сама загрузка - без блокировки"""
+        with self._lock:
+            if self._levels is not None:
+                return self.levels_version, self._levels
+            version = self.levels_version
+        levels = self.load_levels()
+        with self._lock:
+            # Уровни, изменившиеся во время загрузки, загрузит следующий запрос
+            if version == self.levels_version:
+                self._levels = levels
+        return version, levels
+
+    def get(self, volumes, machine_id=DEFAULT_MACHINE_ID):
+        """{mocktail_id: {volume: servings}} для заданных объёмов на машине machine_id.
+
+        ALL_MACHINES - сумма по всем машинам: каждую порцию готовит одна машина.
+        """
+        volumes = tuple(volumes)
+        key = (machine_id, volumes)
+        recipes = self.recipes.get()
+        version, levels = self._levels_snapshot()
+        if machine_id != ALL_MACHINES and machine_id not in levels:
+            raise UnknownMachineError(machine_id)
+        tag = (id(recipes), version)
+        with self._lock:
+            if tag == self._tag:
+                result = self._results.get(key)
+                if result is not None:
+                    return result
+
+        machine_levels = levels.values() if machine_id == ALL_MACHINES else [levels[machine_id]]
+        servings = np.zeros((len(recipes.mocktail_ids), len(volumes)), dtype=int)
+        for current in machine_levels:
+            servings += recipes.servings(current, volumes)
+        result = {
+            mocktail_id: {volume: int(servings[i, j]) for j, volume in enumerate(volumes)}
+            for i, mocktail_id in enumerate(recipes.mocktail_ids)
+        }
+        with self._lock:
+            # Результат по устаревшим уровням не сохраняется под новой версией
+            if version != self.levels_version:
+                return result
+            if tag != self._tag:
+                self._results.clear()
+                self._tag = tag
+            if len(self._results) >= self.max_entries:
+                self._results.clear()
+            self._results[key] = result
+        return result
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Статусы, после которых заказ больше не меняется
+TERMINAL_STATUSES = ('completed', 'cancelled')
+
+# Поля аренды строки orders: у заказа из журнала (ещё не в базе) их нет
+LEASE_FIELDS = {'claimed_by': None, 'lease_expires_at': None, 'attempts': 0}
+
+
+def order_shape(order):
+    """Копия заказа с полями строки orders - один вид для журнала, кэша и базы"""
+    return dict(LEASE_FIELDS, **order)
+
+
+class OrderCache:
+    """Кэш недавних заказов для /order_status: LRU с ограничением размера и TTL.
+
+    Заполняется при записи (создание заказа, смена статуса, аренда), поэтому
+    процесс, изменивший заказ, сразу видит новое состояние. Статус активного
+    заказа могут изменить и другие процессы, поэтому активные заказы живут
+    только active_ttl секунд - это верхняя граница устаревания между
+    воркерами. Завершённые заказы не меняются и живут terminal_ttl.
+    """
+
+    def __init__(self, max_entries=10000, active_ttl=2.0, terminal_ttl=60.0):
+        self.max_entries = max_entries
+        self.active_ttl = active_ttl
+        self.terminal_ttl = terminal_ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _ttl(self, order):
+        return self.terminal_ttl if order.get('status') in TERMINAL_STATUSES else self.active_ttl
+
+    def get(self, order_id):
+        """Копия заказа или None"""
+        with self._lock:
+            entry = self._entries.get(order_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            order, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[order_id]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(order_id)
+            self.hits += 1
+            return dict(order)
+
+    def put(self, order):
+        order = order_shape(order)
+        with self._lock:
+            self._entries[order['order_id']] = (order, time.monotonic() + self._ttl(order))
+            self._entries.move_to_end(order['order_id'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def update(self, order_id, **fields):
+        """Изменение полей закэшированного заказа (срок жизни отсчитывается заново)"""
+        with self._lock:
+            entry = self._entries.get(order_id)
+            if entry is None:
+                return
+            order = dict(entry[0], **fields)
+            self._entries[order_id] = (order, time.monotonic() + self._ttl(order))
+            self._entries.move_to_end(order_id)
+
+    def discard(self, order_id):
+        with self._lock:
+            self._entries.pop(order_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def status(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxEntries": self.max_entries,
+                "activeTtl": self.active_ttl,
+                "terminalTtl": self.terminal_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "hitRate": self.hits / lookups if lookups else None
+            }
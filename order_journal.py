@@ -0,0 +1,408 @@
+import fcntl
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger('mocktail_server.journal')
+
+# Ошибки в данных записи: повтор их не исправит, запись откладывается в .rejected
+PERMANENT_ERRORS = (TypeError, ValueError, LookupError, AttributeError)
+
+
+class RecordNotReady(Exception):
+    """Запись пока нельзя перенести (статус заказа, который ещё в журнале другого процесса):
+    она и следующие записи того же заказа ждут, остальные переносятся"""
+
+
+class OrderJournal:
+    """Локальный append-only журнал заказов (JSON lines) с фоновым переносом в MySQL.
+
+    Запрос на заказ пишет запись в журнал (write + fsync) и сразу отвечает.
+    Фоновый поток переносит записи в БД пачками, строго по порядку seq;
+    apply_batch должен быть идемпотентным - после сбоя пачка повторяется.
+    В файле .checkpoint хранится seq, до которого перенесено всё, и seq
+    перенесённых после него записей (если записи ждали, см. ниже).
+    Запись, перенос которой падает с ошибкой из permanent_errors, не
+    повторяется бесконечно: она пишется в файл .rejected, и перенос
+    продолжается со следующей; остальные ошибки (БД недоступна) повторяются.
+    Запись, для которой apply_batch бросает RecordNotReady, остаётся на
+    месте и повторяется через replay_interval; до тех пор ждут и следующие
+    записи того же заказа (кроме самого заказа), записи других заказов
+    переносятся. Так статусы заказа попадают в БД в порядке записи.
+
+    У каждого процесса сервера свой файл path.<pid> со своими seq и
+    checkpoint; процесс держит на нём flock, пока жив. Файл без блокировки
+    остался от завершившегося процесса (или это общий журнал прежних
+    версий - path): его неперенесённые записи дописываются в свой журнал
+    при открытии и раз в adopt_interval секунд, после чего файл удаляется.
+    """
+
+    def __init__(self, path, apply_batch, batch_size=50, replay_interval=0.5,
+                 max_backoff=30, compact_size=1024 * 1024, adopt_interval=30,
+                 permanent_errors=PERMANENT_ERRORS):
+        self.path = path
+        self.rejected_path = path + '.rejected'
+        self.apply_batch = apply_batch
+        self.permanent_errors = permanent_errors
+        self.batch_size = batch_size
+        self.replay_interval = replay_interval
+        self.max_backoff = max_backoff
+        self.compact_size = compact_size
+        self.adopt_interval = adopt_interval
+
+        self._lock = threading.Lock()
+        self._process_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._file = None
+        self.file_path = None
+        self.checkpoint_path = None
+        self.last_error = None
+        self.last_replay_at = None
+        self.rejected = 0
+        self.adopted = 0
+        # Заказы, записи которых ждут: {order_id: время следующей попытки}
+        self._waiting = {}
+
+    def _ensure_process(self):
+        # Файл открывается при первом использовании в процессе: после fork у воркера свой журнал
+        if self._pid == os.getpid():
+            return
+        with self._process_lock:
+            if self._pid != os.getpid():
+                self._open()
+                self._pid = os.getpid()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if self._file is not None:
+            # Дескриптор родителя: закрытие в дочернем процессе не снимает его блокировку
+            self._file.close()
+        self._thread = None
+        self._pending = OrderedDict()
+        self._orders = {}
+        self._applied_ahead = set()
+        self._waiting = {}
+        self.file_path = f"{self.path}.{os.getpid()}"
+        self.checkpoint_path = self.file_path + '.checkpoint'
+
+        # Файл с тем же pid мог остаться от завершившегося процесса - он восстанавливается как свой
+        self._file = open(self.file_path, 'a+', encoding='utf-8')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.last_applied_seq, self._applied_ahead, records = self._read_journal(self.file_path)
+        self.last_seq = max([self.last_applied_seq] + list(self._applied_ahead) + [record['seq'] for record in records])
+        for record in records:
+            self._remember(record)
+        if self._pending:
+            logger.info(f"Журнал: восстановлено {len(self._pending)} неперенесённых записей")
+
+        self._adopt_orphans()
+
+    def _journal_files(self):
+        """Журналы всех процессов и общий журнал прежних версий"""
+        directory = os.path.dirname(self.path) or '.'
+        name = re.compile(re.escape(os.path.basename(self.path)) + r'(\.\d+)?$')
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(directory, item) for item in sorted(names) if name.match(item)]
+
+    @staticmethod
+    def _read_journal(path, order_id=None):
+        """(checkpoint, перенесённые после него seq, неперенесённые записи) файла журнала;
+        order_id - только записи этого заказа"""
+        checkpoint, applied = 0, set()
+        try:
+            with open(path + '.checkpoint', 'r') as f:
+                saved = json.load(f)
+            checkpoint, applied = saved['seq'], set(saved.get('applied', ()))
+        except (FileNotFoundError, ValueError):
+            pass
+
+        records = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if order_id is not None and order_id not in line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Недописанная последняя строка после сбоя питания
+                        logger.warning(f"Пропущена повреждённая запись журнала {path}")
+                        continue
+                    if record['seq'] <= checkpoint or record['seq'] in applied:
+                        continue
+                    if order_id is None or record['order_id'] == order_id:
+                        records.append(record)
+        except FileNotFoundError:
+            pass
+        return checkpoint, applied, records
+
+    def _adopt_orphans(self):
+        """Перенос неперенесённых записей журналов завершившихся процессов в свой журнал"""
+        for path in self._journal_files():
+            if path == self.file_path:
+                continue
+            try:
+                f = open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Процесс-владелец жив
+                    continue
+                try:
+                    if os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                        continue
+                except FileNotFoundError:
+                    # Журнал уже перенят другим процессом
+                    continue
+
+                _, _, records = self._read_journal(path)
+                if records:
+                    with self._lock:
+                        self._write(records)
+                        self.adopted += len(records)
+                    self._wakeup.set()
+                # Сначала журнал: оставшийся без журнала checkpoint ни на что не влияет
+                os.unlink(path)
+                try:
+                    os.unlink(path + '.checkpoint')
+                except FileNotFoundError:
+                    pass
+                logger.info(f"Журнал: перенято {len(records)} записей из {path}")
+
+    def _remember(self, record):
+        self._pending[record['seq']] = record
+        # Неперенесённые записи заказа: сам заказ (если принят этим процессом) и последний статус
+        state = self._orders.setdefault(record['order_id'], {'order': None, 'status': None, 'entries': 0})
+        state['entries'] += 1
+        if record['type'] == 'order':
+            state['order'] = dict(record['order'])
+            state['created_at'] = record['journaled_at']
+        elif state['status'] is None or record['journaled_at'] >= state['status'][0]:
+            state['status'] = (record['journaled_at'], record['status'])
+
+    def _write(self, records):
+        """Запись в свой журнал с новыми seq и одним fsync (под self._lock)"""
+        written = []
+        for record in records:
+            self.last_seq += 1
+            record = dict(record, seq=self.last_seq)
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            written.append(record)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        for record in written:
+            self._remember(record)
+        return written
+
+    def append(self, record_type, order_id, **fields):
+        """Добавление записи в журнал; возвращается после fsync"""
+        self._ensure_process()
+        with self._lock:
+            record = self._write([{'type': record_type, 'order_id': order_id,
+                                   'journaled_at': time.time(), **fields}])[0]
+        self._wakeup.set()
+        return record
+
+    def pending_order(self, order_id):
+        """Заказ из своего журнала, ещё не перенесённый в БД (с последним своим статусом), или None"""
+        self._ensure_process()
+        with self._lock:
+            state = self._orders.get(order_id)
+            if not state or state['order'] is None:
+                return None
+            order = dict(state['order'])
+            if state['status']:
+                order['status'] = state['status'][1]
+            return order
+
+    def find_order(self, order_id):
+        """Неперенесённый заказ из журналов всех процессов сервера или None.
+
+        Статус - последний по времени записи среди всех журналов: статус
+        заказа этого процесса мог записать другой процесс, и наоборот.
+        Журналы других процессов читаются с диска, поэтому вызывается, когда
+        заказа нет в БД (или БД недоступна) или он ещё в своём журнале.
+        """
+        self._ensure_process()
+        order, statuses = None, []
+        with self._lock:
+            state = self._orders.get(order_id)
+            if state:
+                if state['order'] is not None:
+                    order = dict(state['order'])
+                    statuses.append((state['created_at'], order['status']))
+                if state['status']:
+                    statuses.append(state['status'])
+        for path in self._journal_files():
+            if path == self.file_path:
+                continue
+            for record in self._read_journal(path, order_id)[2]:
+                if record['type'] == 'order':
+                    order = dict(record['order'])
+                    statuses.append((record['journaled_at'], order['status']))
+                else:
+                    statuses.append((record['journaled_at'], record['status']))
+        if order is None:
+            return None
+        # Сортировка устойчивая: при равном времени статус самого заказа - первый
+        for _, status in sorted(statuses, key=lambda item: item[0]):
+            order['status'] = status
+        return order
+
+    def start(self):
+        self._ensure_process()
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='order-journal-replayer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        backoff = self.replay_interval
+        adopted_at = time.monotonic()
+        while True:
+            self._wakeup.wait(backoff)
+            self._wakeup.clear()
+            if time.monotonic() - adopted_at >= self.adopt_interval:
+                adopted_at = time.monotonic()
+                try:
+                    self._adopt_orphans()
+                except Exception as e:
+                    logger.error(f"Журнал: ошибка переноса журналов завершившихся процессов: {e}")
+            try:
+                while self.replay_once():
+                    pass
+                backoff = self.replay_interval
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Журнал: ошибка переноса в БД: {e}")
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def _ready(self, record, waiting):
+        # Заказ ждущей записи не ждёт: он в любом случае раньше своих статусов
+        return record['type'] == 'order' or record['order_id'] not in waiting
+
+    def replay_once(self):
+        """Перенос одной пачки; возвращает количество перенесённых записей"""
+        self._ensure_process()
+        with self._lock:
+            now = time.monotonic()
+            self._waiting = {order_id: retry_at for order_id, retry_at in self._waiting.items() if retry_at > now}
+            waiting = set(self._waiting)
+            batch = list(itertools.islice(
+                (record for record in self._pending.values() if self._ready(record, waiting)), self.batch_size
+            ))
+        if not batch:
+            return 0
+
+        try:
+            self.apply_batch(batch)
+        except (RecordNotReady,) + self.permanent_errors:
+            return self._replay_one_by_one(batch, waiting)
+        self._mark_applied(batch)
+        return len(batch)
+
+    def _replay_one_by_one(self, batch, waiting):
+        """Перенос пачки по одной записи: откладываются только записи с ошибкой в данных,
+        неготовые записи и следующие записи их заказов ждут; возвращает количество перенесённых"""
+        applied = 0
+        for record in batch:
+            if not self._ready(record, waiting):
+                continue
+            try:
+                self.apply_batch([record])
+            except RecordNotReady:
+                waiting.add(record['order_id'])
+                with self._lock:
+                    self._waiting[record['order_id']] = time.monotonic() + self.replay_interval
+                continue
+            except self.permanent_errors as e:
+                self._reject(record, e)
+                applied += 1
+                continue
+            self._mark_applied([record])
+            applied += 1
+        return applied
+
+    def _reject(self, record, error):
+        entry = {'rejected_at': time.time(), 'error': f"{type(error).__name__}: {error}", 'record': record}
+        with open(self.rejected_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        logger.error(f"Журнал: запись {record['seq']} (заказ {record['order_id']}) отложена в "
+                     f"{self.rejected_path}: {entry['error']}")
+        with self._lock:
+            self.rejected += 1
+        self._mark_applied([record])
+
+    def _mark_applied(self, batch):
+        with self._lock:
+            for record in batch:
+                del self._pending[record['seq']]
+                self._applied_ahead.add(record['seq'])
+                state = self._orders.get(record['order_id'])
+                if state:
+                    state['entries'] -= 1
+                    if state['entries'] <= 0:
+                        del self._orders[record['order_id']]
+            # Всё до первой неперенесённой записи; перенесённые после неё (пока ждали
+            # записи другого заказа) хранятся списком
+            first_pending = next(iter(self._pending), self.last_seq + 1)
+            self.last_applied_seq = first_pending - 1
+            self._applied_ahead = {seq for seq in self._applied_ahead if seq > self.last_applied_seq}
+            self._write_checkpoint()
+            self.last_error = None
+            self.last_replay_at = time.time()
+            self._compact_if_drained()
+
+    def _write_checkpoint(self):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'seq': self.last_applied_seq, 'applied': sorted(self._applied_ahead)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _compact_if_drained(self):
+        # Когда всё перенесено, журнал можно обнулить (checkpoint хранит seq);
+        # в файл пишет только этот процесс
+        if self._pending or self._file.tell() < self.compact_size:
+            return
+        self._file.truncate(0)
+        self._file.seek(0)
+        os.fsync(self._file.fileno())
+
+    def status(self):
+        self._ensure_process()
+        with self._lock:
+            oldest = next(iter(self._pending.values()), None)
+            return {
+                "file": self.file_path,
+                "pendingEntries": len(self._pending),
+                "pendingOrders": sum(1 for state in self._orders.values() if state['order'] is not None),
+                "lagSeconds": time.time() - oldest['journaled_at'] if oldest else 0,
+                "lastSeq": self.last_seq,
+                "lastAppliedSeq": self.last_applied_seq,
+                "lastReplayAt": self.last_replay_at,
+                "lastError": self.last_error,
+                "rejectedEntries": self.rejected,
+                "adoptedEntries": self.adopted
+            }
@@ -0,0 +1,54 @@
+import logging
+import threading
+
+logger = logging.getLogger('mocktail_server.order_watch')
+
+
+class OrderWatch:
+    """Уведомления о смене статуса заказа для ожидающих /order_status/<id>/wait.
+
+    Обработчики записи вызывают notify(order_id) после commit (или записи в
+    журнал), шина инвалидации - при сообщении о заказе другого процесса.
+    Подписчик - функция без аргументов; вызывается в потоке notify, поэтому
+    только будит ожидающего (Event.set или call_soon_threadsafe).
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, order_id, callback):
+        with self._lock:
+            self._subscribers.setdefault(order_id, set()).add(callback)
+
+    def unsubscribe(self, order_id, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(order_id)
+            if callbacks is None:
+                return
+            callbacks.discard(callback)
+            if not callbacks:
+                del self._subscribers[order_id]
+
+    def notify(self, *order_ids):
+        with self._lock:
+            callbacks = [callback for order_id in order_ids for callback in self._subscribers.get(order_id, ())]
+        self._call(callbacks)
+
+    def notify_all(self):
+        with self._lock:
+            callbacks = [callback for callbacks in self._subscribers.values() for callback in callbacks]
+        self._call(callbacks)
+
+    @staticmethod
+    def _call(callbacks):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                # Например, цикл событий ожидающего уже закрыт
+                logger.warning(f"Ошибка уведомления об изменении заказа: {e}")
+
+    def waiting(self):
+        with self._lock:
+            return sum(len(callbacks) for callbacks in self._subscribers.values())
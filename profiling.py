@@ -0,0 +1,123 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('mocktail_server.profiling')
+
+# Допустимые имена файлов профилей (защита от выхода за пределы каталога)
+PROFILE_NAME = re.compile(r'^[A-Za-z0-9_.-]+\.(prof|json)$')
+
+
+class RequestProfiler:
+    """Профилирование отдельных запросов с записью в кольцо файлов на диске.
+
+    Для каждого профилированного запроса пишутся два файла с общим именем:
+    <name>.prof (сырые данные cProfile для pstats/snakeviz) и <name>.json
+    (метаданные, топ функций и трасса SQL). Хранятся последние max_profiles.
+    """
+
+    def __init__(self, directory, max_profiles=50, enabled=False, sample_rate=0.0, top_functions=40):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.top_functions = top_functions
+        # cProfile не умеет профилировать несколько потоков одновременно
+        self._busy = threading.Lock()
+        self._ring_lock = threading.Lock()
+
+    def configure(self, enabled=None, sample_rate=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+
+    def should_profile(self, forced=False):
+        if forced:
+            return True
+        return self.enabled and self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        """Запуск профилировщика; None, если уже профилируется другой запрос"""
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            self._busy.release()
+            return None
+        return profile
+
+    def finish(self, profile, queries, meta):
+        """Остановка профилировщика и запись результата в кольцо"""
+        try:
+            profile.disable()
+        finally:
+            self._busy.release()
+
+        try:
+            return self._save(profile, queries, meta)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить профиль: {e}")
+            return None
+
+    def _save(self, profile, queries, meta):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        endpoint = re.sub(r'[^A-Za-z0-9_]+', '_', meta.get('endpoint') or 'unknown')
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}_{endpoint}_{uuid.uuid4().hex[:8]}"
+
+        profile.dump_stats(os.path.join(self.directory, name + '.prof'))
+
+        text = io.StringIO()
+        stats = pstats.Stats(profile, stream=text)
+        stats.sort_stats('cumulative').print_stats(self.top_functions)
+
+        document = dict(meta)
+        document.update({
+            "name": name,
+            "queryCount": len(queries),
+            "queryTimeMs": round(sum(query['durationMs'] for query in queries), 3),
+            "queries": queries,
+            "topFunctions": text.getvalue()
+        })
+        with open(os.path.join(self.directory, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(document, f, ensure_ascii=False, indent=2)
+
+        self._prune()
+        return name
+
+    def _prune(self):
+        with self._ring_lock:
+            names = sorted({os.path.splitext(entry)[0] for entry in os.listdir(self.directory)
+                            if PROFILE_NAME.match(entry)})
+            for name in names[:max(len(names) - self.max_profiles, 0)]:
+                for extension in ('.prof', '.json'):
+                    path = os.path.join(self.directory, name + extension)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def list_profiles(self):
+        if not os.path.exists(self.directory):
+            return []
+        profiles = []
+        for entry in sorted(os.listdir(self.directory), reverse=True):
+            if PROFILE_NAME.match(entry):
+                path = os.path.join(self.directory, entry)
+                profiles.append({"file": entry, "size": os.path.getsize(path),
+                                 "modifiedAt": os.path.getmtime(path)})
+        return profiles
+
+    def status(self):
+        return {"enabled": self.enabled, "sampleRate": self.sample_rate,
+                "maxProfiles": self.max_profiles, "directory": self.directory}
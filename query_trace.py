@@ -0,0 +1,160 @@
+import contextvars
+import re
+import time
+from collections import Counter
+
+# Учёт запросов текущего HTTP-запроса (None - учёт выключен)
+_current_log = contextvars.ContextVar('query_log', default=None)
+
+# Нормализация SQL до "формы": литералы и параметры заменяются на ?
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|%\(\w+\)s')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def statement_shape(sql):
+    """Форма запроса: одинаковая для запросов, отличающихся только значениями"""
+    shape = ' '.join(str(sql).split()).lower()
+    shape = _STRING_LITERAL.sub('?', shape)
+    shape = _PLACEHOLDER.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    return _IN_LIST.sub('(?)', shape)
+
+
+class QueryLog:
+    """Счётчики запросов одного HTTP-запроса; detailed - сохранять полную трассу"""
+
+    def __init__(self, detailed=False):
+        self.detailed = detailed
+        self.records = []
+        self.shapes = Counter()
+        self.count = 0
+        self.duration_ms = 0.0
+
+    def add(self, sql, params, many, duration_ms, rowcount):
+        self.count += 1
+        self.duration_ms += duration_ms
+        self.shapes[statement_shape(sql)] += 1
+        if not self.detailed:
+            return None
+        record = {
+            "sql": " ".join(str(sql).split()),
+            "params": _jsonable(params, many),
+            "many": many,
+            "durationMs": round(duration_ms, 3),
+            "rows": rowcount if rowcount is not None and rowcount >= 0 else 0
+        }
+        self.records.append(record)
+        return record
+
+    def repeated_shapes(self, threshold):
+        """Формы, выполненные threshold и более раз (признак N+1)"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+def start_collection(detailed=False):
+    """Начать учёт SQL-запросов в текущем контексте"""
+    log = QueryLog(detailed)
+    _current_log.set(log)
+    return log
+
+
+def stop_collection():
+    _current_log.set(None)
+
+
+def current_log():
+    return _current_log.get()
+
+
+class TracedCursor:
+    """Обёртка курсора: текст, параметры, длительность и число строк каждого запроса"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._record = None
+
+    def _run(self, call, operation, params, many):
+        log = _current_log.get()
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            if log is not None:
+                duration_ms = (time.perf_counter() - started) * 1000
+                self._record = log.add(operation, params, many, duration_ms, self._cursor.rowcount)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        if params is None:
+            call = lambda: self._cursor.execute(operation, *args, **kwargs)
+        else:
+            call = lambda: self._cursor.execute(operation, params, *args, **kwargs)
+        return self._run(call, operation, params, False)
+
+    def executemany(self, operation, seq_params):
+        seq_params = list(seq_params)
+        return self._run(lambda: self._cursor.executemany(operation, seq_params), operation, seq_params, True)
+
+    def _count_fetched(self, rows):
+        if self._record is not None and rows:
+            if self._record.get('fetched') is None:
+                self._record['fetched'] = 0
+            self._record['fetched'] += len(rows)
+            self._record['rows'] = max(self._record['rows'], self._record['fetched'])
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count_fetched([row])
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._count_fetched(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._count_fetched(rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TracedConnection:
+    """Обёртка соединения, выдающая TracedCursor"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return TracedCursor(self._connection.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def wrap(connection):
+    return TracedConnection(connection) if connection is not None else None
+
+
+def _jsonable(params, many):
+    if params is None:
+        return None
+    if many:
+        params = list(params)
+        return [_jsonable(item, False) for item in params[:20]] + (['...'] if len(params) > 20 else [])
+    if isinstance(params, dict):
+        return {key: _jsonable_value(value) for key, value in params.items()}
+    return [_jsonable_value(value) for value in params]
+
+
+def _jsonable_value(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
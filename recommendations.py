@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class SimilarityMatrix:
+    """Попарное сходство коктейлей по составу и тегам.
+
+    Вектор коктейля - доли ингредиентов в объёме (нормированные) и
+    one-hot тегов с весом tag_weight; сходство - косинус, считается
+    одним матричным произведением. Соседи каждой строки сортируются
+    заранее, поэтому запрос "похожие на X" - это проход по готовому списку.
+    """
+
+    def __init__(self, mocktails, tag_weight=0.35):
+        self.mocktail_ids = [m['mocktail_id'] for m in mocktails]
+        self.row = {mocktail_id: i for i, mocktail_id in enumerate(self.mocktail_ids)}
+        ingredients = sorted({name for m in mocktails for name in m['ingredients']})
+        tags = sorted({tag for m in mocktails for tag in m['tags']})
+        ingredient_column = {name: j for j, name in enumerate(ingredients)}
+        tag_column = {tag: j for j, tag in enumerate(tags)}
+
+        amounts = np.zeros((len(mocktails), len(ingredients)))
+        tag_features = np.zeros((len(mocktails), len(tags)))
+        for i, mocktail in enumerate(mocktails):
+            for name, amount in mocktail['ingredients'].items():
+                amounts[i, ingredient_column[name]] = float(amount)
+            for tag in mocktail['tags']:
+                tag_features[i, tag_column[tag]] = 1.0
+
+        # Нормировка строки убирает масштаб: доли и объёмы дают один вектор
+        vectors = np.hstack([
+            (1 - tag_weight) * _normalize_rows(amounts),
+            tag_weight * _normalize_rows(tag_features)
+        ])
+        vectors = _normalize_rows(vectors)
+
+        self.similarity = vectors @ vectors.T
+        np.fill_diagonal(self.similarity, -np.inf)
+        self.neighbours = np.argsort(-self.similarity, axis=1, kind='stable')
+
+    def similar(self, mocktail_id, limit, allowed=None):
+        """Ближайшие коктейли: [(mocktail_id, сходство)], allowed - допустимые id"""
+        row = self.row[mocktail_id]
+        result = []
+        for column in self.neighbours[row][:-1]:
+            candidate = self.mocktail_ids[column]
+            if allowed is not None and candidate not in allowed:
+                continue
+            result.append((candidate, float(self.similarity[row, column])))
+            if len(result) >= limit:
+                break
+        return result
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
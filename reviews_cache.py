@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+def encode_cursor(review):
+    """Курсор следующей страницы: (created_at, review_id) последнего отзыва.
+
+    created_at - число (DOUBLE, DECIMAL) или datetime (DATETIME); пишется как
+    repr(float) или ISO 8601, чтобы decode_cursor вернул значение того же вида.
+    """
+    created_at = review['created_at']
+    if isinstance(created_at, datetime):
+        value = created_at.isoformat()
+    else:
+        value = repr(float(created_at))
+    return f"{value}~{review['review_id']}"
+
+
+def decode_cursor(cursor):
+    value, _, review_id = cursor.partition('~')
+    if not value or not review_id:
+        raise ValueError("Неверный курсор")
+    try:
+        return float(value), review_id
+    except ValueError:
+        return datetime.fromisoformat(value), review_id
+
+
+def fetch_page(cursor, mocktail_id, after=None, limit=None):
+    """Страница отзывов (новые первыми) и общее число отзывов коктейля, два запроса.
+
+    Keyset-пагинация по (created_at, review_id): страница читается по индексу
+    с места курсора, без OFFSET. limit=None - все отзывы.
+    """
+    conditions = "mocktail_id = %s"
+    params = [mocktail_id]
+    if after is not None:
+        conditions += " AND (created_at < %s OR (created_at = %s AND review_id < %s))"
+        params += [after[0], after[0], after[1]]
+    query = f"SELECT * FROM reviews WHERE {conditions} ORDER BY created_at DESC, review_id DESC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+    cursor.execute(query, tuple(params))
+    reviews = cursor.fetchall()
+
+    next_cursor = None
+    if limit is not None and len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = encode_cursor(reviews[-1])
+
+    cursor.execute("SELECT COUNT(*) as total FROM reviews WHERE mocktail_id = %s", (mocktail_id,))
+    total = cursor.fetchone()['total']
+    return {"reviews": reviews, "total": total, "nextCursor": next_cursor}
+
+
+class ReviewsCache:
+    """Кэш страниц отзывов по каноническому mocktail_id (read-through).
+
+    invalidate(mocktail_id) вызывается после каждой записи отзыва и сбрасывает
+    только страницы этого коктейля; счётчик поколений не даёт сохранить
+    страницу, прочитанную до записи. ttl ограничивает устаревание при
+    записях из других процессов.
+    """
+
+    def __init__(self, max_mocktails=256, max_pages=16, ttl=60.0):
+        self.max_mocktails = max_mocktails
+        self.max_pages = max_pages
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, mocktail_id, page_key, load):
+        with self._lock:
+            entry = self._entries.get(mocktail_id)
+            if entry is not None and time.monotonic() >= entry['expires_at']:
+                del self._entries[mocktail_id]
+                entry = None
+            if entry is not None and page_key in entry['pages']:
+                self._entries.move_to_end(mocktail_id)
+                self.hits += 1
+                return entry['pages'][page_key]
+            self.misses += 1
+            generation = (self._epoch, self._generations.get(mocktail_id, 0))
+
+        page = load()
+
+        with self._lock:
+            if (self._epoch, self._generations.get(mocktail_id, 0)) != generation:
+                return page
+            entry = self._entries.get(mocktail_id)
+            if entry is None:
+                entry = {"pages": {}, "expires_at": time.monotonic() + self.ttl}
+                self._entries[mocktail_id] = entry
+            if len(entry['pages']) < self.max_pages or page_key in entry['pages']:
+                entry['pages'][page_key] = page
+            self._entries.move_to_end(mocktail_id)
+            while len(self._entries) > self.max_mocktails:
+                self._entries.popitem(last=False)
+        return page
+
+    def invalidate(self, mocktail_id=None):
+        """Сброс страниц коктейля (или всех коктейлей)"""
+        with self._lock:
+            if mocktail_id is None:
+                self._entries.clear()
+                self._epoch += 1
+                return
+            self._entries.pop(mocktail_id, None)
+            self._generations[mocktail_id] = self._generations.get(mocktail_id, 0) + 1
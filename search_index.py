@@ -0,0 +1,94 @@
+import re
+import unicodedata
+
+# Допустимые сортировки: ключ -> (функция ключа, по убыванию)
+SORTS = {
+    'rating': (lambda m: (m['rating'], m['review_count']), True),
+    'reviews': (lambda m: (m['review_count'], m['rating']), True),
+    'name': (lambda m: normalize_term(m['name']), False),
+}
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize_term(value):
+    """Регистр и диакритика не учитываются: 'Fruité' == 'fruite'"""
+    decomposed = unicodedata.normalize('NFKD', str(value).casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).strip()
+
+
+def _words(text):
+    return _WORD.findall(normalize_term(text or ''))
+
+
+class MocktailSearchIndex:
+    """Инвертированные индексы каталога: тег -> id, ингредиент -> id, слово -> id.
+
+    Строится целиком из снимка каталога (данные mocktail_tags и
+    mocktail_ingredients); запрос к MySQL при поиске не выполняется.
+    """
+
+    def __init__(self, mocktails):
+        self.mocktails = {m['mocktail_id']: m for m in mocktails}
+        self.by_tag = {}
+        self.by_ingredient = {}
+        self.by_word = {}
+
+        for mocktail_id, mocktail in self.mocktails.items():
+            for tag in mocktail['tags']:
+                self.by_tag.setdefault(normalize_term(tag), set()).add(mocktail_id)
+            for ingredient in mocktail['ingredients']:
+                self.by_ingredient.setdefault(normalize_term(ingredient), set()).add(mocktail_id)
+            for word in _words(mocktail['name']) + _words(mocktail['description']):
+                self.by_word.setdefault(word, set()).add(mocktail_id)
+
+        # Заранее отсортированные списки id для каждой сортировки
+        self.sorted_ids = {}
+        for sort, (key, descending) in SORTS.items():
+            ordered = sorted(self.mocktails.values(), key=key, reverse=descending)
+            self.sorted_ids[sort] = [m['mocktail_id'] for m in ordered]
+
+    def _match_words(self, text):
+        # Каждое слово запроса - префикс какого-либо слова названия/описания
+        result = None
+        for token in _words(text):
+            ids = set()
+            for word, word_ids in self.by_word.items():
+                if word.startswith(token):
+                    ids |= word_ids
+            result = ids if result is None else result & ids
+        return result
+
+    def search(self, tags=(), include=(), exclude=(), min_rating=None, text=None,
+               sort='rating', descending=None, page=1, page_size=20):
+        """Поиск с комбинируемыми фильтрами; возвращает (total, страница, фасеты)"""
+        candidates = set(self.mocktails)
+
+        for tag in tags:
+            candidates &= self.by_tag.get(normalize_term(tag), set())
+        for ingredient in include:
+            candidates &= self.by_ingredient.get(normalize_term(ingredient), set())
+        for ingredient in exclude:
+            candidates -= self.by_ingredient.get(normalize_term(ingredient), set())
+        if text:
+            matched = self._match_words(text)
+            if matched is not None:
+                candidates &= matched
+        if min_rating is not None:
+            candidates = {i for i in candidates if self.mocktails[i]['rating'] >= min_rating}
+
+        ordered = [i for i in self.sorted_ids[sort] if i in candidates]
+        if descending is not None and descending != SORTS[sort][1]:
+            ordered.reverse()
+
+        facets = {"tags": {}, "ingredients": {}}
+        for mocktail_id in ordered:
+            mocktail = self.mocktails[mocktail_id]
+            for tag in mocktail['tags']:
+                facets["tags"][tag] = facets["tags"].get(tag, 0) + 1
+            for ingredient in mocktail['ingredients']:
+                facets["ingredients"][ingredient] = facets["ingredients"].get(ingredient, 0) + 1
+
+        start = (page - 1) * page_size
+        page_items = [self.mocktails[i] for i in ordered[start:start + page_size]]
+        return len(ordered), page_items, facets
@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('mocktail_server.single_flight')
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Одно вычисление на ключ: параллельные вызовы ждут его и получают тот же результат (или ошибку)"""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+
+class StaleWhileRevalidate:
+    """Значения build(key), свежие ttl секунд.
+
+    Устаревшее (по ttl или после invalidate(keep_stale=True)) значение ещё
+    max_stale секунд отдаётся сразу, а новое строится в фоне; без значения
+    читатель ждёт построения. Построение одного ключа всегда одно - через
+    SingleFlight, поэтому холодный кэш не порождает лавину запросов к БД.
+    """
+
+    def __init__(self, build, ttl, max_stale=None, max_entries=256):
+        self.build = build
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.flight = SingleFlight()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._generations = {}
+        self._epoch = 0
+        # Поколения последнего сброса без keep_stale: более старые построения не сохраняются
+        self._floors = {}
+        self._floor_epoch = 0
+        # Ключи, для которых уже запущено фоновое обновление
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _generation(self, key):
+        return self._epoch, self._generations.get(key, 0)
+
+    def get(self, key=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, built_at, generation = entry
+                age = time.monotonic() - built_at
+                if generation == self._generation(key) and age < self.ttl:
+                    self.hits += 1
+                    return value
+                if self.max_stale is None or age < self.ttl + self.max_stale:
+                    self.stale_hits += 1
+                else:
+                    entry = None
+            if entry is None:
+                self.misses += 1
+
+        if entry is None:
+            return self._load(key)
+        self._refresh_in_background(key)
+        return value
+
+    def _load(self, key):
+        with self._lock:
+            generation = self._generation(key)
+
+        def build():
+            built_at = time.monotonic()
+            value = self.build(key)
+            with self._lock:
+                # Запись во время построения оставит значение устаревшим (другое поколение);
+                # значение, построенное до сброса без keep_stale или после него более новым
+                # построением, не сохраняется: иначе писатель прочитал бы данные до записи
+                current = self._entries.get(key)
+                if (generation[0] < self._floor_epoch or generation < self._floors.get(key, (0, 0))
+                        or (current is not None and current[2] > generation)):
+                    return value
+                self._entries.pop(key, None)
+                while len(self._entries) >= self.max_entries:
+                    del self._entries[next(iter(self._entries))]
+                self._entries[key] = (value, built_at, generation)
+            return value
+
+        # Читатели после invalidate() не присоединяются к построению, начатому до записи
+        return self.flight.do((key, generation), build)
+
+    def refresh(self, key=None):
+        """Построение в фоне, если значение ключа устарело или сброшено"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is not None and entry[2] == self._generation(key)
+                    and time.monotonic() - entry[1] < self.ttl):
+                return
+        self._refresh_in_background(key)
+
+    def _refresh_in_background(self, key):
+        # Проверка и отметка - под одной блокировкой: параллельные читатели
+        # устаревшего значения запускают одно фоновое обновление, а не по потоку на каждого
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._load(key)
+            except Exception as e:
+                logger.error(f"Ошибка фонового обновления {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        try:
+            threading.Thread(target=refresh, name='stale-refresh', daemon=True).start()
+        except Exception:
+            with self._lock:
+                self._refreshing.discard(key)
+            raise
+
+    def invalidate(self, key=None, keep_stale=False):
+        """Сброс ключа (или всех ключей); keep_stale - отдавать старое значение, пока строится новое"""
+        with self._lock:
+            if key is None:
+                self._epoch += 1
+                if not keep_stale:
+                    self._entries.clear()
+                    self._floor_epoch = self._epoch
+                return
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if not keep_stale:
+                self._entries.pop(key, None)
+                self._floors[key] = self._generation(key)
+
+    def status(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "staleHits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced": self.flight.coalesced
+            }
@@ -0,0 +1,70 @@
+import importlib.util
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sqlite_db
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """Модуль сервера (__main__.py), загруженный один раз; журнал, шина и лог - во временном каталоге"""
+    workdir = tmp_path_factory.mktemp('server')
+    os.environ['ORDER_JOURNAL_PATH'] = str(workdir / 'journal' / 'orders_journal.log')
+    os.environ['CACHE_BUS_DIR'] = str(workdir / 'bus')
+    os.environ['QUERY_BUDGET_STRICT'] = '1'
+    # Ожидающие статуса должны просыпаться по уведомлению, а не по перечитыванию
+    os.environ['ORDER_WAIT_RECHECK_INTERVAL'] = '30'
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        spec = importlib.util.spec_from_file_location('mocktail_server_app', os.path.join(ROOT, '__main__.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+def reset_caches(server):
+    server.catalog.invalidate()
+    server.review_pages.invalidate()
+    server.ingredient_levels.invalidate()
+    server.makeable_cache.invalidate_levels()
+    server.leaderboard.invalidate()
+    server.order_router.invalidate()
+    server.order_cache.clear()
+
+
+def wait_for_journal(server, timeout=10):
+    """Ожидание переноса журнала заказов в БД"""
+    deadline = time.monotonic() + timeout
+    while server.order_journal.status()['pendingEntries']:
+        assert time.monotonic() < deadline, server.order_journal.status()
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def db(server, tmp_path, monkeypatch):
+    """Пустая база SQLite на месте primary (без реплик); возвращает путь к файлу"""
+    path = str(tmp_path / 'mocktail.sqlite')
+    sqlite_db.create_database(path)
+    monkeypatch.setattr(server.db_router, 'connect', sqlite_db.connect)
+    monkeypatch.setattr(server.db_router, 'primary_config', {'database': path})
+    monkeypatch.setattr(server.db_router, 'replica_configs', [])
+    reset_caches(server)
+    yield path
+    # Заказы теста переносятся в его же базу, а не в базу следующего теста
+    wait_for_journal(server)
+    reset_caches(server)
+
+
+@pytest.fixture
+def client(server, db):
+    return server.app.test_client()
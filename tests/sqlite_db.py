@@ -0,0 +1,183 @@
+"""SQLite вместо MySQL для тестов: connect() с интерфейсом mysql.connector.
+
+Запросы сервера переводятся на диалект SQLite: %s, INSERT IGNORE,
+ON DUPLICATE KEY UPDATE, GREATEST/LEAST и FOR UPDATE (SKIP LOCKED).
+"""
+import re
+import sqlite3
+
+_REWRITES = [
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\bINSERT IGNORE\b'), 'INSERT OR IGNORE'),
+    (re.compile(r'\bGREATEST\('), 'MAX('),
+    (re.compile(r'\bLEAST\('), 'MIN('),
+    (re.compile(r'\bFOR UPDATE(?: SKIP LOCKED)?'), ''),
+    (re.compile(r'\bON DUPLICATE KEY UPDATE\b'), 'ON CONFLICT DO UPDATE SET'),
+    (re.compile(r'\bVALUES\((\w+)\)'), r'excluded.\1'),
+]
+
+SCHEMA = """
+CREATE TABLE mocktails (
+    mocktail_id TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT, image_url TEXT,
+    rating REAL DEFAULT 0, review_count INTEGER DEFAULT 0
+);
+CREATE TABLE ingredients (
+    ingredient_id TEXT PRIMARY KEY, name TEXT NOT NULL, current_level REAL, max_level REAL
+);
+CREATE TABLE tags (tag_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL);
+CREATE TABLE mocktail_tags (mocktail_id TEXT, tag_id INTEGER);
+CREATE TABLE mocktail_ingredients (mocktail_id TEXT, ingredient_id TEXT, amount REAL);
+CREATE TABLE orders (
+    order_id TEXT PRIMARY KEY, mocktail_name TEXT, timestamp REAL, status TEXT, total_volume REAL,
+    claimed_by TEXT, lease_expires_at REAL, attempts INTEGER NOT NULL DEFAULT 0,
+    machine_id TEXT NOT NULL DEFAULT 'default', ingredients_json TEXT
+);
+CREATE TABLE order_ingredients (order_id TEXT, ingredient_name TEXT, amount REAL);
+CREATE TABLE reviews (
+    review_id TEXT PRIMARY KEY, mocktail_id TEXT, user_name TEXT, rating REAL, comment TEXT, created_at REAL
+);
+CREATE TABLE machines (machine_id TEXT PRIMARY KEY, name TEXT NOT NULL, active INTEGER NOT NULL DEFAULT 1, created_at REAL);
+CREATE TABLE machine_inventory (
+    machine_id TEXT NOT NULL, ingredient_id TEXT NOT NULL, current_level REAL NOT NULL DEFAULT 0,
+    max_level REAL NOT NULL DEFAULT 1000, PRIMARY KEY (machine_id, ingredient_id)
+);
+CREATE TABLE change_log (
+    version INTEGER PRIMARY KEY AUTOINCREMENT, entity TEXT NOT NULL, entity_id TEXT NOT NULL,
+    op TEXT NOT NULL, data TEXT, created_at REAL NOT NULL
+);
+CREATE TABLE ingredient_level_samples (
+    sample_id INTEGER PRIMARY KEY AUTOINCREMENT, ingredient_id TEXT NOT NULL, ts REAL NOT NULL,
+    level REAL NOT NULL, delta REAL NOT NULL, source_type TEXT NOT NULL, source_id TEXT
+);
+CREATE TABLE ingredient_level_rollups (
+    ingredient_id TEXT NOT NULL, resolution TEXT NOT NULL, bucket_start REAL NOT NULL,
+    min_level REAL NOT NULL, max_level REAL NOT NULL, last_level REAL NOT NULL,
+    consumed REAL NOT NULL DEFAULT 0, refilled REAL NOT NULL DEFAULT 0, samples INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ingredient_id, resolution, bucket_start)
+);
+"""
+
+INGREDIENTS = [
+    ('cranberry', 'Jus de Cranberry', 800, 1000),
+    ('grenadine', 'Sirop de Grenadine', 700, 1000),
+    ('citron', 'Jus de Citron', 600, 1000),
+    ('sprite', 'Sprite', 900, 1000)
+]
+
+
+def translate(sql):
+    for pattern, replacement in _REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class Cursor:
+    def __init__(self, connection, dictionary):
+        self._cursor = connection.cursor()
+        self._dictionary = dictionary
+
+    def execute(self, operation, params=None):
+        self._cursor.execute(translate(operation), tuple(params or ()))
+
+    def executemany(self, operation, seq_params):
+        self._cursor.executemany(translate(operation), [tuple(params) for params in seq_params])
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+
+    def cursor(self, dictionary=False, **kwargs):
+        return Cursor(self._connection, dictionary)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+
+def connect(database, **kwargs):
+    """Как mysql.connector.connect(**config): database - путь к файлу SQLite"""
+    return Connection(database)
+
+
+def create_database(path):
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.executemany("INSERT INTO ingredients VALUES (?, ?, ?, ?)", INGREDIENTS)
+    connection.executemany("INSERT INTO tags (tag_id, name) VALUES (?, ?)", [(1, 'Fruité'), (2, 'Pétillant')])
+    connection.commit()
+    connection.close()
+
+
+def seed_mocktails(path, count):
+    """count коктейлей m0..m{count-1}, у каждого два ингредиента и тег"""
+    connection = sqlite3.connect(path)
+    for table in ('mocktails', 'mocktail_ingredients', 'mocktail_tags'):
+        connection.execute(f"DELETE FROM {table}")
+    for i in range(count):
+        mocktail_id = f"m{i}"
+        connection.execute("INSERT INTO mocktails VALUES (?, ?, ?, '', 0, 0)",
+                           (mocktail_id, f"Mocktail {i}", f"Description {i}"))
+        connection.executemany("INSERT INTO mocktail_ingredients VALUES (?, ?, ?)",
+                               [(mocktail_id, 'sprite', 100), (mocktail_id, 'cranberry', 50)])
+        connection.execute("INSERT INTO mocktail_tags VALUES (?, ?)", (mocktail_id, 1 + i % 2))
+    connection.commit()
+    connection.close()
+
+
+
+def seed_orders(path, count):
+    """count завершённых заказов o0..o{count-1} с ingredients_json"""
+    connection = sqlite3.connect(path)
+    connection.execute("DELETE FROM orders")
+    connection.executemany("""
+    INSERT INTO orders (order_id, mocktail_name, timestamp, status, total_volume, ingredients_json)
+    VALUES (?, ?, ?, 'completed', 150, '{"Sprite":100,"Jus de Cranberry":50}')
+    """, [(f"o{i}", f"Mocktail {i}", 1000.0 + i) for i in range(count)])
+    connection.commit()
+    connection.close()
+
+
+def seed_reviews(path, mocktail_id, count):
+    """count отзывов r0..r{count-1} о коктейле mocktail_id"""
+    connection = sqlite3.connect(path)
+    connection.execute("DELETE FROM reviews")
+    connection.executemany("INSERT INTO reviews VALUES (?, ?, ?, ?, 'ok', ?)", [
+        (f"r{i}", mocktail_id, f"user{i}", 1 + i % 5, 1000.0 + i) for i in range(count)
+    ])
+    connection.commit()
+    connection.close()
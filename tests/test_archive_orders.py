@@ -0,0 +1,77 @@
+"""Архивация старых заказов порциями: файл-архив, журнал изменений и шина инвалидаций"""
+import gzip
+import json
+import sqlite3
+import time
+
+import pytest
+
+import archive_orders
+import sqlite_db
+
+
+@pytest.fixture
+def archive_db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'mocktail.sqlite')
+    sqlite_db.create_database(path)
+    monkeypatch.setattr(archive_orders.mysql.connector, 'connect', sqlite_db.connect)
+    monkeypatch.setitem(archive_orders.db_config, 'database', path)
+    monkeypatch.setattr(archive_orders, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    published = []
+    monkeypatch.setattr(archive_orders.cache_bus, 'publish', lambda *keys: published.append(keys))
+    return path, published
+
+
+def add_orders(path, orders):
+    connection = sqlite3.connect(path)
+    connection.executemany("""
+    INSERT INTO orders (order_id, mocktail_name, timestamp, status, total_volume, ingredients_json)
+    VALUES (?, 'Mocktail 0', ?, ?, 150, NULL)
+    """, orders)
+    connection.executemany("INSERT INTO order_ingredients VALUES (?, 'Sprite', 150)", [(order[0],) for order in orders])
+    connection.commit()
+    connection.close()
+
+
+def test_old_finished_orders_move_to_file_in_chunks(archive_db, tmp_path):
+    path, published = archive_db
+    old = time.time() - 100 * 86400
+    add_orders(path, [(f"old{i}", old + i, 'completed' if i % 2 else 'cancelled') for i in range(5)] + [
+        ('old-active', old, 'processing'),
+        ('recent', time.time(), 'completed')
+    ])
+
+    assert archive_orders.archive_orders(retention_days=90, mode='file', chunk_size=2, pause=0) == 5
+
+    connection = sqlite3.connect(path)
+    assert sorted(row[0] for row in connection.execute("SELECT order_id FROM orders")) == ['old-active', 'recent']
+    assert connection.execute("SELECT COUNT(*) FROM order_ingredients").fetchone() == (2,)
+    changes = connection.execute("SELECT entity, entity_id, op, data FROM change_log ORDER BY version").fetchall()
+    connection.close()
+    assert changes == [('order', f"old{i}", 'delete', '{"archived":true}') for i in range(5)]
+    # Одно сообщение шины на порцию, после её commit
+    assert published == [
+        (('order', 'old0'), ('order', 'old1')), (('order', 'old2'), ('order', 'old3')), (('order', 'old4'),)
+    ]
+
+    [archive_file] = (tmp_path / 'archive').iterdir()
+    with gzip.open(archive_file, 'rt', encoding='utf-8') as f:
+        archived = [json.loads(line) for line in f]
+    assert [order['order_id'] for order in archived] == [f"old{i}" for i in range(5)]
+    assert all(order['ingredients'] == {'Sprite': 150} for order in archived)
+    assert 'ingredients_json' not in archived[0]
+
+
+def test_nothing_to_archive_leaves_no_file(archive_db, tmp_path):
+    path, published = archive_db
+    add_orders(path, [('recent', time.time(), 'completed')])
+    assert archive_orders.archive_orders(retention_days=90, mode='file', chunk_size=2, pause=0) == 0
+    assert list((tmp_path / 'archive').iterdir()) == []
+    assert published == []
+
+
+def test_large_chunk_is_published_in_several_messages(archive_db, monkeypatch):
+    _, published = archive_db
+    monkeypatch.setattr(archive_orders, 'PUBLISH_BATCH', 2)
+    archive_orders.publish_chunk(['a', 'b', 'c'])
+    assert published == [(('order', 'a'), ('order', 'b')), (('order', 'c'),)]
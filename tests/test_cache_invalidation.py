@@ -0,0 +1,46 @@
+"""Кэши процесса после изменений в других процессах (шина инвалидации)"""
+import sqlite3
+
+import sqlite_db
+from test_db_routing import make_router
+
+
+def test_leaderboard_reload_reads_primary(server, client, db, tmp_path, monkeypatch):
+    sqlite_db.seed_mocktails(db, 1)
+    # Реплика ещё не получила отзыв, из-за которого пришла инвалидация
+    replica = str(tmp_path / 'replica.sqlite')
+    sqlite_db.create_database(replica)
+    connection = sqlite3.connect(replica)
+    connection.executescript("CREATE TABLE replica_lag (seconds REAL); INSERT INTO replica_lag VALUES (0);")
+    connection.close()
+    monkeypatch.setattr(server, 'db_router', make_router(db, [replica]))
+
+    sqlite_db.seed_reviews(db, 'm0', 1)
+    server.apply_remote_invalidation('reviews', 'm0')
+
+    leaderboard = client.get('/mocktails/leaderboard').get_json()['leaderboard']
+    assert [(item['mocktailId'], item['reviewCount']) for item in leaderboard] == [('m0', 1)]
+
+
+def test_leaderboard_invalidated_during_load_stays_unloaded(server):
+    leaderboard = server.leaderboard
+    generation = leaderboard.generation
+    leaderboard.invalidate()
+    leaderboard.load([('m0', 5, 1000.0)], generation)
+    assert not leaderboard.loaded
+
+
+def test_heartbeat_publishes_lease_change(server, client, db, monkeypatch):
+    connection = sqlite3.connect(db)
+    connection.execute("""
+    INSERT INTO orders (order_id, mocktail_name, timestamp, status, total_volume, claimed_by, lease_expires_at)
+    VALUES ('o1', 'Mocktail 0', 1000, 'processing', 150, 'c1', 0)
+    """)
+    connection.commit()
+    connection.close()
+    published = []
+    monkeypatch.setattr(server.cache_bus, 'publish', lambda *keys: published.extend(keys))
+
+    response = client.post('/dispensers/heartbeat', json={'controllerId': 'c1', 'orderIds': ['o1', 'o2']})
+    assert response.get_json()['extended'] == ['o1']
+    assert published == [('order', 'o1')]
@@ -0,0 +1,66 @@
+"""Журнал изменений: выдача по версиям, пропуски незавершённых транзакций и полная синхронизация"""
+import sqlite3
+import time
+
+import change_feed
+import sqlite_db
+
+
+def add_changes(path, versions, created_at):
+    connection = sqlite3.connect(path)
+    connection.executemany("""
+    INSERT INTO change_log (version, entity, entity_id, op, data, created_at)
+    VALUES (?, 'order', ?, 'status', '{"status":"completed"}', ?)
+    """, [(version, f"o{version}", created_at) for version in versions])
+    connection.commit()
+    connection.close()
+
+
+def read(path, since, limit=10, now=None):
+    connection = sqlite_db.connect(path)
+    cursor = connection.cursor(dictionary=True)
+    try:
+        changes, version, resync, has_more = change_feed.read_changes(cursor, since, limit, now)
+        return [change['version'] for change in changes], version, resync, has_more
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def test_changes_after_version(db):
+    add_changes(db, [1, 2, 3], time.time())
+    assert read(db, 1) == ([2, 3], 3, False, False)
+    assert read(db, 0, limit=2) == ([1, 2], 2, False, True)
+    assert read(db, 3) == ([], 3, False, False)
+
+
+def test_gap_waits_for_uncommitted_transaction(db):
+    now = time.time()
+    # Версия 3 выдана транзакции, которая ещё не завершилась
+    add_changes(db, [1, 2, 4, 5], now)
+    assert read(db, 0, now=now) == ([1, 2], 2, False, True)
+    # Спустя GAP_GRACE пропуск считается откатом и пропускается
+    assert read(db, 2, now=now + change_feed.GAP_GRACE + 1) == ([4, 5], 5, False, False)
+
+
+def test_client_behind_retention_or_ahead_needs_resync(db):
+    assert read(db, None) == ([], 0, True, False)
+    add_changes(db, [10, 11], time.time())
+    # Без since - только текущая версия
+    assert read(db, None) == ([], 11, True, False)
+    # Записи после since уже удалены
+    assert read(db, 5) == ([], 11, True, False)
+    assert read(db, 9) == ([10, 11], 11, False, False)
+    # Версия из другой базы (или после восстановления из копии)
+    assert read(db, 12) == ([], 11, True, False)
+
+
+def test_review_write_appears_in_feed(client, db):
+    sqlite_db.seed_mocktails(db, 1)
+    version = client.get('/changes').get_json()['version']
+    client.post('/reviews', json={'mocktailId': 'm0', 'userName': 'guest', 'rating': 4, 'comment': 'ok'})
+
+    body = client.get(f'/changes?since={version}').get_json()
+    assert not body['resyncRequired']
+    assert {(change['entity'], change['op']) for change in body['changes']} >= {('review', 'create')}
+    assert client.get('/changes?since=x').status_code == 400
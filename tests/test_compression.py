@@ -0,0 +1,36 @@
+"""Сжатие ответов: кэш сжатых тел ограничен по байтам и заполняется только повторяющимися ответами"""
+import gzip
+import os
+
+import sqlite_db
+from compression import CompressedBodyCache
+
+
+def test_cache_is_capped_by_total_bytes():
+    cache = CompressedBodyCache(max_bytes=3000)
+    bodies = [os.urandom(1000) for _ in range(4)]
+    for body in bodies:
+        assert gzip.decompress(cache.get_or_compress(body, 'gzip', 6)) == body
+    stats = cache.stats()
+    assert stats['bytes'] <= 3000
+    assert stats['entries'] < 4
+    # Самое старое тело вытеснено, последнее - в кэше
+    cache.get_or_compress(bodies[-1], 'gzip', 6)
+    cache.get_or_compress(bodies[0], 'gzip', 6)
+    assert cache.stats()['hits'] == 1
+
+
+def test_only_snapshot_endpoints_fill_the_cache(server, client, db, monkeypatch):
+    sqlite_db.seed_mocktails(db, 20)
+    sqlite_db.seed_reviews(db, 'm0', 20)
+    monkeypatch.setattr(server, 'compressed_bodies', CompressedBodyCache())
+
+    response = client.get('/reviews/m0', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert server.compressed_bodies.stats()['entries'] == 0
+
+    for _ in range(2):
+        response = client.get('/mocktails', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+    assert server.compressed_bodies.stats()['entries'] == 1
+    assert server.compressed_bodies.stats()['hits'] == 1
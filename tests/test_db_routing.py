@@ -0,0 +1,150 @@
+"""ReplicaRouter с двумя SQLite-базами в роли primary и реплики"""
+import sqlite3
+import time
+
+import pytest
+
+import db_routing
+import sqlite_db
+from conftest import wait_for_journal
+
+
+def create_node(path, role, lag=0):
+    connection = sqlite3.connect(path)
+    connection.executescript(f"""
+    CREATE TABLE node (role TEXT);
+    CREATE TABLE replica_lag (seconds REAL);
+    INSERT INTO node VALUES ('{role}');
+    INSERT INTO replica_lag VALUES ({lag});
+    """)
+    connection.commit()
+    connection.close()
+
+
+def set_lag(path, seconds):
+    connection = sqlite3.connect(path)
+    connection.execute("UPDATE replica_lag SET seconds = ?", (seconds,))
+    connection.commit()
+    connection.close()
+
+
+def sqlite_replica_lag(connection):
+    """Аналог mysql_replica_lag: отставание хранится в таблице реплики"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT seconds FROM replica_lag")
+        return cursor.fetchone()['seconds']
+    finally:
+        cursor.close()
+
+
+def role(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT role FROM node")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        connection.close()
+
+
+@pytest.fixture
+def nodes(tmp_path):
+    primary = str(tmp_path / 'primary.sqlite')
+    replica = str(tmp_path / 'replica.sqlite')
+    create_node(primary, 'primary')
+    create_node(replica, 'replica')
+    return primary, replica
+
+
+def make_router(primary, replicas, connect=sqlite_db.connect, **kwargs):
+    kwargs.setdefault('lag_check_interval', 0)
+    return db_routing.ReplicaRouter({'database': primary}, [{'database': path} for path in replicas],
+                                    connect=connect, lag_probe=sqlite_replica_lag, **kwargs)
+
+
+def test_reads_go_to_replica_writes_to_primary(nodes):
+    primary, replica = nodes
+    router = make_router(primary, [replica])
+    assert role(router.read()) == 'replica'
+    assert role(router.primary()) == 'primary'
+
+
+def test_without_replicas_reads_go_to_primary(nodes):
+    primary, _ = nodes
+    assert role(make_router(primary, []).read()) == 'primary'
+
+
+def test_lagging_replica_falls_back_to_primary(nodes):
+    primary, replica = nodes
+    router = make_router(primary, [replica], max_lag=5)
+    set_lag(replica, 30)
+    assert role(router.read()) == 'primary'
+
+    # Реплика догнала primary: после lag_check_interval чтение снова с неё
+    set_lag(replica, 1)
+    assert role(router.read()) == 'replica'
+
+
+def test_unavailable_replica_falls_back_and_is_skipped(nodes, tmp_path):
+    primary, _ = nodes
+    attempts = []
+
+    def connect(database, **kwargs):
+        attempts.append(database)
+        return sqlite_db.connect(database, **kwargs)
+
+    # sqlite3 не может открыть файл в несуществующем каталоге - как недоступный сервер
+    missing = str(tmp_path / 'missing' / 'replica.sqlite')
+    router = make_router(primary, [missing], connect=connect, retry_after=60)
+    assert role(router.read()) == 'primary'
+    assert role(router.read()) == 'primary'
+    # Недоступная реплика не опрашивается повторно до истечения retry_after
+    assert attempts.count(missing) == 1
+
+
+def test_second_replica_used_when_first_unavailable(nodes, tmp_path):
+    primary, replica = nodes
+    router = make_router(primary, [str(tmp_path / 'missing' / 'replica.sqlite'), replica])
+    assert {role(router.read()) for _ in range(3)} == {'replica'}
+
+
+def test_read_your_writes_for_new_order(nodes):
+    primary, replica = nodes
+    router = make_router(primary, [replica], max_lag=0.2, read_your_writes_window=0.2)
+    router.note_write('order-1')
+    assert role(router.read('order-1')) == 'primary'
+    assert role(router.read('order-2')) == 'replica'
+    assert role(router.read(force_primary=True)) == 'primary'
+
+    time.sleep(0.25)
+    assert role(router.read('order-1')) == 'replica'
+
+
+def test_new_order_status_read_from_primary(server, db, tmp_path, monkeypatch):
+    # Реплика с той же схемой, но без данных: её ответ отличим от ответа primary
+    replica = str(tmp_path / 'replica.sqlite')
+    sqlite_db.create_database(replica)
+    connection = sqlite3.connect(replica)
+    connection.executescript("CREATE TABLE replica_lag (seconds REAL); INSERT INTO replica_lag VALUES (0);")
+    connection.close()
+    router = make_router(db, [replica])
+    monkeypatch.setattr(server, 'db_router', router)
+
+    client = server.app.test_client()
+    response = client.post('/prepare_mocktail', json={
+        'mocktailName': 'Mocktail 0', 'ingredients': {'Sprite': 100}, 'totalVolume': 100
+    })
+    order_id = response.get_json()['orderId']
+    assert 'mocktail_last_write' in response.headers.get('Set-Cookie', '')
+    wait_for_journal(server)
+    server.order_cache.clear()
+
+    # Заказ уже в primary, но ещё не на реплике: чтение по orderId идёт на primary
+    response = server.app.test_client().get(f'/order_status/{order_id}')
+    assert response.status_code == 200
+    assert response.get_json()['order']['order_id'] == order_id
+
+    # Клиент с cookie недавней записи читает /orders с primary, другой клиент - с реплики
+    assert [order['order_id'] for order in client.get('/orders').get_json()['orders']] == [order_id]
+    assert server.app.test_client().get('/orders').get_json()['orders'] == []
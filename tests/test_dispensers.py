@@ -0,0 +1,77 @@
+"""Аренда заказов контроллерами: захват, продление, истечение аренды и завершение"""
+import sqlite3
+import time
+
+import pytest
+
+
+def add_received_orders(path, *order_ids):
+    connection = sqlite3.connect(path)
+    connection.executemany("""
+    INSERT INTO orders (order_id, mocktail_name, timestamp, status, total_volume, ingredients_json)
+    VALUES (?, 'Mocktail 0', ?, 'received', 150, '{"Sprite": 150}')
+    """, [(order_id, 1000 + i) for i, order_id in enumerate(order_ids)])
+    connection.commit()
+    connection.close()
+
+
+def claim(client, controller_id, **fields):
+    response = client.post('/dispensers/claim', json=dict(fields, controllerId=controller_id))
+    assert response.status_code == 200, response.get_json()
+    return [order['order_id'] for order in response.get_json()['orders']]
+
+
+def test_claim_takes_oldest_orders_once(client, db):
+    add_received_orders(db, 'o1', 'o2', 'o3')
+    assert claim(client, 'c1', limit=2) == ['o1', 'o2']
+    assert claim(client, 'c2', limit=2) == ['o3']
+    assert claim(client, 'c2') == []
+
+
+def test_expired_lease_is_claimed_again(client, db):
+    add_received_orders(db, 'o1')
+    assert claim(client, 'c1', leaseSeconds=0.05) == ['o1']
+    assert claim(client, 'c2') == []
+    time.sleep(0.1)
+    assert claim(client, 'c2') == ['o1']
+
+    # Контроллер с истёкшей арендой больше не может ни продлить, ни завершить заказ
+    response = client.post('/dispensers/heartbeat', json={'controllerId': 'c1', 'orderIds': ['o1']})
+    assert response.get_json()['lost'] == ['o1']
+    response = client.post('/dispensers/complete', json={
+        'controllerId': 'c1', 'results': [{'orderId': 'o1', 'status': 'completed'}]
+    })
+    assert response.get_json()['rejected'] == ['o1']
+
+
+def test_heartbeat_keeps_lease(client, db):
+    add_received_orders(db, 'o1')
+    assert claim(client, 'c1', leaseSeconds=0.2) == ['o1']
+    time.sleep(0.1)
+    response = client.post('/dispensers/heartbeat', json={'controllerId': 'c1', 'orderIds': ['o1'], 'leaseSeconds': 60})
+    assert response.get_json()['extended'] == ['o1']
+    time.sleep(0.15)
+    assert claim(client, 'c2') == []
+
+
+def test_complete_finishes_owned_orders(client, db):
+    add_received_orders(db, 'o1', 'o2')
+    assert claim(client, 'c1', limit=2) == ['o1', 'o2']
+    response = client.post('/dispensers/complete', json={'controllerId': 'c1', 'results': [
+        {'orderId': 'o1', 'status': 'completed'}, {'orderId': 'o2', 'status': 'cancelled'}
+    ]})
+    assert response.get_json()['accepted'] == ['o1', 'o2']
+    assert client.get('/order_status/o1').get_json()['order']['status'] == 'completed'
+    assert client.get('/order_status/o2').get_json()['order']['status'] == 'cancelled'
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/dispensers/heartbeat', {'controllerId': 'c1', 'orderIds': 'o1'}),
+    ('/dispensers/heartbeat', {'controllerId': 'c1', 'orderIds': [{'id': 'o1'}]}),
+    ('/dispensers/heartbeat', {'controllerId': 'c1', 'orderIds': [True]}),
+    ('/dispensers/complete', {'controllerId': 'c1', 'results': ['x']}),
+    ('/dispensers/complete', {'controllerId': 'c1', 'results': {'orderId': 'o1', 'status': 'completed'}}),
+    ('/dispensers/complete', {'controllerId': 'c1', 'results': [{'orderId': ['o1'], 'status': 'completed'}]}),
+])
+def test_malformed_lease_requests_are_rejected(client, db, path, body):
+    assert client.post(path, json=body).status_code == 400
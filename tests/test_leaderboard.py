@@ -0,0 +1,63 @@
+"""Рейтинг коктейлей: байесовское среднее, затухание и инкрементальные изменения"""
+import time
+
+import pytest
+
+import sqlite_db
+from leaderboard import DAY, Leaderboard
+
+
+def ranking(board, variant='bayesian'):
+    return [mocktail_id for mocktail_id, _, _, _ in board.top(10, variant)]
+
+
+def test_many_good_reviews_beat_a_single_perfect_one():
+    board = Leaderboard(prior_weight=5, prior_mean=3)
+    now = time.time()
+    board.load([('single', 5, now)] + [('many', 4.5, now)] * 20 + [('bad', 1, now)] * 3)
+    assert ranking(board) == ['many', 'single', 'bad']
+    mocktail_id, score, count, mean = board.top(1)[0]
+    assert (mocktail_id, count, mean) == ('many', 20, 4.5)
+    assert score == pytest.approx((5 * 3 + 20 * 4.5) / 25)
+
+
+def test_decayed_variant_prefers_recent_reviews():
+    board = Leaderboard(prior_weight=1, prior_mean=3, decay_half_lives={'hot': 7})
+    now = time.time()
+    board.load([('old', 5, now - 60 * DAY)] * 10 + [('new', 4, now)] * 3)
+    assert ranking(board) == ['old', 'new']
+    assert ranking(board, 'hot') == ['new', 'old']
+
+
+def test_incremental_changes_match_full_load():
+    now = time.time()
+    board = Leaderboard(prior_weight=2, decay_half_lives={'hot': 7})
+    board.load([('a', 5, now), ('b', 3, now)])
+    board.add('b', 5, now - DAY)
+    board.update('a', 5, 1, now)
+    board.remove('b', 3, now)
+
+    expected = Leaderboard(prior_weight=2, prior_mean=board.prior_mean, decay_half_lives={'hot': 7})
+    expected.load([('a', 1, now), ('b', 5, now - DAY)])
+    for variant in ('bayesian', 'hot'):
+        assert [(m, pytest.approx(s), c) for m, s, c, _ in board.top(10, variant)] == \
+            [(m, pytest.approx(s), c) for m, s, c, _ in expected.top(10, variant)]
+
+
+@pytest.mark.parametrize('rating', [0, 6, 'five', None, [4]])
+def test_review_with_invalid_rating_is_rejected(client, db, rating):
+    sqlite_db.seed_mocktails(db, 1)
+    response = client.post('/reviews', json={'mocktailId': 'm0', 'userName': 'guest', 'rating': rating, 'comment': 'ok'})
+    assert response.status_code == 400
+    assert client.get('/mocktails/leaderboard').get_json()['leaderboard'] == []
+
+
+def test_new_review_updates_loaded_leaderboard(client, db):
+    sqlite_db.seed_mocktails(db, 2)
+    sqlite_db.seed_reviews(db, 'm0', 1)
+    assert [item['mocktailId'] for item in client.get('/mocktails/leaderboard').get_json()['leaderboard']] == ['m0']
+
+    response = client.post('/reviews', json={'mocktailId': 'm1', 'userName': 'guest', 'rating': '5', 'comment': 'ok'})
+    assert response.status_code == 200
+    leaderboard = client.get('/mocktails/leaderboard').get_json()['leaderboard']
+    assert [(item['mocktailId'], item['reviewCount']) for item in leaderboard] == [('m1', 1), ('m0', 1)]
@@ -0,0 +1,98 @@
+import sqlite3
+import threading
+
+import pytest
+
+import sqlite_db
+from machines import UnknownMachineError
+from makeable import MakeableCache
+
+MOCKTAILS = [{'mocktail_id': 'm0', 'name': 'Mocktail 0', 'ingredients': {'Sprite': 100, 'Jus de Cranberry': 50}}]
+
+
+class StaticCatalog:
+    def get(self):
+        return 1, MOCKTAILS
+
+
+def test_result_from_levels_replaced_during_load_is_not_cached():
+    levels = [{'default': {'Sprite': 1000, 'Jus de Cranberry': 500}}]
+    cache = None
+
+    def load_levels():
+        current = dict(levels[0])
+        if len(levels) == 1:
+            # Заказ списал ингредиенты, пока шла загрузка
+            levels.append({'default': {'Sprite': 0, 'Jus de Cranberry': 0}})
+            levels.pop(0)
+            cache.invalidate_levels()
+        return current
+
+    cache = MakeableCache(StaticCatalog(), load_levels)
+    assert cache.get([150]) == {'m0': {150: 10}}
+    # Устаревший результат не сохранён под новой версией уровней
+    assert cache.get([150]) == {'m0': {150: 0}}
+
+
+def test_invalidate_does_not_wait_for_load():
+    loading = threading.Event()
+    release = threading.Event()
+
+    def load_levels():
+        loading.set()
+        release.wait(5)
+        return {'default': {'Sprite': 1000, 'Jus de Cranberry': 500}}
+
+    cache = MakeableCache(StaticCatalog(), load_levels)
+    reader = threading.Thread(target=cache.get, args=([150],))
+    reader.start()
+    try:
+        assert loading.wait(5)
+        invalidated = threading.Thread(target=cache.invalidate_levels)
+        invalidated.start()
+        invalidated.join(1)
+        assert not invalidated.is_alive()
+    finally:
+        release.set()
+        reader.join(5)
+
+
+def test_servings_per_machine_and_for_all_machines():
+    levels = {'default': {'Sprite': 100, 'Jus de Cranberry': 50}, 'bar': {'Sprite': 300, 'Jus de Cranberry': 150}}
+    cache = MakeableCache(StaticCatalog(), lambda: levels)
+    assert cache.get([150]) == {'m0': {150: 1}}
+    assert cache.get([150], 'bar') == {'m0': {150: 3}}
+    assert cache.get([150], 'all') == {'m0': {150: 4}}
+    with pytest.raises(UnknownMachineError):
+        cache.get([150], 'missing')
+
+
+def add_machine(path, machine_id, levels):
+    connection = sqlite3.connect(path)
+    connection.execute("INSERT INTO machines VALUES (?, ?, 1, 0)", (machine_id, machine_id))
+    connection.executemany("INSERT INTO machine_inventory VALUES (?, ?, ?, 1000)",
+                           [(machine_id, ingredient_id, level) for ingredient_id, level in levels.items()])
+    connection.execute("UPDATE ingredients SET current_level = 0 WHERE ingredient_id = 'sprite'")
+    connection.commit()
+    connection.close()
+
+
+def test_makeable_endpoints_consider_all_machines(client, db):
+    sqlite_db.seed_mocktails(db, 2)
+    # На машине по умолчанию нет Sprite, на второй машине - есть
+    add_machine(db, 'bar', {'sprite': 1000, 'cranberry': 500})
+
+    def makeable(query):
+        body = client.get(f'/mocktails/makeable?totalVolume=150{query}').get_json()
+        return {item['mocktailId']: item['volumes']['150']['makeable'] for item in body['mocktails']}
+
+    assert makeable('') == {'m0': True, 'm1': True}
+    assert makeable('&machineId=all') == {'m0': True, 'm1': True}
+    assert makeable('&machineId=default') == {'m0': False, 'm1': False}
+    assert makeable('&machineId=bar') == {'m0': True, 'm1': True}
+    assert client.get('/mocktails/makeable?machineId=missing').status_code == 400
+
+    similar = client.get('/mocktails/m0/similar?makeable=1&totalVolume=150').get_json()['similar']
+    assert [item['mocktailId'] for item in similar] == ['m1']
+    similar = client.get('/mocktails/m0/similar?makeable=1&totalVolume=150&machineId=default').get_json()['similar']
+    assert similar == []
@@ -0,0 +1,339 @@
+import json
+import os
+import sqlite3
+
+import mysql.connector
+import pytest
+
+from conftest import wait_for_journal
+from order_journal import OrderJournal, RecordNotReady
+
+
+def order_record(order_id, **fields):
+    order = {'order_id': order_id, 'mocktail_name': 'Mocktail 0', 'timestamp': 1000.0, 'status': 'processing',
+             'total_volume': 150, 'ingredients': {'Sprite': 100}, 'machine_id': 'default'}
+    order.update(fields)
+    return order
+
+
+class FakeDatabase:
+    """apply_batch, который переносит записи в список; bad - заказы с ошибкой в данных"""
+
+    def __init__(self, bad=(), unavailable=False):
+        self.bad = set(bad)
+        self.unavailable = unavailable
+        self.applied = []
+
+    def apply_batch(self, records):
+        if self.unavailable:
+            raise ConnectionError("database is down")
+        for record in records:
+            if record['order_id'] in self.bad:
+                raise TypeError("unsupported operand type(s) for -: 'float' and 'str'")
+        self.applied.extend(record['order_id'] for record in records)
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'orders_journal.log')
+
+
+def test_bad_record_is_rejected_and_later_orders_replayed(journal_path):
+    database = FakeDatabase(bad={'bad'})
+    journal = OrderJournal(journal_path, database.apply_batch)
+    for order_id in ('first', 'bad', 'after'):
+        journal.append('order', order_id, order=order_record(order_id))
+
+    while journal.replay_once():
+        pass
+
+    assert database.applied == ['first', 'after']
+    status = journal.status()
+    assert status['pendingEntries'] == 0
+    assert status['rejectedEntries'] == 1
+    with open(journal.rejected_path) as f:
+        rejected = [json.loads(line) for line in f]
+    assert [entry['record']['order_id'] for entry in rejected] == ['bad']
+    assert rejected[0]['error'].startswith('TypeError')
+
+
+def test_transient_error_keeps_records_pending(journal_path):
+    database = FakeDatabase(unavailable=True)
+    journal = OrderJournal(journal_path, database.apply_batch)
+    journal.append('order', 'o1', order=order_record('o1'))
+
+    with pytest.raises(ConnectionError):
+        journal.replay_once()
+    assert journal.status()['pendingEntries'] == 1
+    assert journal.pending_order('o1')['status'] == 'processing'
+
+    database.unavailable = False
+    assert journal.replay_once() == 1
+    assert database.applied == ['o1']
+
+
+@pytest.mark.parametrize('order', [
+    {'mocktailName': 'x', 'ingredients': {'Sprite': '50'}, 'totalVolume': 50},
+    {'mocktailName': 'x', 'ingredients': {'Sprite': -5}, 'totalVolume': 50},
+    {'mocktailName': 'x', 'ingredients': {'Sprite': True}, 'totalVolume': 50},
+    {'mocktailName': 'x', 'ingredients': {}, 'totalVolume': 50},
+    {'mocktailName': 'x', 'ingredients': ['Sprite'], 'totalVolume': 50},
+    {'mocktailName': 'x', 'ingredients': {'Sprite': 50}, 'totalVolume': '50'},
+    {'mocktailName': '', 'ingredients': {'Sprite': 50}, 'totalVolume': 50},
+])
+def test_invalid_order_rejected_before_journal(server, client, order):
+    pending = server.order_journal.status()['lastSeq']
+    response = client.post('/prepare_mocktail', json=order)
+    assert response.status_code == 400
+    assert server.order_journal.status()['lastSeq'] == pending
+
+
+def test_bad_journal_record_does_not_block_replay(server, client, db):
+    # Запись с ошибкой в данных (например, из журнала версии без проверки) - в обход /prepare_mocktail
+    server.order_journal.append('order', 'bad-order', order=order_record('bad-order', ingredients={'Sprite': '50'}))
+    order_id = client.post('/prepare_mocktail', json={
+        'mocktailName': 'Mocktail 0', 'ingredients': {'Sprite': 100}, 'totalVolume': 100
+    }).get_json()['orderId']
+    wait_for_journal(server)
+
+    connection = sqlite3.connect(db)
+    stored = [row[0] for row in connection.execute("SELECT order_id FROM orders")]
+    level = connection.execute("SELECT current_level FROM ingredients WHERE name = 'Sprite'").fetchone()[0]
+    connection.close()
+    assert stored == [order_id]
+    assert level == 800
+    assert server.order_journal.status()['rejectedEntries'] >= 1
+
+
+def in_child_process(target):
+    """Запуск target в дочернем процессе (fork); процесс завершается без переноса журнала"""
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            target()
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+def test_each_process_has_own_journal(journal_path):
+    in_child_process(lambda: OrderJournal(journal_path, FakeDatabase().apply_batch)
+                     .append('order', 'child', order=order_record('child')))
+
+    database = FakeDatabase()
+    journal = OrderJournal(journal_path, database.apply_batch)
+    journal.append('order', 'parent', order=order_record('parent'))
+
+    # Журнал завершившегося процесса перенят целиком, seq не пересекаются
+    assert journal.status()['file'] == f"{journal_path}.{os.getpid()}"
+    assert journal.status()['adoptedEntries'] == 1
+    assert journal.status()['lastSeq'] == 2
+    assert os.listdir(os.path.dirname(journal_path)) == [os.path.basename(journal.file_path)]
+    while journal.replay_once():
+        pass
+    assert database.applied == ['child', 'parent']
+
+
+def test_live_process_journal_is_not_adopted(journal_path):
+    ready_read, ready_write = os.pipe()
+    done_read, done_write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            other = OrderJournal(journal_path, FakeDatabase().apply_batch)
+            other.append('order', 'other', order=order_record('other'))
+            os.write(ready_write, b'1')
+            os.read(done_read, 1)
+        finally:
+            os._exit(0)
+    try:
+        os.read(ready_read, 1)
+        database = FakeDatabase()
+        journal = OrderJournal(journal_path, database.apply_batch)
+        journal.append('status', 'other', status='completed')
+        # Заказ виден из другого процесса, но переносит его процесс-владелец
+        assert journal.find_order('other')['status'] == 'completed'
+        assert journal.pending_order('other') is None
+        assert journal.status()['adoptedEntries'] == 0
+    finally:
+        os.write(done_write, b'1')
+        os.waitpid(pid, 0)
+    journal._adopt_orphans()
+    assert journal.status()['adoptedEntries'] == 1
+    # Статус записан позже заказа, хотя в своём журнале он раньше перенятого заказа
+    assert journal.pending_order('other')['status'] == 'completed'
+
+
+def test_legacy_shared_journal_is_adopted(journal_path):
+    with open(journal_path, 'w') as f:
+        for seq, order_id in ((1, 'applied'), (2, 'pending')):
+            record = {'type': 'order', 'order_id': order_id, 'journaled_at': 1000.0, 'seq': seq,
+                      'order': order_record(order_id)}
+            f.write(json.dumps(record) + '\n')
+    with open(journal_path + '.checkpoint', 'w') as f:
+        json.dump({'seq': 1}, f)
+
+    database = FakeDatabase()
+    journal = OrderJournal(journal_path, database.apply_batch)
+    while journal.replay_once():
+        pass
+    assert database.applied == ['pending']
+    assert not os.path.exists(journal_path)
+    assert not os.path.exists(journal_path + '.checkpoint')
+
+
+def test_not_ready_record_does_not_block_later_records(journal_path):
+    ready = set()
+    applied = []
+
+    def apply_batch(records):
+        for record in records:
+            if record['type'] == 'status' and record['order_id'] not in ready:
+                raise RecordNotReady(record['order_id'])
+        applied.extend((record['type'], record['order_id']) for record in records)
+
+    journal = OrderJournal(journal_path, apply_batch, replay_interval=0)
+    journal.append('status', 'foreign', status='completed')
+    journal.append('order', 'own', order=order_record('own'))
+    while journal.replay_once():
+        pass
+    assert applied == [('order', 'own')]
+    assert journal.status()['pendingEntries'] == 1
+
+    ready.add('foreign')
+    assert journal.replay_once() == 1
+    assert applied == [('order', 'own'), ('status', 'foreign')]
+
+
+class StatusDatabase:
+    """apply_batch со статусами заказов; статус из not_ready бросает RecordNotReady"""
+
+    def __init__(self):
+        self.not_ready = set()
+        self.applied = []
+
+    def apply_batch(self, records):
+        for record in records:
+            if record['type'] == 'status' and record['status'] in self.not_ready:
+                raise RecordNotReady(record['order_id'])
+        self.applied.extend((record['order_id'], record.get('status')) for record in records)
+
+
+def test_waiting_record_keeps_order_of_statuses(journal_path):
+    database = StatusDatabase()
+    database.not_ready.add('processing')
+    journal = OrderJournal(journal_path, database.apply_batch, replay_interval=0)
+    journal.append('status', 'foreign', status='processing')
+    journal.append('order', 'own', order=order_record('own'))
+    journal.append('status', 'foreign', status='completed')
+    while journal.replay_once():
+        pass
+    # completed не обгоняет ждущий processing того же заказа
+    assert database.applied == [('own', None)]
+    assert journal.status()['pendingEntries'] == 2
+
+    database.not_ready.clear()
+    while journal.replay_once():
+        pass
+    assert database.applied == [('own', None), ('foreign', 'processing'), ('foreign', 'completed')]
+    assert journal.status()['pendingEntries'] == 0
+
+
+def test_records_applied_past_waiting_record_are_not_replayed_after_restart(journal_path):
+    database = StatusDatabase()
+    database.not_ready.add('processing')
+
+    def run():
+        journal = OrderJournal(journal_path, database.apply_batch, replay_interval=0)
+        journal.append('status', 'foreign', status='processing')
+        journal.append('order', 'own', order=order_record('own'))
+        while journal.replay_once():
+            pass
+
+    in_child_process(run)
+    database.not_ready.clear()
+    restarted = OrderJournal(journal_path, database.apply_batch)
+    while restarted.replay_once():
+        pass
+    # 'own' перенесён до перезапуска (в дочернем процессе): после него - только ждавший статус
+    assert database.applied == [('foreign', 'processing')]
+
+
+def test_order_from_another_process_is_visible_and_updatable(server, client, db):
+    in_child_process(lambda: server.order_journal.append('order', 'foreign', order=order_record(
+        'foreign', mocktail_name='Mocktail 0', ingredients={'Sprite': 100}, total_volume=100)))
+
+    response = client.get('/order_status/foreign')
+    assert response.status_code == 200
+    assert response.get_json()['order']['status'] == 'processing'
+
+    response = client.post('/order_status/update', json={'orderId': 'foreign', 'status': 'completed'})
+    assert response.status_code == 200
+    assert client.get('/order_status/foreign').get_json()['order']['status'] == 'completed'
+
+    # Процесс-владелец завершился: его журнал перенимается, статус переносится после заказа
+    server.order_journal._adopt_orphans()
+    wait_for_journal(server)
+    connection = sqlite3.connect(db)
+    assert connection.execute("SELECT status FROM orders WHERE order_id = 'foreign'").fetchall() == [('completed',)]
+    connection.close()
+
+
+@pytest.fixture
+def database_down(server, monkeypatch):
+    def connect(**config):
+        raise mysql.connector.errors.InterfaceError("Can't connect to MySQL server")
+
+    available = server.db_router.connect
+    monkeypatch.setattr(server.db_router, 'connect', connect)
+    yield
+    server.db_router.connect = available
+    # Перенос после ошибок ждёт с нарастающей паузой - будим его
+    server.order_journal._wakeup.set()
+    wait_for_journal(server)
+
+
+def test_status_from_another_process_overrides_pending_copy(server, client, db, database_down):
+    order_id = client.post('/prepare_mocktail', json={
+        'mocktailName': 'Mocktail 0', 'ingredients': {'Sprite': 100}, 'totalVolume': 100
+    }).get_json()['orderId']
+    in_child_process(lambda: server.order_journal.append('status', order_id, status='completed'))
+    server.order_cache.discard(order_id)
+
+    response = client.get(f'/order_status/{order_id}')
+    assert response.get_json()['order']['status'] == 'completed'
+    # Статус дочернего процесса переносится в базу этого теста
+    server.order_journal._adopt_orphans()
+
+
+def test_order_from_another_process_updatable_while_database_down(server, client, db, database_down):
+    in_child_process(lambda: server.order_journal.append('order', 'foreign-down', order=order_record(
+        'foreign-down', mocktail_name='Mocktail 0', ingredients={'Sprite': 100}, total_volume=100)))
+
+    response = client.get('/order_status/foreign-down')
+    assert response.status_code == 200
+    assert response.get_json()['order']['status'] == 'processing'
+
+    response = client.post('/order_status/update', json={'orderId': 'foreign-down', 'status': 'completed'})
+    assert response.status_code == 200
+    assert client.get('/order_status/foreign-down').get_json()['order']['status'] == 'completed'
+
+    assert client.get('/order_status/missing').status_code == 500
+    server.order_journal._adopt_orphans()
+
+
+def test_cached_order_has_database_shape(server, client, db):
+    order_id = client.post('/prepare_mocktail', json={
+        'mocktailName': 'Mocktail 0', 'ingredients': {'Sprite': 100}, 'totalVolume': 100
+    }).get_json()['orderId']
+    cached = client.get(f'/order_status/{order_id}').get_json()['order']
+    assert (cached['claimed_by'], cached['lease_expires_at'], cached['attempts']) == (None, None, 0)
+
+    wait_for_journal(server)
+    server.order_cache.clear()
+    stored = client.get(f'/order_status/{order_id}').get_json()['order']
+    assert set(cached) == set(stored)
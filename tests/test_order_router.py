@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from machines import DEFAULT_MACHINE_ID, OrderRouter
+
+
+def state(**levels):
+    return {machine_id: [{'name': 'Sprite', 'currentLevel': level}] for machine_id, level in levels.items()}, {}
+
+
+def wait_loaded(router, timeout=5):
+    deadline = time.monotonic() + timeout
+    while router._loading or router._state is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_route_does_not_wait_for_slow_load():
+    release = threading.Event()
+
+    def load_state():
+        release.wait(5)
+        return state(default=0, bar=500)
+
+    router = OrderRouter(load_state)
+    started = time.monotonic()
+    assert router.route({'Sprite': 100}) == DEFAULT_MACHINE_ID
+    assert time.monotonic() - started < 0.5
+    release.set()
+    wait_loaded(router)
+    assert router.route({'Sprite': 100}) == 'bar'
+
+
+def test_failed_load_backs_off_and_keeps_last_state():
+    calls = []
+    failing = []
+
+    def load_state():
+        calls.append(time.monotonic())
+        if failing:
+            raise ConnectionError("database is down")
+        return state(default=0, bar=500)
+
+    router = OrderRouter(load_state, ttl=0, retry_after=60)
+    router.route({'Sprite': 100})
+    wait_loaded(router)
+
+    failing.append(True)
+    router.invalidate()
+    for _ in range(20):
+        # Последнее известное состояние, а не машина по умолчанию
+        assert router.route({'Sprite': 10}) == 'bar'
+        time.sleep(0.01)
+    # После ошибки - не чаще одной попытки за retry_after
+    assert len(calls) == 2
+
+
+def test_machine_exists():
+    router = OrderRouter(lambda: state(default=0, bar=500))
+    assert router.machine_exists(DEFAULT_MACHINE_ID)
+    assert router.machine_exists('bar') is None
+    wait_loaded(router)
+    assert router.machine_exists('bar') is True
+    assert router.machine_exists('missing') is False
+    # После изменений машин - неизвестно до следующей загрузки
+    router.invalidate()
+    assert router.machine_exists('missing') is None
+
+
+def test_order_for_unknown_machine_is_rejected(server, client, db):
+    order = {'mocktailName': 'Mocktail 0', 'ingredients': {'Sprite': 100}, 'totalVolume': 100}
+    server.order_router.machine_exists('missing')
+    wait_loaded(server.order_router)
+    last_seq = server.order_journal.status()['lastSeq']
+    response = client.post('/prepare_mocktail', json=dict(order, machineId='missing'))
+    assert response.status_code == 400
+    assert server.order_journal.status()['lastSeq'] == last_seq
+
+    response = client.post('/prepare_mocktail', json=dict(order, machineId='default'))
+    assert response.status_code == 200
+    assert response.get_json()['machineId'] == 'default'
+
+
+@pytest.mark.parametrize('machine_id', ['all', 5])
+def test_invalid_machine_id(client, machine_id):
+    response = client.post('/prepare_mocktail', json={
+        'mocktailName': 'Mocktail 0', 'ingredients': {'Sprite': 100}, 'totalVolume': 100, 'machineId': machine_id
+    })
+    assert response.status_code == 400
+
+
+def test_unknown_machine_rejected_while_router_state_is_stale(server, client, db):
+    order = {'mocktailName': 'Mocktail 0', 'ingredients': {'Sprite': 100}, 'totalVolume': 100}
+    connection = sqlite3.connect(db)
+    connection.execute("INSERT INTO machines VALUES ('bar', 'bar', 1, 0)")
+    connection.commit()
+    connection.close()
+    server.order_router.invalidate()
+    last_seq = server.order_journal.status()['lastSeq']
+
+    response = client.post('/prepare_mocktail', json=dict(order, machineId='missing'))
+    assert response.status_code == 400
+    assert server.order_journal.status()['lastSeq'] == last_seq
+
+    # Машина без запасов маршрутизатору не видна - проверка по базе
+    wait_loaded(server.order_router)
+    response = client.post('/prepare_mocktail', json=dict(order, machineId='bar'))
+    assert response.status_code == 200
+    assert response.get_json()['machineId'] == 'bar'
+
+
+def test_levels_of_unknown_machine_are_not_updated(client, db):
+    response = client.post('/ingredients/update', json={'machineId': 'missing', 'updatedLevels': {'sprite': 500}})
+    assert response.status_code == 400
+    connection = sqlite3.connect(db)
+    assert connection.execute("SELECT COUNT(*) FROM machine_inventory").fetchone() == (0,)
+    assert connection.execute("SELECT COUNT(*) FROM change_log").fetchone() == (0,)
+    connection.close()
@@ -0,0 +1,65 @@
+"""Бюджеты SQL-запросов: число запросов обработчика не растёт с объёмом данных"""
+import pytest
+
+import sqlite_db
+from conftest import reset_caches
+
+SIZES = (1, 5, 25)
+
+
+def query_count(server, client, path, warm):
+    # Холодные кэши: считаются запросы к базе, а не попадания в кэш
+    reset_caches(server)
+    warm(server)
+    response = client.get(path)
+    assert response.status_code == 200, response.get_json()
+    return int(response.headers['X-Query-Count'])
+
+
+def assert_constant_query_count(server, client, endpoint, path, seed, warm):
+    counts = {}
+    for size in SIZES:
+        seed(size)
+        counts[size] = query_count(server, client, path, warm)
+    assert max(counts.values()) <= server.QUERY_BUDGETS[endpoint], counts
+    assert len(set(counts.values())) == 1, f"Число запросов растёт с объёмом данных: {counts}"
+
+
+def cold(server):
+    pass
+
+
+@pytest.mark.parametrize('endpoint, path, seed, warm', [
+    ('get_mocktails', '/mocktails', lambda db, size: sqlite_db.seed_mocktails(db, size), cold),
+    ('get_orders', '/orders', lambda db, size: sqlite_db.seed_orders(db, size), cold),
+    ('get_mocktail_reviews', '/reviews/m0', lambda db, size: sqlite_db.seed_reviews(db, 'm0', size), cold),
+])
+def test_query_count_is_constant(server, client, db, endpoint, path, seed, warm):
+    if endpoint == 'get_mocktail_reviews':
+        sqlite_db.seed_mocktails(db, 1)
+    assert_constant_query_count(server, client, endpoint, path, lambda size: seed(db, size), warm)
+
+
+def test_over_budget_request_fails(server, client, db, monkeypatch):
+    sqlite_db.seed_orders(db, 5)
+    monkeypatch.setitem(server.QUERY_BUDGETS, 'get_orders', 0)
+    response = client.get('/orders')
+    assert response.status_code == 500
+    assert not response.get_json()['success']
+
+
+def test_review_page_after_new_review_stays_in_budget(server, client, db):
+    sqlite_db.seed_mocktails(db, 1)
+    sqlite_db.seed_reviews(db, 'm0', 5)
+    server.catalog.get()
+    response = client.post('/reviews', json={
+        'mocktailId': 'Mocktail 0', 'userName': 'guest', 'rating': 4, 'comment': 'ok'
+    })
+    assert response.status_code == 200, response.get_json()
+
+    # Отзыв сбросил каталог, но страница находит коктейль по прежнему снимку
+    response = client.get('/reviews/Mocktail 0?limit=3')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['total'] == 6
+    assert len(response.get_json()['reviews']) == 3
+    assert int(response.headers['X-Query-Count']) == 2
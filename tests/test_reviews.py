@@ -0,0 +1,67 @@
+"""Страницы отзывов: keyset-курсоры и сброс кэша страниц при записи"""
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+import sqlite_db
+from reviews_cache import decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize('created_at, expected', [
+    (1700000000.25, 1700000000.25),
+    (Decimal('1700000000.123456'), 1700000000.123456),
+    (1700000000, 1700000000.0),
+    (datetime(2024, 5, 1, 12, 30, 15, 250000), datetime(2024, 5, 1, 12, 30, 15, 250000)),
+])
+def test_cursor_round_trip(created_at, expected):
+    cursor = encode_cursor({'created_at': created_at, 'review_id': 'r~1'})
+    assert decode_cursor(cursor) == (expected, 'r~1')
+
+
+@pytest.mark.parametrize('cursor', ['', '1000.0', '~r1', 'yesterday~r1'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def read_all_pages(client, mocktail_id, limit):
+    reviews, cursor = [], None
+    while True:
+        query = f"limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+        body = client.get(f'/reviews/{mocktail_id}?{query}').get_json()
+        reviews += [review['review_id'] for review in body['reviews']]
+        cursor = body['nextCursor']
+        if cursor is None:
+            return reviews, body['total']
+
+
+def test_pages_cover_all_reviews_once(client, db):
+    sqlite_db.seed_mocktails(db, 1)
+    sqlite_db.seed_reviews(db, 'm0', 7)
+    # Отзывы с одинаковым created_at упорядочиваются по review_id
+    connection = sqlite3.connect(db)
+    connection.executemany("INSERT INTO reviews VALUES (?, 'm0', 'same', 5, 'ok', 1003.0)", [('r3a',), ('r3b',)])
+    connection.commit()
+    connection.close()
+
+    reviews, total = read_all_pages(client, 'm0', 2)
+    assert total == 9
+    assert reviews == ['r6', 'r5', 'r4', 'r3b', 'r3a', 'r3', 'r2', 'r1', 'r0']
+
+
+def test_new_review_resets_cached_pages(client, db):
+    sqlite_db.seed_mocktails(db, 1)
+    sqlite_db.seed_reviews(db, 'm0', 3)
+    assert client.get('/reviews/m0?limit=2').get_json()['total'] == 3
+
+    response = client.post('/reviews', json={'mocktailId': 'm0', 'userName': 'guest', 'rating': 5, 'comment': 'new'})
+    review_id = response.get_json()['reviewId']
+    body = client.get('/reviews/m0?limit=2').get_json()
+    assert body['total'] == 4
+    assert body['reviews'][0]['review_id'] == review_id
+
+
+def test_malformed_cursor_is_rejected(client, db):
+    assert client.get('/reviews/m0?limit=2&cursor=garbage').status_code == 400
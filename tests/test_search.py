@@ -0,0 +1,73 @@
+"""Фасетный поиск по каталогу: фильтры, текст, сортировки и фасеты"""
+import sqlite3
+
+import sqlite_db
+from search_index import MocktailSearchIndex
+
+
+def mocktail(mocktail_id, name, tags, ingredients, rating=0.0, review_count=0, description=''):
+    return {'mocktail_id': mocktail_id, 'name': name, 'description': description, 'tags': tags,
+            'ingredients': dict.fromkeys(ingredients, 50), 'rating': rating, 'review_count': review_count}
+
+
+INDEX = MocktailSearchIndex([
+    mocktail('berry', 'Berry Fizz', ['Fruité', 'Pétillant'], ['Sprite', 'Jus de Cranberry'], 4.5, 10),
+    mocktail('sunset', 'Sunset', ['Fruité'], ['Sirop de Grenadine', 'Jus de Citron'], 4.8, 2,
+             description='Grenadine et citron pressé'),
+    mocktail('lemon', 'Lemon Spritz', ['Pétillant'], ['Sprite', 'Jus de Citron'], 3.9, 30),
+])
+
+
+def ids(result):
+    return [m['mocktail_id'] for m in result[1]]
+
+
+def test_filters_combine():
+    assert ids(INDEX.search(tags=['fruite'])) == ['sunset', 'berry']
+    assert ids(INDEX.search(tags=['FRUITÉ', 'petillant'])) == ['berry']
+    assert ids(INDEX.search(include=['sprite'], exclude=['jus de cranberry'])) == ['lemon']
+    assert ids(INDEX.search(min_rating=4.6)) == ['sunset']
+    assert ids(INDEX.search(tags=['unknown'])) == []
+
+
+def test_text_matches_word_prefixes_in_name_and_description():
+    assert ids(INDEX.search(text='spri')) == ['lemon']
+    assert ids(INDEX.search(text='citron pres')) == ['sunset']
+    assert ids(INDEX.search(text='fizz lemon')) == []
+
+
+def test_sorts_and_pages():
+    assert ids(INDEX.search(sort='reviews')) == ['lemon', 'berry', 'sunset']
+    assert ids(INDEX.search(sort='name')) == ['berry', 'lemon', 'sunset']
+    assert ids(INDEX.search(sort='name', descending=True)) == ['sunset', 'lemon', 'berry']
+    total, page, _ = INDEX.search(sort='name', page=2, page_size=2)
+    assert total == 3 and [m['mocktail_id'] for m in page] == ['sunset']
+
+
+def test_facets_count_all_matches_not_only_the_page():
+    total, page, facets = INDEX.search(include=['sprite'], page_size=1)
+    assert (total, len(page)) == (2, 1)
+    assert facets == {
+        'tags': {'Pétillant': 2, 'Fruité': 1},
+        'ingredients': {'Sprite': 2, 'Jus de Cranberry': 1, 'Jus de Citron': 1}
+    }
+
+
+def test_search_endpoint(client, db):
+    sqlite_db.seed_mocktails(db, 3)
+    connection = sqlite3.connect(db)
+    connection.execute("UPDATE mocktails SET rating = 4.5, review_count = 3 WHERE mocktail_id = 'm2'")
+    connection.commit()
+    connection.close()
+
+    body = client.get('/mocktails/search?tags=fruite&sort=rating').get_json()
+    # Теги чередуются: m0 и m2 - 'Fruité', m1 - 'Pétillant'
+    assert (body['total'], [m['mocktail_id'] for m in body['mocktails']]) == (2, ['m2', 'm0'])
+    assert body['facets']['tags'] == {'Fruité': 2}
+
+    body = client.get('/mocktails/search?q=mocktail&minRating=4').get_json()
+    assert [m['mocktail_id'] for m in body['mocktails']] == ['m2']
+
+    assert client.get('/mocktails/search?sort=price').status_code == 400
+    assert client.get('/mocktails/search?order=up').status_code == 400
+    assert client.get('/mocktails/search?page=x').status_code == 400
@@ -0,0 +1,212 @@
+"""Одни и те же контракты маршрутов в режиме WSGI (test_client) и в асинхронном режиме (AsyncWSGIServer)"""
+import asyncio
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import async_server
+import sqlite_db
+
+ORDER = {
+    'mocktailName': 'Mocktail 0',
+    'ingredients': {'Sprite': 100, 'Jus de Cranberry': 50},
+    'totalVolume': 150
+}
+
+
+class WSGIClient:
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, body=None):
+        response = self.app.test_client().open(path, method=method, json=body)
+        return response.status_code, response.get_json()
+
+
+class AsyncClient:
+    """AsyncWSGIServer на случайном порту в отдельном потоке с циклом событий"""
+
+    def __init__(self, app, watch, max_workers=8):
+        self.server = async_server.AsyncWSGIServer(app, host='127.0.0.1', port=0, max_workers=max_workers,
+                                                   watch=watch, recheck_interval=30)
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            listener = self.loop.run_until_complete(
+                asyncio.start_server(self.server.handle_connection, '127.0.0.1', 0))
+            self.port = listener.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+            listener.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait(5)
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        headers = {'Connection': 'close'}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.server.executor.shutdown(wait=False)
+
+
+@pytest.fixture(params=['wsgi', 'async'])
+def http_client(request, server, db):
+    if request.param == 'wsgi':
+        yield WSGIClient(server.app)
+        return
+    client = AsyncClient(server.app, server.order_watch)
+    yield client
+    client.close()
+
+
+def place_order(http_client):
+    status, body = http_client.request('POST', '/prepare_mocktail', ORDER)
+    assert status == 200 and body['success']
+    return body['orderId']
+
+
+def test_mocktails(http_client, db):
+    sqlite_db.seed_mocktails(db, 2)
+    status, body = http_client.request('GET', '/mocktails')
+    assert status == 200
+    assert body['success']
+    assert sorted(mocktail['name'] for mocktail in body['mocktails']) == ['Mocktail 0', 'Mocktail 1']
+    assert body['mocktails'][0]['ingredients'] == {'Sprite': 100, 'Jus de Cranberry': 50}
+
+
+def test_order_lifecycle(http_client):
+    order_id = place_order(http_client)
+
+    status, body = http_client.request('GET', f'/order_status/{order_id}')
+    assert status == 200
+    assert body['order']['status'] == 'processing'
+    assert body['order']['ingredients'] == ORDER['ingredients']
+
+    status, body = http_client.request('POST', '/order_status/update', {'orderId': order_id, 'status': 'completed'})
+    assert status == 200 and body['success']
+    status, body = http_client.request('GET', f'/order_status/{order_id}')
+    assert body['order']['status'] == 'completed'
+
+
+def test_order_errors(http_client):
+    status, body = http_client.request('POST', '/prepare_mocktail', {'mocktailName': 'x'})
+    assert status == 400 and not body['success']
+    status, body = http_client.request('GET', '/order_status/missing')
+    assert status == 404 and not body['success']
+    status, body = http_client.request('POST', '/order_status/update', {'orderId': 'missing', 'status': 'completed'})
+    assert status == 404
+
+
+def test_wait_returns_when_status_differs(http_client):
+    order_id = place_order(http_client)
+    started = time.monotonic()
+    status, body = http_client.request('GET', f'/order_status/{order_id}/wait?known=received&timeout=10')
+    assert status == 200
+    assert body['order']['status'] == 'processing'
+    assert time.monotonic() - started < 2
+
+
+def test_wait_times_out_with_known_status(http_client):
+    order_id = place_order(http_client)
+    started = time.monotonic()
+    status, body = http_client.request('GET', f'/order_status/{order_id}/wait?known=processing&timeout=0.5')
+    assert status == 200
+    assert body['order']['status'] == 'processing'
+    assert 0.5 <= time.monotonic() - started < 5
+
+
+def test_wait_unknown_order(http_client):
+    status, body = http_client.request('GET', '/order_status/missing/wait?known=processing&timeout=5')
+    assert status == 404
+
+
+def test_wait_wakes_on_status_change(http_client):
+    order_id = place_order(http_client)
+    result = {}
+
+    def wait():
+        result['started'] = time.monotonic()
+        result['response'] = http_client.request('GET', f'/order_status/{order_id}/wait?known=processing&timeout=20')
+        result['finished'] = time.monotonic()
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(0.3)
+    http_client.request('POST', '/order_status/update', {'orderId': order_id, 'status': 'completed'})
+    waiter.join(10)
+
+    status, body = result['response']
+    assert status == 200
+    assert body['order']['status'] == 'completed'
+    # Перечитывание - раз в 30 с (conftest), значит ожидающего разбудило уведомление
+    assert result['finished'] - result['started'] < 5
+
+
+def test_async_waiters_do_not_hold_executor(server, db):
+    client = AsyncClient(server.app, server.order_watch, max_workers=2)
+    try:
+        order_id = place_order(client)
+        waiters = [
+            threading.Thread(target=client.request,
+                             args=('GET', f'/order_status/{order_id}/wait?known=processing&timeout=3'))
+            for _ in range(10)
+        ]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.3)
+
+        # Десять ожидающих при двух потоках пула: обычные запросы обслуживаются сразу
+        started = time.monotonic()
+        status, _ = client.request('GET', f'/order_status/{order_id}')
+        assert status == 200
+        assert time.monotonic() - started < 1
+        assert server.order_watch.waiting() == 10
+
+        for waiter in waiters:
+            waiter.join(10)
+        assert server.order_watch.waiting() == 0
+    finally:
+        client.close()
+
+
+@pytest.mark.parametrize('headers, status', [
+    ('Content-Length: -5', 400),
+    ('Content-Length: abc', 400),
+    ('Content-Length: 2\r\nContent-Length: 3', 400),
+    ('Transfer-Encoding: chunked', 501),
+    (f'Content-Length: {async_server.MAX_BODY_SIZE + 1}', 413),
+])
+def test_async_rejects_unusable_request_bodies(server, db, headers, status):
+    client = AsyncClient(server.app, server.order_watch)
+    try:
+        with socket.create_connection(('127.0.0.1', client.port), timeout=10) as connection:
+            connection.sendall(f'POST /prepare_mocktail HTTP/1.1\r\nHost: test\r\n{headers}\r\n\r\n'.encode('latin-1'))
+            response = connection.makefile('rb').readline()
+        assert response.split()[1] == str(status).encode()
+    finally:
+        client.close()
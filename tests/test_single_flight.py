@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from single_flight import StaleWhileRevalidate
+
+
+class SlowSource:
+    """build, которое можно задержать: первое построение ждёт release"""
+
+    def __init__(self):
+        self.value = 'before'
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def build(self, key):
+        self.calls += 1
+        if self.calls == 1:
+            value = self.value
+            self.started.set()
+            self.release.wait(5)
+            return value
+        return self.value
+
+
+@pytest.mark.parametrize('key', ['k', None])
+def test_build_started_before_hard_invalidation_is_not_stored(key):
+    source = SlowSource()
+    cache = StaleWhileRevalidate(source.build, ttl=60, max_stale=60)
+    old_reader = threading.Thread(target=cache.get, args=(key,))
+    old_reader.start()
+    assert source.started.wait(5)
+
+    # Запись: данные изменены, кэш сброшен, писатель читает своё значение
+    source.value = 'after'
+    cache.invalidate(key)
+    assert cache.get(key) == 'after'
+
+    source.release.set()
+    old_reader.join(5)
+    # Построение, начатое до записи, не затирает новое значение
+    assert cache.get(key) == 'after'
+
+
+def test_build_finished_after_hard_invalidation_is_not_served():
+    source = SlowSource()
+    cache = StaleWhileRevalidate(source.build, ttl=60, max_stale=60)
+    old_reader = threading.Thread(target=cache.get, args=('k',))
+    old_reader.start()
+    assert source.started.wait(5)
+
+    source.value = 'after'
+    cache.invalidate('k')
+    source.release.set()
+    old_reader.join(5)
+    # Значение до записи не отдаётся даже как устаревшее
+    assert cache.get('k') == 'after'
+
+
+def test_concurrent_stale_reads_start_one_refresh():
+    source = SlowSource()
+    cache = StaleWhileRevalidate(source.build, ttl=60, max_stale=60)
+    source.release.set()
+    assert cache.get('k') == 'before'
+    source.calls = 0
+    source.release.clear()
+    source.started.clear()
+    cache.invalidate('k', keep_stale=True)
+    loads = []
+    load = cache._load
+    cache._load = lambda key: loads.append(key) or load(key)
+
+    barrier = threading.Barrier(8)
+
+    def read():
+        barrier.wait()
+        assert cache.get('k') == 'before'
+
+    readers = [threading.Thread(target=read) for _ in range(8)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    assert source.started.wait(5)
+    source.release.set()
+    for thread in threading.enumerate():
+        if thread.name == 'stale-refresh':
+            thread.join(5)
+    assert (len(loads), source.calls) == (1, 1)
+    assert cache.get('k') == 'before'